@@ -0,0 +1,347 @@
+"""Benchmark the dashboard pipeline against synthetic data.
+
+Runs the same ``pipeline.load_*`` functions as ``streamlit_app.py`` (windowed
+streaming fetch -> rollup store -> summary table -> styled table page ->
+Vega-Lite charts) over datasets of increasing size made with ``synthetic.py``
+and reports wall time, peak RSS and output payload bytes per stage.  Every
+dataset starts with an empty result cache and rollup store; ``fetch_cancelled``
+measures how long a fetch takes to stop once its load is cancelled after the
+first window.
+
+    python benchmark.py --datasets 100000x10x30,1000000x50x90 --output results.json
+    python benchmark.py --baseline results.json --threshold 0.25
+    python benchmark.py --compare-sql
+
+Datasets are given as ``QUERIES x WAREHOUSES x DAYS`` and are cached under
+``--data-dir``.  With ``--baseline`` the exit code is 1 if the wall time,
+peak RSS or output bytes of any stage grew by more than ``--threshold``
+compared to the baseline.  ``--compare-sql``
+instead times ``legacy_hourly_utilization_sql`` and ``hourly_utilization_sql``
+on each dataset and checks the latter against a pandas reference.
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import CancelledError
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from charts import metering_chart_spec, utilization_chart_spec
+from data_source import LocalDataSource
+from intervals import HOUR_MS, split_by_hour
+from page_load import SessionLoader
+from pipeline import hourly_rollup, load_metering, load_summary_table, load_utilization_series
+from result_cache import RESULT_CACHE
+from rollup_store import ROLLUP_DIR_ENV
+from synthetic import generate
+from table_view import style_page
+from utilization import (CREDITS_PER_HOUR, HOURLY_KEY, Query, as_datetime, hourly_utilization_sql,
+                         legacy_hourly_utilization_sql)
+
+# Fixed so that cached datasets and date ranges line up between runs.
+END_DATE = datetime.date(2024, 1, 1)
+DEFAULT_DATASETS = '10000x5x7,100000x10x30,1000000x50x90'
+# Per measured metric, the smallest increase counted as a regression;
+# differences below it are mostly noise.
+MIN_REGRESSION = {
+    'seconds': 0.05,
+    'peak_rss_bytes': 16 * 2**20,
+    'output_bytes': 1024,
+}
+
+
+def _reset_peak_rss():
+    # Linux only: writing 5 resets the VmHWM high water mark of this process.
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # Not available on Windows, where /proc is missing too.
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _arrow_bytes(df):
+    # Streamlit ships DataFrames to the browser as Arrow IPC streams.
+    table = pa.Table.from_pandas(df)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().size
+
+
+def _vega_bytes(spec):
+    spec = dict(spec)
+    datasets = spec.pop('datasets', {})
+    return len(json.dumps(spec).encode()) + sum(_arrow_bytes(df) for df in datasets.values())
+
+
+class StageTimer:
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.results = []
+
+    def run(self, stage, fn, payload=None):
+        """Run ``fn()`` as ``stage``; ``payload(result)`` gives its output size in bytes."""
+        _reset_peak_rss()
+        started = time.perf_counter()
+        result = fn()
+        seconds = time.perf_counter() - started
+        self.results.append({
+            'dataset': self.dataset,
+            'stage': stage,
+            'seconds': round(seconds, 6),
+            'peak_rss_bytes': _peak_rss(),
+            'output_bytes': payload(result) if payload else None,
+        })
+        return result
+
+
+@contextlib.contextmanager
+def _empty_caches():
+    # Each fetch measured starts from an empty result cache and rollup store.
+    previous = os.environ.get(ROLLUP_DIR_ENV)
+    with tempfile.TemporaryDirectory() as path:
+        os.environ[ROLLUP_DIR_ENV] = path
+        RESULT_CACHE.invalidate()
+        try:
+            yield
+        finally:
+            if previous is None:
+                os.environ.pop(ROLLUP_DIR_ENV)
+            else:
+                os.environ[ROLLUP_DIR_ENV] = previous
+
+
+def _cancelled_fetch(source, start_date, end_date):
+    load = SessionLoader().start('cancelled')
+
+    def cancel_after_first_window():
+        while not load.cancelled:
+            if load.progress()[0]:
+                load.cancel()
+            time.sleep(0.001)
+
+    threading.Thread(target=cancel_after_first_window, daemon=True).start()
+    try:
+        hourly_rollup(source, load, start_date, end_date)
+    except CancelledError:
+        pass
+
+
+def run_pipeline(source, dataset, days):
+    start_date, end_date = END_DATE - datetime.timedelta(days=days), END_DATE
+    range_start = datetime.datetime.combine(start_date, datetime.time())
+    range_end = datetime.datetime.combine(end_date, datetime.time())
+    timer = StageTimer(dataset)
+    with _empty_caches():
+        timer.run('fetch_cancelled', lambda: _cancelled_fetch(source, start_date, end_date))
+    with _empty_caches():
+        load = SessionLoader().start(dataset)
+        timer.run('fetch_summary', lambda: hourly_rollup(source, load, start_date, end_date), _arrow_bytes)
+        RESULT_CACHE.invalidate()
+        timer.run('fetch_stored', lambda: hourly_rollup(source, load, start_date, end_date), _arrow_bytes)
+        RESULT_CACHE.invalidate()
+        df, view = timer.run('summary_table', lambda: load_summary_table(source, load, start_date, end_date),
+                             lambda summary: _arrow_bytes(summary[1].table))
+        timer.run('styler', lambda: style_page(*view.page(view.matches())).to_html(),
+                  lambda html: len(html.encode()))
+        metering = timer.run('fetch_metering', lambda: load_metering(
+            source, load, range_start, range_end, range_start, range_end), lambda m: _arrow_bytes(m[0]))
+        timer.run('vega_lite', lambda: metering_chart_spec(*metering), _vega_bytes)
+        utilization = timer.run('utilization_series', lambda: load_utilization_series(
+            source, load, start_date, end_date, range_start, range_end), lambda u: _arrow_bytes(u[0]))
+        timer.run('utilization_chart', lambda: utilization_chart_spec(*utilization), _vega_bytes)
+    return timer.results
+
+
+def reference_hourly(source, start, end):
+    """What ``hourly_utilization_sql`` should return, computed with pandas.
+
+    Reads the raw views of a ``LocalDataSource`` and splits every query over
+    the hours it ran in with ``intervals.split_by_hour``.
+    """
+    start, end = as_datetime(start), as_datetime(end)
+    queries = source.sql(Query(
+        "SELECT WAREHOUSE_ID, WAREHOUSE_NAME, WAREHOUSE_SIZE, START_TIME, END_TIME, TOTAL_ELAPSED_TIME "
+        "FROM QUERY_HISTORY WHERE WAREHOUSE_SIZE IS NOT NULL AND START_TIME < ? AND END_TIME > ?",
+        (str(end), str(start))))
+    metering = source.sql(Query(
+        "SELECT WAREHOUSE_ID, WAREHOUSE_NAME, START_TIME AS HOUR, CREDITS_USED "
+        "FROM WAREHOUSE_METERING_HISTORY WHERE START_TIME >= ? AND START_TIME < ?",
+        (str(start), str(end))))
+
+    starts = _epoch_ms(queries['START_TIME'])
+    # Queries without a duration still count in the hour they started in.
+    ends = np.maximum(_epoch_ms(queries['END_TIME']), starts + 1)
+    index, hour_ms, duration = split_by_hour(starts, ends)
+    runs = queries.iloc[index].reset_index(drop=True)
+    elapsed = runs['TOTAL_ELAPSED_TIME'].to_numpy() * duration / (ends - starts)[index]
+    size_credits = runs['WAREHOUSE_SIZE'].map(CREDITS_PER_HOUR).fillna(0).to_numpy()
+    runs = runs[['WAREHOUSE_ID', 'WAREHOUSE_NAME', 'WAREHOUSE_SIZE']].assign(
+        HOUR=pd.to_datetime(hour_ms, unit='ms'),
+        NO_OF_QUERIES=(hour_ms == starts[index] // HOUR_MS * HOUR_MS).astype(int),
+        TOTAL_ELAPSED_TIME=elapsed,
+        EXPECTED_CREDITS=elapsed / 1000 / 60 / 60 * size_credits,
+    )
+    runs = runs[(runs['HOUR'] >= start) & (runs['HOUR'] < end)]
+    used = runs.groupby(['HOUR', 'WAREHOUSE_ID', 'WAREHOUSE_NAME', 'WAREHOUSE_SIZE'], as_index=False).agg(
+        {'NO_OF_QUERIES': 'sum', 'TOTAL_ELAPSED_TIME': 'sum', 'EXPECTED_CREDITS': 'sum'})
+    billed = metering.assign(HOUR=pd.to_datetime(metering['HOUR'])).groupby(
+        ['WAREHOUSE_ID', 'HOUR'], as_index=False).agg({'WAREHOUSE_NAME': 'max', 'CREDITS_USED': 'max'})
+    joined = used.merge(billed, on=['WAREHOUSE_ID', 'HOUR'], how='outer', suffixes=('', '_METERED'))
+    joined['WAREHOUSE_NAME'] = joined['WAREHOUSE_NAME'].fillna(joined['WAREHOUSE_NAME_METERED'])
+    return joined.groupby(HOURLY_KEY, as_index=False, dropna=False).agg({
+        'NO_OF_QUERIES': 'sum', 'TOTAL_ELAPSED_TIME': 'sum', 'EXPECTED_CREDITS': 'sum', 'CREDITS_USED': 'max'})
+
+
+def _epoch_ms(times):
+    return pd.to_datetime(times).to_numpy(dtype='datetime64[ms]').astype(np.int64)
+
+
+def compare_sql(source, dataset, days, repeat=3):
+    """Time the legacy and current hourly SQL and check the current one.
+
+    The current SQL is checked against ``reference_hourly``.  Returns
+    ``(results, mismatch)`` where ``mismatch`` is ``None`` if both returned
+    the same rows.
+    """
+    start_date, end_date = END_DATE - datetime.timedelta(days=days), END_DATE
+    results, frames = [], {}
+    for stage, build in (('sql_legacy', legacy_hourly_utilization_sql), ('sql_current', hourly_utilization_sql)):
+        query = build(start_date, end_date)
+        timer = StageTimer(dataset)
+        for _ in range(repeat):
+            frames[stage] = timer.run(stage, lambda: source.sql(query), _arrow_bytes)
+        results.append(min(timer.results, key=lambda r: r['seconds']))
+    expected, current = (frame.assign(HOUR=pd.to_datetime(frame['HOUR']).astype('datetime64[ns]'))
+                         .sort_values(HOURLY_KEY, ignore_index=True)
+                         for frame in (reference_hourly(source, start_date, end_date), frames['sql_current']))
+    try:
+        pd.testing.assert_frame_equal(expected, current, check_dtype=False, rtol=1e-9)
+    except AssertionError as e:
+        return results, str(e)
+    return results, None
+
+
+def dataset_source(data_dir, spec, seed):
+    queries, warehouses, days = (int(part) for part in spec.split('x'))
+    path = os.path.join(data_dir, f'{spec}-seed{seed}')
+    if not os.path.exists(os.path.join(path, 'warehouse_metering_history.parquet')):
+        print(f'generating {spec} in {path}', file=sys.stderr)
+        generate(path, queries, warehouses, days, seed=seed, end_date=END_DATE)
+    return LocalDataSource(path), days
+
+
+def compare(results, baseline, threshold):
+    """Return a description of each stage and metric that regressed against ``baseline``.
+
+    Wall time, peak RSS and output bytes may each grow by ``threshold``.
+    """
+    previous = {(r['dataset'], r['stage']): r for r in baseline['results']}
+    regressions = []
+    for r in results:
+        old = previous.get((r['dataset'], r['stage']))
+        if old is None:
+            continue
+        for metric, min_increase in MIN_REGRESSION.items():
+            before, after = old.get(metric), r.get(metric)
+            if before is None or after is None:
+                continue
+            if after - before > min_increase and after > before * (1 + threshold):
+                unit = '{:.3f}s' if metric == 'seconds' else '{:,.0f} bytes'
+                regressions.append(f"{r['dataset']} {r['stage']} {metric}: "
+                                   f"{unit.format(before)} -> {unit.format(after)}")
+    return regressions
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--datasets', default=DEFAULT_DATASETS,
+                        help="Comma separated QUERIESxWAREHOUSESxDAYS specs (default: %(default)s)")
+    parser.add_argument('--data-dir', default=os.path.join('.benchmark', 'data'))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Write results as JSON to this file")
+    parser.add_argument('--baseline', help="Results JSON from a previous run to compare against")
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help="Allowed growth of each stage metric as a fraction (default: %(default)s)")
+    parser.add_argument('--compare-sql', action='store_true',
+                        help="Compare the legacy and current utilization SQL instead")
+    args = parser.parse_args(argv)
+
+    results = []
+    mismatches = []
+    for spec in args.datasets.split(','):
+        source, days = dataset_source(args.data_dir, spec.strip(), args.seed)
+        if args.compare_sql:
+            timings, mismatch = compare_sql(source, spec.strip(), days)
+            results.extend(timings)
+            if mismatch:
+                mismatches.append(f"{spec.strip()}: {mismatch}")
+        else:
+            results.extend(run_pipeline(source, spec.strip(), days))
+
+    print(f"{'dataset':<22}{'stage':<18}{'seconds':>10}{'peak RSS MB':>14}{'output KB':>12}")
+    for r in results:
+        output_kb = '' if r['output_bytes'] is None else f"{r['output_bytes'] / 1024:,.1f}"
+        print(f"{r['dataset']:<22}{r['stage']:<18}{r['seconds']:>10.3f}"
+              f"{r['peak_rss_bytes'] / 2**20:>14,.1f}{output_kb:>12}")
+
+    report = {
+        'commit': _commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    for line in mismatches:
+        print('MISMATCH ' + line, file=sys.stderr)
+    if mismatches:
+        return 1
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for line in regressions:
+            print('REGRESSION ' + line, file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
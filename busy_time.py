@@ -0,0 +1,129 @@
+"""Concurrency-aware busy time per warehouse cluster and hour.
+
+``SUM(TOTAL_ELAPSED_TIME)`` counts two overlapping queries twice, which can
+push utilization over 100% while the warehouse still sat idle for part of the
+hour.  The busy time computed here is the union of the query intervals on
+each (warehouse, size, cluster), split at hour boundaries, so it never
+exceeds the time the cluster was actually up.
+
+Queries are consumed in chunks that must arrive sorted by ``BUSY_GROUP`` and
+then ``START_TIME`` (``busy_intervals_sql`` does that), so memory depends on
+the chunk size and the number of (cluster, hour) pairs, not on the number of
+queries.
+"""
+import numpy as np
+import pandas as pd
+
+from intervals import merge_intervals, split_by_hour
+from utilization import MAX_QUERY_DURATION, Query, as_datetime
+
+BUSY_GROUP = ['WAREHOUSE_NAME', 'WAREHOUSE_SIZE', 'CLUSTER_NUMBER']
+
+
+def busy_intervals_sql(start, end):
+    """Start and end time of every warehouse query that ran during ``[start, end)``.
+
+    Queries that started up to ``MAX_QUERY_DURATION`` before ``start`` are
+    included if they were still running at ``start``.
+    """
+    start = as_datetime(start)
+    return Query("""SELECT
+            WAREHOUSE_NAME,
+            WAREHOUSE_SIZE,
+            COALESCE(CLUSTER_NUMBER, 0) AS CLUSTER_NUMBER,
+            START_TIME,
+            END_TIME
+        FROM QUERY_HISTORY
+        WHERE WAREHOUSE_SIZE IS NOT NULL
+            AND START_TIME >= ?
+            AND START_TIME < ?
+            AND END_TIME > ?
+        ORDER BY 1,2,3,4
+        """, (str(start - MAX_QUERY_DURATION), str(as_datetime(end)), str(start)))
+
+
+def epoch_ms(series):
+    # Work in the wall clock time the timestamps were returned in, so hours
+    # line up with DATE_TRUNC('HOUR', ...) in the session time zone.
+    if getattr(series.dt, 'tz', None) is not None:
+        series = series.dt.tz_localize(None)
+    return series.values.astype('datetime64[ms]').astype(np.int64)
+
+
+class BusyTimeAccumulator:
+    def __init__(self):
+        self._groups = {}
+        self._group_keys = []
+        self._parts = []
+        self._carry = None
+
+    def add(self, chunk):
+        """Add a sorted chunk of ``busy_intervals_sql`` rows."""
+        if len(chunk) == 0:
+            return
+        starts = epoch_ms(pd.to_datetime(chunk['START_TIME']))
+        ends = epoch_ms(pd.to_datetime(chunk['END_TIME']))
+        groups = self._group_ids([chunk[column].values for column in BUSY_GROUP])
+        if self._carry is not None:
+            # The last run of the previous chunk may continue into this one.
+            group, run_start, run_end = self._carry
+            groups = np.concatenate([[group], groups])
+            starts = np.concatenate([[run_start], starts])
+            ends = np.concatenate([[run_end], ends])
+
+        run_starts, run_ends, run_groups = merge_intervals(starts, ends, groups)
+        self._carry = (run_groups[-1], run_starts[-1], run_ends[-1])
+        self._add_runs(run_starts[:-1], run_ends[:-1], run_groups[:-1])
+
+    def result(self):
+        """Busy milliseconds per (warehouse, size, cluster, hour)."""
+        if self._carry is not None:
+            group, run_start, run_end = self._carry
+            self._add_runs(np.array([run_start]), np.array([run_end]), np.array([group]))
+            self._carry = None
+        columns = BUSY_GROUP + ['HOUR', 'BUSY_MS']
+        if not self._parts:
+            return pd.DataFrame(columns=columns)
+        busy = self._compact()
+        keys = pd.DataFrame(self._group_keys, columns=BUSY_GROUP).iloc[busy['GROUP'].values]
+        keys = keys.reset_index(drop=True)
+        keys['HOUR'] = pd.to_datetime(busy['HOUR'].values, unit='ms')
+        keys['BUSY_MS'] = busy['BUSY_MS'].values
+        return keys[columns]
+
+    def _group_ids(self, columns):
+        # Rows arrive sorted by group, so only the first row of each group
+        # needs a dictionary lookup.
+        n = len(columns[0])
+        changed = np.zeros(n, dtype=bool)
+        changed[0] = True
+        for values in columns:
+            changed[1:] |= values[1:] != values[:-1]
+        first = np.flatnonzero(changed)
+        ids = np.array([self._group_id(tuple(values[i] for values in columns)) for i in first], dtype=np.int64)
+        return np.repeat(ids, np.diff(np.append(first, n)))
+
+    def _group_id(self, key):
+        group = self._groups.get(key)
+        if group is None:
+            group = self._groups[key] = len(self._group_keys)
+            self._group_keys.append(key)
+        return group
+
+    def _add_runs(self, run_starts, run_ends, run_groups):
+        index, hours, durations = split_by_hour(run_starts, run_ends)
+        self._parts.append(pd.DataFrame({'GROUP': run_groups[index], 'HOUR': hours, 'BUSY_MS': durations}))
+        if len(self._parts) >= 64:
+            self._parts = [self._compact()]
+
+    def _compact(self):
+        return (pd.concat(self._parts, ignore_index=True)
+                .groupby(['GROUP', 'HOUR'], as_index=False, sort=False)['BUSY_MS'].sum())
+
+
+def busy_time(chunks):
+    """Busy milliseconds per (warehouse, size, cluster, hour) from sorted chunks."""
+    accumulator = BusyTimeAccumulator()
+    for chunk in chunks:
+        accumulator.add(chunk)
+    return accumulator.result()
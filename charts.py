@@ -0,0 +1,257 @@
+"""Vega-Lite specs for the dashboard charts."""
+
+# Vega-Lite time unit matching each metering bucket in utilization.METERING_BUCKETS.
+BUCKET_TIME_UNITS = {
+    'HOUR': 'utcyearmonthdatehours',
+    'DAY': 'utcyearmonthdate',
+    'WEEK': 'utcyearmonthdate',
+}
+
+
+def metering_chart_spec(overview, detail, overview_bucket='HOUR', detail_bucket='HOUR'):
+    """Overview bar chart over the full range above a per-warehouse heatmap.
+
+    Both frames are already aggregated per (bucket, warehouse) server side and
+    are embedded as named datasets, so ``detail`` can cover a zoomed-in
+    window at a finer bucket than ``overview``.
+    """
+    height = len(detail["WAREHOUSE_NAME"].unique().tolist())*25
+    datasets = {"overview": overview}
+    if detail is not overview:
+        datasets["detail"] = detail
+    return {
+        "$schema": "https://vega.github.io/schema/vega-lite/v5.json",
+        "datasets": datasets,
+        "vconcat": [
+            {
+                "data": {"name": "overview"},
+                "mark": {
+                    "type": "bar",
+                    "tooltip": {
+                        "content": "data"
+                    }
+                },
+                "height": 60,
+                "width": "container",
+                "autosize": {
+                    "type": "fit",
+                    "contains": "padding"
+                },
+                "params": [
+                    {
+                        "name": "brush",
+                        "select": {
+                            "type": "interval",
+                            "encodings": [
+                                "x"
+                            ]
+                        }
+                    }
+                ],
+                "encoding": {
+                    "x": {
+                        "field": "START_TIME",
+                        "axis": None,
+                        "timeUnit": BUCKET_TIME_UNITS[overview_bucket],
+                        "scale": {
+                            "type": "utc"
+                        },
+                        "title": "Time"
+                    },
+                    "y": {
+                        "aggregate": "sum",
+                        "title": "",
+                        "field": "CREDITS_USED"
+                    },
+                    "tooltip": [
+                        {
+                            "field": "START_TIME",
+                            "title": "Day",
+                            "scale": {
+                                "type": "utc"
+                            },
+                            "formatType": "time",
+                            "format": "%m %d, %Y"
+                        },
+                        {
+                            "aggregate": "sum",
+                            "field": "CREDITS_USED",
+                            "title": "Credits",
+                            "format": ",.0f"
+                        }
+                    ]
+                }
+            },
+            {
+                "data": {"name": "detail" if "detail" in datasets else "overview"},
+                "hconcat": [
+                    {
+                        "mark": {
+                            "type": "rect",
+                            "tooltip": {
+                                "content": "data"
+                            }
+                        },
+                        "width": "container",
+                        "autosize": {
+                            "type": "fit",
+                            "contains": "padding"
+                        },
+                        "height": height,
+                        "encoding": {
+                            "x": {
+                                "field": "START_TIME",
+                                "timeUnit": BUCKET_TIME_UNITS[detail_bucket],
+                                "scale": {
+                                    "type": "utc",
+                                    "domain": {
+                                        "param": "brush"
+                                    }
+                                },
+                                "title": "Time"
+                            },
+                            "y": {
+                                "field": "WAREHOUSE_NAME",
+                                "title": "Wahouse Name"
+                            },
+                            "color": {
+                                "field": "CREDITS_USED",
+                                "aggregate": "sum"
+                            },
+                            "tooltip": [
+                                {
+                                    "field": "WAREHOUSE_NAME",
+                                    "title": "Wahouse Name"
+                                },
+                                {
+                                    "field": "START_TIME",
+                                    "title": "Time",
+                                    "formatType": "time",
+                                    "format": "%m %d, %Y"
+                                },
+                                {
+                                    "aggregate": "sum",
+                                    "field": "CREDITS_USED",
+                                    "title": "Credits",
+                                    "format": ",.0f"
+                                }
+                            ]
+                        }
+                    },
+                    {
+                        "mark": {
+                            "type": "bar",
+                            "tooltip": {
+                                "content": "data"
+                            }
+                        },
+                        "width": 60,
+                        "height": height,
+                        "encoding": {
+                            "y": {
+                                "field": "WAREHOUSE_NAME",
+                                "title": "Wahouse Name",
+                                "axis": None
+                            },
+                            "x": {
+                                "aggregate": "sum",
+                                "field": "CREDITS_USED"
+                            },
+                            "tooltip": [
+                                {
+                                    "field": "WAREHOUSE_NAME",
+                                    "title": "Wahouse Name"
+                                },
+                                {
+                                    "aggregate": "sum",
+                                    "field": "CREDITS_USED",
+                                    "title": "Credits",
+                                    "format": ",.0f"
+                                }
+                            ]
+                        }
+                    }
+                ]
+            }
+        ],
+        "config": {
+            "view": {
+                "stroke": "transparent"
+            }
+        }
+    }
+
+
+def utilization_chart_spec(series, bucket='HOUR'):
+    """Utilization per warehouse over time from ``timeseries.utilization_series``."""
+    return {
+        "$schema": "https://vega.github.io/schema/vega-lite/v5.json",
+        "datasets": {"utilization": series},
+        "data": {"name": "utilization"},
+        "mark": {
+            "type": "line",
+            "point": False,
+            "tooltip": True
+        },
+        "width": "container",
+        "height": 300,
+        "autosize": {
+            "type": "fit",
+            "contains": "padding"
+        },
+        "encoding": {
+            "x": {
+                "field": "START_TIME",
+                "type": "temporal",
+                "timeUnit": BUCKET_TIME_UNITS[bucket],
+                "scale": {
+                    "type": "utc"
+                },
+                "title": "Time"
+            },
+            "y": {
+                "field": "UTILIZATION",
+                "type": "quantitative",
+                "title": "Utilization",
+                "axis": {
+                    "format": ".0%"
+                }
+            },
+            "color": {
+                "field": "WAREHOUSE_NAME",
+                "type": "nominal",
+                "title": "Warehouse Name"
+            },
+            "tooltip": [
+                {
+                    "field": "WAREHOUSE_NAME",
+                    "title": "Warehouse Name"
+                },
+                {
+                    "field": "START_TIME",
+                    "type": "temporal",
+                    "title": "Time",
+                    "scale": {
+                        "type": "utc"
+                    },
+                    "formatType": "time",
+                    "format": "%m %d, %Y %H:%M"
+                },
+                {
+                    "field": "UTILIZATION",
+                    "title": "Utilization",
+                    "format": ".0%"
+                },
+                {
+                    "field": "CREDITS_USED",
+                    "title": "Credits",
+                    "format": ",.2f"
+                }
+            ]
+        },
+        "config": {
+            "view": {
+                "stroke": "transparent"
+            }
+        }
+    }
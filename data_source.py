@@ -0,0 +1,331 @@
+"""Where the dashboard reads ``QUERY_HISTORY`` and ``WAREHOUSE_METERING_HISTORY`` from.
+
+``SnowflakeDataSource`` wraps a logged in Snowpark session.  ``LocalDataSource``
+serves the same two views from Parquet files through DuckDB so the dashboard
+and its transforms can be run and measured offline, e.g. against data made by
+``synthetic.py``.
+"""
+import datetime
+import glob
+import os
+import re
+import threading
+from concurrent.futures import CancelledError
+
+from instrumentation import query_tag
+from utilization import Query
+
+
+class QueryJob:
+    """A query that has been issued but whose result has not been read yet."""
+
+    def result(self):
+        """Block until the query finishes and return it as a pandas DataFrame.
+
+        Raises ``concurrent.futures.CancelledError`` if the job was cancelled.
+        """
+        raise NotImplementedError
+
+    def batches(self):
+        """Yield the result as a series of pandas DataFrames.
+
+        Raises ``concurrent.futures.CancelledError`` if the job was cancelled.
+        """
+        raise NotImplementedError
+
+    def cancel(self):
+        raise NotImplementedError
+
+
+class DataSource:
+    """Runs SQL against ``QUERY_HISTORY`` and ``WAREHOUSE_METERING_HISTORY``."""
+
+    @property
+    def identity(self):
+        """Tuple identifying the account/role/database/schema being read."""
+        raise NotImplementedError
+
+    def now(self):
+        """The current time as a naive ``datetime`` in the source's time zone."""
+        raise NotImplementedError
+
+    def time_zone(self):
+        """Name of the source's time zone, e.g. ``'America/Los_Angeles'``."""
+        raise NotImplementedError
+
+    def warehouse_auto_suspends(self, tag=None):
+        """AUTO_SUSPEND in seconds per warehouse name, None for never; empty if unknown."""
+        return {}
+
+    def submit(self, query, tag=None):
+        """Issue ``query`` and return a ``QueryJob`` for its result.
+
+        ``query`` is SQL text or a ``utilization.Query`` with bind variables.
+        ``tag`` is set as the query's ``QUERY_TAG`` where supported.
+        """
+        raise NotImplementedError
+
+    def sql(self, query, tag=None):
+        """Run ``query`` and return the result as a pandas DataFrame."""
+        return self.submit(query, tag).result()
+
+    def iter_batches(self, query, tag=None):
+        """Run ``query`` and yield its result as a series of pandas DataFrames."""
+        yield from self.submit(query, tag).batches()
+
+
+class SnowflakeQueryJob(QueryJob):
+    # ``on_result(query_id)`` is called once the result has been read.  If
+    # reading fails, ``fallback()`` gives the job and ``on_result`` to use
+    # instead.
+    def __init__(self, async_job, on_result=None, fallback=None):
+        self._job = async_job
+        self._on_result = on_result
+        self._fallback = fallback
+        self._cancelled = False
+
+    @property
+    def query_id(self):
+        return self._job.query_id
+
+    def result(self):
+        try:
+            result = self._job.result("pandas")
+        except Exception as e:
+            if self._cancelled:
+                raise CancelledError(f"Query {self.query_id} was cancelled") from e
+            if self._fallback is None:
+                raise
+            self._run_fallback()
+            return self.result()
+        if self._on_result is not None:
+            self._on_result(self.query_id)
+        return result
+
+    def batches(self):
+        try:
+            batches = self._job.result("pandas_batches")
+        except Exception as e:
+            if self._cancelled:
+                raise CancelledError(f"Query {self.query_id} was cancelled") from e
+            if self._fallback is None:
+                raise
+            self._run_fallback()
+            yield from self.batches()
+            return
+        try:
+            yield from batches
+        except Exception as e:
+            if self._cancelled:
+                raise CancelledError(f"Query {self.query_id} was cancelled") from e
+            raise
+        if self._on_result is not None:
+            self._on_result(self.query_id)
+
+    def _run_fallback(self):
+        # The remembered result is gone, run the query itself.
+        (self._job, self._on_result), self._fallback = self._fallback(), None
+
+    def cancel(self):
+        self._cancelled = True
+        self._job.cancel()
+
+
+def _statement_params(tag):
+    return {'QUERY_TAG': tag} if tag else None
+
+
+_QUERY_ID = re.compile(r'^[0-9a-fA-F-]+$')
+
+
+class SnowflakeDataSource(DataSource):
+    """Runs queries on a Snowpark session.
+
+    With ``query_ids`` (a ``ResultCache``, see ``session_pool``) the IDs of
+    finished ``utilization.Query`` queries are remembered, and running the
+    same query again reads the persisted result with ``RESULT_SCAN``
+    instead of using the warehouse.
+    """
+
+    def __init__(self, session, query_ids=None):
+        self.session = session
+        self.query_ids = query_ids
+        self._identity = None
+        self._time_zone = None
+
+    @property
+    def identity(self):
+        # One round trip per session; the identity scopes every cached result.
+        if self._identity is None:
+            row = self.session.sql(
+                "SELECT CURRENT_ACCOUNT(), CURRENT_ROLE(), CURRENT_DATABASE(), CURRENT_SCHEMA()"
+            ).collect(statement_params=_statement_params(query_tag('identity')))[0]
+            self._identity = tuple(row)
+        return self._identity
+
+    def now(self):
+        # Wall clock time in the session time zone, like DATE_TRUNC results.
+        row = self.session.sql("SELECT CURRENT_TIMESTAMP()::TIMESTAMP_NTZ").collect(
+            statement_params=_statement_params(query_tag('now')))[0]
+        return row[0]
+
+    def time_zone(self):
+        if self._time_zone is None:
+            rows = self.session.sql("SHOW PARAMETERS LIKE 'TIMEZONE' IN SESSION").collect(
+                statement_params=_statement_params(query_tag('time_zone')))
+            self._time_zone = rows[0].as_dict()['value']
+        return self._time_zone
+
+    def warehouse_auto_suspends(self, tag=None):
+        rows = self.session.sql("SHOW WAREHOUSES").collect(statement_params=_statement_params(tag))
+        # AUTO_SUSPEND is NULL or 0 for warehouses that never suspend.
+        return {row['name']: int(row['auto_suspend']) if row['auto_suspend'] else None
+                for row in (row.as_dict() for row in rows)}
+
+    def submit(self, query, tag=None):
+        key, query_id = self._remembered(query)
+        if query_id is None:
+            return SnowflakeQueryJob(self._collect_nowait(query, tag), self._remember(key))
+        # The remembered ID keeps its expiry: the RESULT_SCAN's own ID is
+        # not remembered, or a result could be served on and on.
+        return SnowflakeQueryJob(self._collect_nowait(_result_scan(query_id), tag),
+                                 fallback=lambda: self._forget(key, query, tag))
+
+    def _collect_nowait(self, query, tag):
+        if isinstance(query, Query):
+            dataframe = self.session.sql(query.text, params=list(query.params))
+        else:
+            dataframe = self.session.sql(query)
+        return dataframe.collect_nowait(statement_params=_statement_params(tag))
+
+    def _remembered(self, query):
+        if self.query_ids is None or not isinstance(query, Query):
+            return None, None
+        # The same text can read other views under another database/schema.
+        key = self.identity + tuple(query)
+        return key, self.query_ids.get(key)
+
+    def _remember(self, key):
+        def remember(query_id):
+            if key is not None and _QUERY_ID.match(query_id or ''):
+                self.query_ids.put(key, query_id)
+        return remember
+
+    def _forget(self, key, query, tag):
+        self.query_ids.invalidate(key)
+        return self._collect_nowait(query, tag), self._remember(key)
+
+
+def _result_scan(query_id):
+    return f"SELECT * FROM TABLE(RESULT_SCAN('{query_id}'))"
+
+
+# Snowflake functions used by our SQL that DuckDB spells differently.
+_DUCKDB_COMPAT = [
+    """CREATE OR REPLACE MACRO TO_VARCHAR(ts, fmt) AS strftime(ts,
+        replace(replace(replace(replace(replace(replace(replace(fmt,
+            'YYYY', '%Y'), 'MM', '%m'), 'DD', '%d'), 'HH24', '%H'), 'HH', '%H'), 'MI', '%M'), 'SS', '%S'))""",
+    """CREATE OR REPLACE MACRO DATEADD(part, n, ts) AS CAST(ts AS TIMESTAMP) + CASE upper(part)
+        WHEN 'DAY' THEN to_days(CAST(n AS INTEGER))
+        WHEN 'HOUR' THEN to_hours(CAST(n AS BIGINT))
+        WHEN 'MINUTE' THEN to_minutes(CAST(n AS BIGINT))
+        WHEN 'SECOND' THEN to_seconds(CAST(n AS DOUBLE))
+    END""",
+]
+
+
+class LocalQueryJob(QueryJob):
+    # DuckDB runs the query in whichever thread asks for the result.
+    def __init__(self, cursor, query, batch_size=1000000):
+        self._cursor = cursor
+        self._query = query
+        self._batch_size = batch_size
+        self._lock = threading.Lock()
+        self._cancelled = False
+
+    def result(self):
+        with self._lock:
+            if self._cancelled:
+                raise CancelledError("Query was cancelled")
+        try:
+            return self._cursor.execute(*_text_and_params(self._query)).df()
+        except Exception as e:
+            if self._cancelled:
+                raise CancelledError("Query was cancelled") from e
+            raise
+
+    def batches(self):
+        with self._lock:
+            if self._cancelled:
+                raise CancelledError("Query was cancelled")
+        try:
+            reader = self._cursor.execute(*_text_and_params(self._query)).fetch_record_batch(self._batch_size)
+            for batch in reader:
+                yield batch.to_pandas()
+        except Exception as e:
+            if self._cancelled:
+                raise CancelledError("Query was cancelled") from e
+            raise
+
+    def cancel(self):
+        with self._lock:
+            self._cancelled = True
+        self._cursor.interrupt()
+
+
+def _text_and_params(query):
+    if isinstance(query, Query):
+        # Older DuckDB releases (the last ones for Python 3.8) do not cast
+        # VARCHAR parameters to TIMESTAMP like Snowflake does.
+        return query.text, [_timestamp_or_value(value) for value in query.params]
+    return query, None
+
+
+def _timestamp_or_value(value):
+    try:
+        value = datetime.datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return value
+    if value.tzinfo is not None:
+        # Local timestamps are UTC.
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return value
+
+
+TABLES = ('QUERY_HISTORY', 'WAREHOUSE_METERING_HISTORY')
+
+
+class LocalDataSource(DataSource):
+    """Reads ``<path>/<table>*.parquet`` for each of ``TABLES`` via DuckDB.
+
+    Timestamps are stored without a time zone and taken as UTC.
+    """
+
+    def __init__(self, path):
+        try:
+            import duckdb
+        except ImportError:
+            raise ImportError("LocalDataSource requires duckdb, install it with `pip install duckdb`")
+        self.path = os.path.abspath(path)
+        self._conn = duckdb.connect()
+        for statement in _DUCKDB_COMPAT:
+            self._conn.execute(statement)
+        for table in TABLES:
+            pattern = os.path.join(self.path, table.lower() + '*.parquet')
+            if not glob.glob(pattern):
+                raise FileNotFoundError(f"No {table} data found matching {pattern}")
+            self._conn.execute(f"CREATE VIEW {table} AS SELECT * FROM read_parquet('{pattern}')")
+
+    @property
+    def identity(self):
+        return ('local', self.path)
+
+    def now(self):
+        return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+    def time_zone(self):
+        return 'UTC'
+
+    def submit(self, query, tag=None):
+        # A cursor per query makes the source safe to share between threads.
+        return LocalQueryJob(self._conn.cursor(), query)
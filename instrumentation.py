@@ -0,0 +1,144 @@
+"""Named stage timers, byte counters and query tags.
+
+Every ``PageLoad`` records its stages (queries, transforms, rendering) in a
+``StageMetrics``.  Each finished stage is logged as one JSON object on the
+``warehouse_utilization.metrics`` logger and added to the process-wide
+totals in ``PROCESS_METRICS``, which can be written out in the Prometheus
+text format.
+
+Queries are tagged with ``query_tag`` so their compilation and execution
+time can be looked up in ``QUERY_HISTORY`` by ``QUERY_TAG``.
+"""
+import contextlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from utilization import Query
+
+APP_NAME = 'snowflake-warehouse-utilization'
+
+log = logging.getLogger('warehouse_utilization.metrics')
+
+
+def query_tag(stage, **details):
+    """``QUERY_TAG`` for a query issued by ``stage``."""
+    return json.dumps(dict(app=APP_NAME, stage=stage, **details), default=str, separators=(',', ':'))
+
+
+def session_query_timings_sql(load_id):
+    """Snowflake's own timings for this session's queries tagged with ``load_id``."""
+    return Query("""SELECT
+            QUERY_ID,
+            QUERY_TAG,
+            EXECUTION_STATUS,
+            COMPILATION_TIME,
+            QUEUED_OVERLOAD_TIME,
+            EXECUTION_TIME,
+            TOTAL_ELAPSED_TIME,
+            BYTES_SCANNED,
+            ROWS_PRODUCED
+        FROM TABLE(INFORMATION_SCHEMA.QUERY_HISTORY_BY_SESSION(RESULT_LIMIT => 1000))
+        WHERE QUERY_TAG LIKE ?
+        ORDER BY START_TIME
+        """, (f'%"load":"{load_id}"%',))
+
+
+def frame_bytes(df):
+    # Shallow size, string contents are not counted, to keep this cheap for
+    # every batch.
+    return int(df.memory_usage(index=False, deep=False).sum())
+
+
+def configure_json_logging(stream=None):
+    """Write every finished stage as a JSON line to ``stream`` (stderr by default)."""
+    if not any(getattr(handler, '_stage_metrics', False) for handler in log.handlers):
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        handler._stage_metrics = True
+        log.addHandler(handler)
+    log.setLevel(logging.INFO)
+
+
+class ProcessMetrics:
+    """Totals per stage over every load served by this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = {}
+
+    def add(self, record):
+        with self._lock:
+            key = (record['stage'], record.get('query', ''))
+            totals = self._totals.setdefault(key, {'calls': 0, 'errors': 0, 'seconds': 0.0, 'bytes': 0})
+            totals['calls'] += 1
+            totals['errors'] += 'error' in record
+            totals['seconds'] += record['seconds']
+            totals['bytes'] += record.get('bytes', 0)
+
+    def prometheus_text(self):
+        with self._lock:
+            totals = {key: dict(values) for key, values in self._totals.items()}
+        lines = []
+        for metric, help_text in (('calls', 'Stages run'),
+                                  ('errors', 'Stages that raised an exception'),
+                                  ('seconds', 'Wall time spent in each stage'),
+                                  ('bytes', 'Bytes produced by each stage')):
+            name = f'warehouse_utilization_stage_{metric}_total'
+            lines.append(f'# HELP {name} {help_text}.')
+            lines.append(f'# TYPE {name} counter')
+            for (stage, query), values in sorted(totals.items()):
+                labels = f'stage="{stage}",query="{query}"' if query else f'stage="{stage}"'
+                lines.append(f'{name}{{{labels}}} {values[metric]}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        """Atomically write the totals, e.g. for node_exporter's textfile collector."""
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp, path)
+
+
+PROCESS_METRICS = ProcessMetrics()
+
+
+class StageMetrics:
+    def __init__(self, **context):
+        self.context = context
+        self._lock = threading.Lock()
+        self._records = []
+
+    @contextlib.contextmanager
+    def stage(self, name, **details):
+        """Time the ``with`` block as stage ``name``.
+
+        Yields the record, so the block can add counters such as ``bytes``
+        or ``rows`` to it.
+        """
+        record = {'stage': name}
+        record.update(details)
+        started = time.perf_counter()
+        try:
+            yield record
+        except BaseException as e:
+            record['error'] = type(e).__name__
+            raise
+        finally:
+            record['seconds'] = round(time.perf_counter() - started, 6)
+            self.add(record)
+
+    def add(self, record):
+        with self._lock:
+            self._records.append(record)
+        PROCESS_METRICS.add(record)
+        if log.isEnabledFor(logging.INFO):
+            log.info(json.dumps(dict(self.context, **record), default=str))
+
+    def records(self):
+        with self._lock:
+            return list(self._records)
@@ -0,0 +1,65 @@
+"""Vectorized helpers for working with [start, end) time intervals.
+
+Times are int64 epoch milliseconds throughout.
+"""
+import numpy as np
+
+HOUR_MS = 3600 * 1000
+
+
+def merge_intervals(starts, ends, groups=None):
+    """Union overlapping intervals, optionally within groups.
+
+    ``starts``/``ends`` must be sorted by ``(groups, starts)``.  Returns
+    ``(run_starts, run_ends, run_groups)`` for the merged runs, where
+    ``run_groups`` is ``None`` if no groups were given.
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.maximum(np.asarray(ends, dtype=np.int64), starts)
+    if len(starts) == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, (None if groups is None else np.asarray(groups)[:0])
+
+    origin = starts.min()
+    rel_ends = ends - origin
+    if groups is None:
+        new_group = np.zeros(len(starts), dtype=bool)
+        running_end = np.maximum.accumulate(rel_ends)
+    else:
+        groups = np.asarray(groups)
+        new_group = np.empty(len(starts), dtype=bool)
+        new_group[0] = True
+        new_group[1:] = groups[1:] != groups[:-1]
+        # Offsetting each group above the previous one lets a single
+        # cumulative max restart at every group boundary.
+        offset = np.cumsum(new_group, dtype=np.int64) * (int(rel_ends.max()) + 1)
+        running_end = np.maximum.accumulate(rel_ends + offset) - offset
+
+    new_run = np.empty(len(starts), dtype=bool)
+    new_run[0] = True
+    new_run[1:] = (starts[1:] - origin > running_end[:-1]) | new_group[1:]
+    first = np.flatnonzero(new_run)
+    last = np.append(first[1:] - 1, len(starts) - 1)
+    run_groups = None if groups is None else groups[first]
+    return starts[first], running_end[last] + origin, run_groups
+
+
+def split_by_hour(starts, ends):
+    """Split intervals at hour boundaries.
+
+    Returns ``(index, hour_start, duration)`` with one entry per
+    (interval, hour) pair, where ``index`` points back into the input.
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    keep = ends > starts
+    index = np.flatnonzero(keep)
+    starts, ends = starts[keep], ends[keep]
+    first_hour = starts // HOUR_MS
+    n_hours = (ends - 1) // HOUR_MS - first_hour + 1
+    index = np.repeat(index, n_hours)
+    steps = np.arange(len(index)) - np.repeat(np.cumsum(n_hours) - n_hours, n_hours)
+    hour_start = (np.repeat(first_hour, n_hours) + steps) * HOUR_MS
+    duration = (np.minimum(np.repeat(ends, n_hours), hour_start + HOUR_MS)
+                - np.maximum(np.repeat(starts, n_hours), hour_start))
+    return index, hour_start, duration
@@ -0,0 +1,105 @@
+"""Run the dashboard's queries concurrently and cancel them when inputs change.
+
+Each Streamlit session gets a ``SessionLoader`` with its own small thread pool.
+Every run of the script starts a ``PageLoad`` for its inputs (the date range);
+if the inputs differ from the previous run, the queries still in flight for
+the previous inputs are cancelled so they stop using warehouse time.
+"""
+import threading
+import time
+import uuid
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+from instrumentation import StageMetrics, frame_bytes, query_tag
+
+MAX_WORKERS_PER_SESSION = 2
+
+
+class PageLoad:
+    def __init__(self, executor, key):
+        self.key = key
+        # Tags every query of this load, see instrumentation.query_tag.
+        self.id = uuid.uuid4().hex[:12]
+        self.metrics = StageMetrics(load=self.id)
+        self.cancelled = False
+        self._executor = executor
+        self._lock = threading.Lock()
+        self._futures = []
+        self._jobs = set()
+        self._progress = {}
+
+    def submit(self, fn, *args):
+        """Run ``fn(*args)`` on the session's pool and return its future."""
+        future = self._executor.submit(fn, *args)
+        with self._lock:
+            self._futures.append(future)
+        return future
+
+    def iter_batches(self, source, query, stage, **details):
+        """Yield the result of ``query`` on ``source`` in batches.
+
+        The query is not issued once the load is cancelled, and ``cancel()``
+        stops it while it runs.  It is tagged and timed as ``stage``;
+        ``first_batch_seconds`` covers compilation and execution, the rest is
+        result transfer plus whatever the caller does with each batch.
+        """
+        with self.metrics.stage('query', query=stage, **details) as record:
+            record['rows'] = record['bytes'] = 0
+            started = time.perf_counter()
+            with self._lock:
+                if self.cancelled:
+                    raise CancelledError()
+                job = source.submit(query, self.tag(stage, **details))
+                self._jobs.add(job)
+            record['query_id'] = getattr(job, 'query_id', None)
+            try:
+                for batch in job.batches():
+                    if 'first_batch_seconds' not in record:
+                        record['first_batch_seconds'] = round(time.perf_counter() - started, 6)
+                    if self.cancelled:
+                        raise CancelledError()
+                    record['rows'] += len(batch)
+                    record['bytes'] += frame_bytes(batch)
+                    yield batch
+            finally:
+                with self._lock:
+                    self._jobs.discard(job)
+
+    def tag(self, stage, **details):
+        return query_tag(stage, load=self.id, **details)
+
+    def set_progress(self, name, done, total):
+        """Record progress of a long running fetch, see ``progress()``."""
+        with self._lock:
+            self._progress[name] = (done, total)
+
+    def progress(self):
+        """Overall ``(done, total)`` across every fetch that reported progress."""
+        with self._lock:
+            values = list(self._progress.values())
+        return sum(done for done, _ in values), sum(total for _, total in values)
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            futures, jobs = list(self._futures), list(self._jobs)
+        for future in futures:
+            future.cancel()
+        for job in jobs:
+            job.cancel()
+
+
+class SessionLoader:
+    def __init__(self, max_workers=MAX_WORKERS_PER_SESSION):
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix='warehouse-utilization')
+        self._current = None
+
+    def start(self, key):
+        """Return the ``PageLoad`` for ``key``, cancelling one for other inputs."""
+        current = self._current
+        if current is not None and current.key == key and not current.cancelled:
+            return current
+        if current is not None:
+            current.cancel()
+        self._current = PageLoad(self._executor, key)
+        return self._current
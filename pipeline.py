@@ -0,0 +1,125 @@
+"""The dashboard's queries and computations, without any Streamlit calls.
+
+Shared by ``streamlit_app.py`` and the headless ``report.py``.  Each
+``load_*`` function takes a ``DataSource`` and the ``page_load.PageLoad``
+its queries belong to.
+"""
+import pandas as pd
+
+from busy_time import busy_intervals_sql, busy_time
+from instrumentation import frame_bytes
+from result_cache import RESULT_CACHE
+from rollup_store import get_store
+from simulator import simulate, with_current_settings
+from streaming import StreamingAggregate, fetch_windows
+from table_view import TableView
+from timeseries import pre_aggregate, utilization_series
+from utilization import (HOURLY_AGGREGATIONS, HOURLY_KEY, METERING_AGGREGATIONS, METERING_KEY,
+                         add_derived_columns, add_true_utilization, coarsen_metering, hourly_utilization_sql,
+                         metering_bucket, metering_sql, summarize_hourly)
+
+
+def streamed_sql(source, load, build_query, start, end, aggregate, stage):
+    # Results are shared with other sessions, treat the returned frame as read-only.
+    key = source.identity + (str(start), str(end), build_query(start, end))
+    return RESULT_CACHE.get_or_compute(
+        key, lambda: fetch_windows(load, source, build_query, start, end, aggregate, stage))
+
+
+def hourly_rollup(source, load, start_date, end_date):
+    # Closed hours come from the local store, only new hours hit Snowflake.
+    store = get_store(source.identity)
+    return store.get_range(
+        lambda start, end: streamed_sql(
+            source, load, hourly_utilization_sql, start, end,
+            StreamingAggregate(HOURLY_KEY, HOURLY_AGGREGATIONS), 'utilization'),
+        start_date, end_date, now=source.now(), tz=source.time_zone())
+
+
+def metering_frame(source, load, start, end, bucket):
+    wh_metering = streamed_sql(
+        source, load, lambda s, e: metering_sql(s, e, bucket), start, end,
+        StreamingAggregate(METERING_KEY, METERING_AGGREGATIONS), 'metering')
+    return wh_metering.assign(START_TIME=pd.to_datetime(wh_metering["START_TIME"]))
+
+
+# In the dashboard the load_* functions run on the session's thread pool.
+
+
+def load_summary(source, load, start_date, end_date, true_utilization=False):
+    with load.metrics.stage('hourly_rollup') as record:
+        hourly = hourly_rollup(source, load, start_date, end_date)
+        record['rows'], record['bytes'] = len(hourly), frame_bytes(hourly)
+    with load.metrics.stage('summarize'):
+        summary = summarize_hourly(hourly)
+    with load.metrics.stage('derived_columns') as record:
+        df = add_derived_columns(summary)
+        record['rows'], record['bytes'] = len(df), frame_bytes(df)
+    busy = load_busy_time(source, load, start_date, end_date) if true_utilization else None
+    with load.metrics.stage('true_utilization'):
+        return add_true_utilization(df, busy, hourly)
+
+
+def load_summary_table(source, load, start_date, end_date, true_utilization=False):
+    # Widget changes rerun the page, so the summary and its sort orders and
+    # gradient are built once per range and shared, treat them as read-only.
+    key = source.identity + (str(start_date), str(end_date), true_utilization, 'summary_table')
+
+    def compute():
+        df = load_summary(source, load, start_date, end_date, true_utilization)
+        with load.metrics.stage('table_view', rows=len(df)):
+            return df, TableView(df)
+
+    return RESULT_CACHE.get_or_compute(key, compute)
+
+
+def load_busy_time(source, load, start_date, end_date):
+    # Streams every query interval, so only the per-hour busy time is cached.
+    query = busy_intervals_sql(start_date, end_date)
+    key = source.identity + (str(start_date), str(end_date), query)
+    return RESULT_CACHE.get_or_compute(key, lambda: busy_time(load.iter_batches(source, query, 'busy_time')))
+
+
+def load_metering(source, load, range_start, range_end, zoom_start, zoom_end):
+    # The point budget is shared by the warehouses, which are only known once
+    # the overview is in; it is fetched at the budget of a single warehouse
+    # and coarsened here if there are more.
+    overview_bucket = metering_bucket(range_start, range_end)
+    wh_metering = metering_frame(source, load, range_start, range_end, overview_bucket)
+    warehouses = wh_metering['WAREHOUSE_NAME'].nunique()
+    bucket = metering_bucket(range_start, range_end, warehouses)
+    if bucket != overview_bucket:
+        wh_metering, overview_bucket = coarsen_metering(wh_metering, bucket), bucket
+    if (zoom_start, zoom_end) == (range_start, range_end):
+        return wh_metering, wh_metering, overview_bucket, overview_bucket
+    detail_bucket = metering_bucket(zoom_start, zoom_end, warehouses)
+    wh_detail = metering_frame(source, load, zoom_start, zoom_end, detail_bucket)
+    return wh_metering, wh_detail, overview_bucket, detail_bucket
+
+
+def load_utilization_levels(source, load, start_date, end_date):
+    # Hour/day/week pre-aggregates, so a new zoom window only slices them.
+    key = source.identity + (str(start_date), str(end_date), 'utilization_levels')
+    return RESULT_CACHE.get_or_compute(
+        key, lambda: pre_aggregate(hourly_rollup(source, load, start_date, end_date)))
+
+
+def load_utilization_series(source, load, start_date, end_date, zoom_start, zoom_end):
+    levels = load_utilization_levels(source, load, start_date, end_date)
+    with load.metrics.stage('utilization_series') as record:
+        series, bucket = utilization_series(levels, zoom_start, zoom_end)
+        record['rows'] = len(series)
+    return series, bucket
+
+
+def load_simulation(source, load, start_date, end_date, auto_suspends):
+    """The simulation and the current AUTO_SUSPEND of every warehouse."""
+    with load.metrics.stage('query', query='warehouse_settings'):
+        current = source.warehouse_auto_suspends(load.tag('warehouse_settings'))
+    # The current settings are always simulated, they are what savings are measured against.
+    auto_suspends = with_current_settings(auto_suspends, current)
+    query = busy_intervals_sql(start_date, end_date)
+    key = source.identity + (str(start_date), str(end_date), query, auto_suspends)
+    simulation = RESULT_CACHE.get_or_compute(
+        key, lambda: simulate(load.iter_batches(source, query, 'simulation'), auto_suspends))
+    return simulation, current
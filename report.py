@@ -0,0 +1,159 @@
+"""Write the warehouse utilization table for many accounts without the dashboard.
+
+    python report.py accounts.json --start 2024-01-01 --end 2024-02-01 --output reports
+    python report.py accounts.json --formats parquet,csv --workers 8 --true-utilization
+
+``accounts.json`` is a list of accounts, each with a unique ``name`` other
+than ``combined`` and
+either the Snowpark connection parameters (``account``, ``user``, ``role``,
+``warehouse``, ...) or ``local`` pointing at a directory of Parquet files
+(see ``synthetic.py``).  Rather than storing a password in the file, set
+``password_env`` to the name of an environment variable holding it.
+``database`` and ``schema`` default to ``SNOWFLAKE.ACCOUNT_USAGE``.
+
+Accounts are processed concurrently, at most ``--workers`` at a time.  For
+every account ``<output>/<name>.<format>`` holds the same columns as the
+dashboard table, and ``<output>/combined.<format>`` holds every account with
+an extra ``ACCOUNT`` column.  The exit code is 1 if any account failed.
+
+``--log-json`` prints every timed stage as a JSON line on stderr and
+``--prometheus`` writes the stage totals in the Prometheus text format.
+"""
+import argparse
+import datetime
+import json
+import os
+import re
+import sys
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from data_source import LocalDataSource, SnowflakeDataSource
+from instrumentation import PROCESS_METRICS, configure_json_logging
+from page_load import SessionLoader
+from pipeline import load_summary
+from session_pool import SESSION_POOL
+from utilization import warehouse_table
+
+FORMATS = ('parquet', 'csv', 'json')
+DEFAULT_CONNECTION = {
+    'database': 'SNOWFLAKE',
+    'schema': 'ACCOUNT_USAGE',
+    'role': 'ACCOUNTADMIN',
+}
+
+
+COMBINED = 'combined'
+
+
+def read_accounts(path):
+    with open(path) as f:
+        accounts = json.load(f)
+    names = [account.get('name') for account in accounts]
+    if None in names:
+        raise ValueError(f"Every account in {path} needs a name")
+    # Names become file names next to the combined file, on file systems
+    # that may ignore case.
+    files = [_filename(name).lower() for name in names]
+    if COMBINED in files:
+        raise ValueError(f"No account in {path} can be named {COMBINED!r}, its file holds every account")
+    if len(set(files)) != len(files):
+        raise ValueError(f"Every account in {path} needs a unique name")
+    return accounts
+
+
+def connect(account):
+    if 'local' in account:
+        return LocalDataSource(account['local'])
+    params = dict(DEFAULT_CONNECTION)
+    params.update((key, value) for key, value in account.items() if key not in ('name', 'password_env'))
+    if 'password_env' in account:
+        params['password'] = os.environ[account['password_env']]
+    # Accounts sharing a login also share the session; the pool closes it.
+    pooled = SESSION_POOL.get(params)
+    return SnowflakeDataSource(pooled.session, pooled.query_ids)
+
+
+def account_report(account, start_date, end_date, true_utilization=False):
+    source = connect(account)
+    load = SessionLoader().start(account['name'])
+    load.metrics.context['account'] = account['name']
+    return warehouse_table(load_summary(source, load, start_date, end_date, true_utilization))
+
+
+def write_table(df, path, formats):
+    for fmt in formats:
+        if fmt == 'parquet':
+            df.to_parquet(f'{path}.parquet', index=False)
+        elif fmt == 'csv':
+            df.to_csv(f'{path}.csv', index=False)
+        else:
+            df.to_json(f'{path}.json', orient='records', indent=2)
+
+
+def _filename(name):
+    return re.sub(r'[^\w.-]', '_', name)
+
+
+def main(argv=None):
+    today = datetime.date.today()
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('accounts', help="JSON file with the list of accounts")
+    parser.add_argument('--start', type=datetime.date.fromisoformat, default=today - datetime.timedelta(days=31),
+                        help="First day, YYYY-MM-DD (default: 31 days ago)")
+    parser.add_argument('--end', type=datetime.date.fromisoformat, default=today,
+                        help="Day after the last day, YYYY-MM-DD (default: today)")
+    parser.add_argument('--output', default='reports', help="Output directory (default: %(default)s)")
+    parser.add_argument('--formats', default=','.join(FORMATS),
+                        help="Comma separated output formats (default: %(default)s)")
+    parser.add_argument('--workers', type=int, default=4,
+                        help="Accounts processed at the same time (default: %(default)s)")
+    parser.add_argument('--true-utilization', action='store_true',
+                        help="Also compute TRUE_UTILIZATION, which fetches every query's start and end time")
+    parser.add_argument('--log-json', action='store_true', help="Log every stage as a JSON line on stderr")
+    parser.add_argument('--prometheus', help="Write stage metrics in the Prometheus text format to this file")
+    args = parser.parse_args(argv)
+
+    formats = [fmt.strip() for fmt in args.formats.split(',')]
+    unknown = set(formats) - set(FORMATS)
+    if unknown:
+        parser.error(f"unknown format(s): {', '.join(sorted(unknown))}")
+    if args.start >= args.end:
+        parser.error("--end must fall after --start")
+    try:
+        accounts = read_accounts(args.accounts)
+    except ValueError as e:
+        parser.error(str(e))
+    os.makedirs(args.output, exist_ok=True)
+    if args.log_json:
+        configure_json_logging()
+
+    with ThreadPoolExecutor(args.workers) as pool:
+        futures = [(account['name'], pool.submit(account_report, account, args.start, args.end,
+                                                 args.true_utilization))
+                   for account in accounts]
+        tables, failed = [], []
+        for name, future in futures:
+            try:
+                table = future.result()
+            except Exception:
+                print(f"FAILED {name}", file=sys.stderr)
+                traceback.print_exc()
+                failed.append(name)
+                continue
+            write_table(table, os.path.join(args.output, _filename(name)), formats)
+            tables.append(table.assign(ACCOUNT=name)[['ACCOUNT'] + list(table.columns)])
+            print(f"{name}: {len(table):,} warehouses")
+
+    if tables:
+        write_table(pd.concat(tables, ignore_index=True), os.path.join(args.output, COMBINED), formats)
+    if args.prometheus:
+        PROCESS_METRICS.write_prometheus(args.prometheus)
+    SESSION_POOL.close()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+"""Process-wide cache for Snowflake query results.
+
+Streamlit reruns the whole script on every widget interaction, and every user
+session runs its own copy of the script.  Modules however are only imported
+once per server process, so a cache held here is shared by every session.
+
+Entries expire after ``ttl`` seconds and the least recently used entry is
+evicted once ``max_entries`` is reached.  Concurrent requests for the same key
+are collapsed into a single computation (single-flight): the first caller runs
+the query and everyone else waits for its result.
+
+Cached values are shared between sessions, so callers must treat them as
+read-only.
+"""
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import CancelledError
+
+
+class _FlightCancelled(Exception):
+    pass
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ResultCache:
+    def __init__(self, max_entries=32, ttl=15 * 60, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._flights = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return the cached value for ``key`` or ``None`` if missing/expired."""
+        with self._lock:
+            return self._lookup(key)
+
+    def get_or_compute(self, key, compute):
+        """Return the cached value for ``key``, calling ``compute()`` on a miss.
+
+        If another thread is already computing ``key`` this call blocks until
+        that computation finishes and shares its result (or its exception).
+        If that computation was cancelled by its owner, the waiting callers
+        retry instead of inheriting the cancellation.
+        """
+        while True:
+            try:
+                return self._get_or_compute(key, compute)
+            except _FlightCancelled:
+                continue
+
+    def _get_or_compute(self, key, compute):
+        with self._lock:
+            value = self._lookup(key)
+            if value is not None:
+                return value
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.misses += 1
+
+        if not leader:
+            flight.done.wait()
+            if isinstance(flight.error, CancelledError):
+                raise _FlightCancelled()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = compute()
+        except BaseException as e:
+            flight.error = e
+            raise
+        else:
+            self.put(key, flight.value)
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+        return flight.value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, self._clock() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key=None):
+        """Drop ``key`` from the cache, or every entry if no key is given."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires <= self._clock():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+
+# Shared by every session served by this process.
+RESULT_CACHE = ResultCache()
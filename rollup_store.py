@@ -0,0 +1,191 @@
+"""Persistent store for the hourly utilization rollup.
+
+ACCOUNT_USAGE views lag behind real time (up to 3 hours for
+WAREHOUSE_METERING_HISTORY), and a query only shows up in QUERY_HISTORY once
+it has finished, which can be as late as the statement timeout after it
+started.  Once an hour is older than both, its rollup never changes.  The
+store keeps every closed hour it has seen in a Parquet file per
+account/role/database/schema, along with the ranges of hours it covers.  A
+request only goes to Snowflake for the hours the store does not cover yet,
+plus the still-open hours at the end which are fetched live and never
+persisted.
+
+Hours are stored as naive UTC timestamps, so the repeated wall clock hour when
+daylight saving time ends is kept as two hours.  Range bounds are given and
+hours are returned in the wall clock time of the source's session time zone,
+which is what ``DATE_TRUNC('HOUR', ...)`` produces there.
+"""
+import datetime
+import hashlib
+import json
+import os
+import threading
+
+import pandas as pd
+
+from utilization import HOURLY_KEY, MAX_QUERY_DURATION, floor_hour
+
+ACCOUNT_USAGE_LATENCY = datetime.timedelta(hours=3)
+
+# Bumped whenever the meaning of the stored rollup changes; stores written
+# with another version are discarded and rebuilt.
+STORE_VERSION = 3
+
+ROLLUP_DIR_ENV = 'WAREHOUSE_UTILIZATION_ROLLUP_DIR'
+DEFAULT_ROOT = os.path.join(os.path.expanduser('~'), '.cache', 'snowflake-warehouse-utilization')
+
+
+class HourlyRollupStore:
+    def __init__(self, path, latency=ACCOUNT_USAGE_LATENCY, max_query_duration=MAX_QUERY_DURATION):
+        self.path = path
+        self.latency = latency
+        self.max_query_duration = max_query_duration
+        self._lock = threading.Lock()
+        self._frame = None
+        self._covered = []
+        self._load()
+
+    @property
+    def covered(self):
+        """Sorted, disjoint ``[low, high)`` UTC ranges of closed hours held by the store."""
+        return list(self._covered)
+
+    def get_range(self, fetch, start, end, now=None, tz='UTC'):
+        """Return hourly rollup rows for ``[start, end)``.
+
+        ``start`` and ``end`` are wall clock times in ``tz``, the session time
+        zone, and so are the returned hours.  ``fetch(start, end)`` must return
+        the hourly rollup for that range from the source, where the bounds are
+        tz-aware UTC datetimes; it is only called for hours that are missing
+        from the store or not closed yet.  ``now`` is the current time of the
+        source, in ``tz`` if it is naive (local time by default).
+        """
+        start = _to_utc(floor_hour(start), tz)
+        end = _to_utc(floor_hour(end), tz)
+        now = now or datetime.datetime.now()
+        if now.tzinfo is not None:
+            now = _to_wall_clock(now, tz)
+        # Hour boundaries of the session time zone, which need not be whole
+        # hours from UTC.
+        closed = _to_utc(floor_hour(now - self.latency - self.max_query_duration), tz)
+        with self._lock:
+            self._fill(fetch, start, min(end, closed))
+            stored = self._frame
+            if stored is None:
+                stored = pd.DataFrame(columns=HOURLY_KEY)
+            else:
+                stored = stored[(stored['HOUR'] >= start) & (stored['HOUR'] < end)]
+        if end > max(start, closed):
+            live = _utc_hours(_fetch(fetch, max(start, closed), end))
+            stored = pd.concat([stored, live], ignore_index=True)
+        stored = stored.reset_index(drop=True)
+        return stored.assign(HOUR=_to_wall_clock(pd.to_datetime(stored['HOUR']), tz))
+
+    def _fill(self, fetch, start, end):
+        missing = _missing(self._covered, start, end)
+        if not missing:
+            return
+        parts = [_utc_hours(_fetch(fetch, lo, hi)) for lo, hi in missing]
+        if self._frame is not None:
+            parts.insert(0, self._frame)
+        frame = pd.concat(parts, ignore_index=True)
+        frame = frame.drop_duplicates(HOURLY_KEY, keep='last').sort_values(HOURLY_KEY, ignore_index=True)
+        covered = _union(self._covered + missing)
+        self._save(frame, covered)
+        self._frame, self._covered = frame, covered
+
+    def _files(self):
+        return os.path.join(self.path, 'hourly.parquet'), os.path.join(self.path, 'meta.json')
+
+    def _load(self):
+        data_file, meta_file = self._files()
+        if not (os.path.exists(data_file) and os.path.exists(meta_file)):
+            return
+        with open(meta_file) as f:
+            meta = json.load(f)
+        if meta.get('version') != STORE_VERSION:
+            return
+        self._frame = _utc_hours(pd.read_parquet(data_file))
+        self._covered = [(datetime.datetime.fromisoformat(low), datetime.datetime.fromisoformat(high))
+                         for low, high in meta['covered']]
+
+    def _save(self, frame, covered):
+        os.makedirs(self.path, exist_ok=True)
+        data_file, meta_file = self._files()
+        # Write then rename so readers in other processes never see half a file.
+        frame.to_parquet(data_file + '.tmp', index=False)
+        os.replace(data_file + '.tmp', data_file)
+        with open(meta_file + '.tmp', 'w') as f:
+            json.dump({'version': STORE_VERSION,
+                       'covered': [[low.isoformat(), high.isoformat()] for low, high in covered]}, f)
+        os.replace(meta_file + '.tmp', meta_file)
+
+
+def _missing(covered, start, end):
+    """The parts of ``[start, end)`` not in the sorted, disjoint ``covered`` ranges."""
+    missing = []
+    for low, high in covered:
+        if high <= start or low >= end:
+            continue
+        if low > start:
+            missing.append((start, low))
+        start = max(start, high)
+    if start < end:
+        missing.append((start, end))
+    return missing
+
+
+def _union(ranges):
+    merged = []
+    for low, high in sorted(ranges):
+        if merged and low <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], high))
+        else:
+            merged.append((low, high))
+    return merged
+
+
+def _fetch(fetch, start, end):
+    utc = datetime.timezone.utc
+    return fetch(start.replace(tzinfo=utc), end.replace(tzinfo=utc))
+
+
+def _to_utc(value, tz):
+    # Wall clock time in ``tz`` to naive UTC.  An hour that occurs twice is
+    # taken as its first occurrence, one that is skipped as the next hour.
+    return (pd.Timestamp(value).tz_localize(tz, ambiguous=True, nonexistent='shift_forward')
+            .tz_convert('UTC').tz_localize(None).to_pydatetime())
+
+
+def _to_wall_clock(value, tz):
+    # Naive UTC (Series) or tz-aware (datetime) to naive wall clock time in ``tz``.
+    if isinstance(value, pd.Series):
+        return value.dt.tz_localize('UTC').dt.tz_convert(tz).dt.tz_localize(None)
+    return pd.Timestamp(value).tz_convert(tz).tz_localize(None).to_pydatetime()
+
+
+def _utc_hours(frame):
+    # Snowflake returns TIMESTAMP_LTZ hours as tz-aware timestamps, DuckDB
+    # returns the naive timestamps of local data, which are taken as UTC.
+    hours = pd.to_datetime(frame['HOUR'])
+    if getattr(hours.dt, 'tz', None) is not None:
+        hours = hours.dt.tz_convert('UTC').dt.tz_localize(None)
+    return frame.assign(HOUR=hours)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(identity, root=None):
+    """Return the shared store for an (account, role, database, schema) identity.
+
+    Stores live under ``root``, ``$WAREHOUSE_UTILIZATION_ROLLUP_DIR`` or ``DEFAULT_ROOT``.
+    """
+    root = root or os.environ.get(ROLLUP_DIR_ENV, DEFAULT_ROOT)
+    digest = hashlib.sha1(json.dumps([str(i) for i in identity]).encode()).hexdigest()[:16]
+    path = os.path.join(root, digest)
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = HourlyRollupStore(path)
+        return _stores[path]
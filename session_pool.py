@@ -0,0 +1,168 @@
+"""Process-wide pool of authenticated Snowpark sessions.
+
+Logging in takes several round trips and every new session starts cold, so
+sessions are kept per login (account, user, role and credentials) for as
+long as they are in use.
+A background thread keeps them alive with ``SELECT 1``, which needs no
+warehouse, drops sessions that fail that check and closes the ones that have
+been idle for ``max_idle`` seconds.  A session that has not been checked for
+``check_interval`` seconds is checked again before it is handed out.
+
+Every (account, user, role) also gets a ``ResultCache`` of recent query IDs
+for ``SnowflakeDataSource``, so the persisted results of one session can be
+read with ``RESULT_SCAN`` by every other session of the same user and role.
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+
+from instrumentation import query_tag
+from result_cache import ResultCache
+
+KEEP_ALIVE_INTERVAL = 10 * 60
+CHECK_INTERVAL = 60
+MAX_IDLE = 4 * 60 * 60
+# How long a remembered result is served with RESULT_SCAN.  ACCOUNT_USAGE
+# views keep changing, so this matches the in-process result cache rather
+# than the 24 hours Snowflake keeps results for.
+RESULT_SCAN_TTL = 15 * 60
+MAX_QUERY_IDS = 1024
+
+log = logging.getLogger('warehouse_utilization')
+
+
+class PooledSession:
+    def __init__(self, session, key, query_ids, owned, now):
+        self.session = session
+        self.key = key
+        self.query_ids = query_ids
+        # Owned sessions were created by the pool and are closed by it.
+        self.owned = owned
+        self.last_used = self.last_checked = now
+
+
+def _create_session(params):
+    from snowflake.snowpark import Session
+    return Session.builder.configs(dict(params, client_session_keep_alive=True)).create()
+
+
+def _user_key(account, user, role):
+    return tuple((value or '').upper() for value in (account, user, role))
+
+
+class SessionPool:
+    def __init__(self, create=_create_session, keep_alive=KEEP_ALIVE_INTERVAL,
+                 check_interval=CHECK_INTERVAL, max_idle=MAX_IDLE, clock=time.monotonic):
+        self._create = create
+        self.keep_alive = keep_alive
+        self.check_interval = check_interval
+        self.max_idle = max_idle
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._query_ids = {}
+        self._creating = {}
+        self._thread = None
+
+    def get(self, params):
+        """A healthy session logged in with the connection ``params``.
+
+        Sessions are only shared between callers passing the same
+        parameters, credentials included.
+        """
+        digest = hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+        with self._lock:
+            creating = self._creating.setdefault(digest, threading.Lock())
+        # One login per parameters at a time, everyone else waits for it.
+        with creating:
+            pooled = self._sessions.get(digest)
+            if pooled is not None and self.check(pooled):
+                return pooled
+            key = _user_key(params.get('account'), params.get('user'), params.get('role'))
+            return self._add(digest, self._create(params), key, owned=True)
+
+    def adopt(self, session):
+        """Register a session logged in elsewhere, e.g. by ``st_connection``.
+
+        The pool keeps it alive and checks it, but never closes it.
+        """
+        with self._lock:
+            pooled = self._sessions.get(id(session))
+        if pooled is not None and pooled.session is session:
+            return pooled
+        row = session.sql("SELECT CURRENT_ACCOUNT(), CURRENT_USER(), CURRENT_ROLE()").collect(
+            statement_params={'QUERY_TAG': query_tag('session_pool')})[0]
+        return self._add(id(session), session, _user_key(*row), owned=False)
+
+    def check(self, pooled):
+        """Whether ``pooled`` still works; broken sessions are dropped from the pool."""
+        now = self._clock()
+        pooled.last_used = now
+        if now - pooled.last_checked < self.check_interval:
+            return True
+        return self._ping(pooled)
+
+    def close(self):
+        """Close every session created by the pool."""
+        with self._lock:
+            sessions, self._sessions = list(self._sessions.values()), {}
+        for pooled in sessions:
+            if pooled.owned:
+                _close(pooled.session)
+
+    def _add(self, handle, session, key, owned):
+        with self._lock:
+            query_ids = self._query_ids.get(key)
+            if query_ids is None:
+                query_ids = self._query_ids[key] = ResultCache(max_entries=MAX_QUERY_IDS, ttl=RESULT_SCAN_TTL)
+            pooled = self._sessions[handle] = PooledSession(session, key, query_ids, owned, self._clock())
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._keep_alive_loop, daemon=True,
+                                                name='warehouse-utilization-keep-alive')
+                self._thread.start()
+        return pooled
+
+    def _ping(self, pooled):
+        try:
+            pooled.session.sql("SELECT 1").collect(statement_params={'QUERY_TAG': query_tag('keep_alive')})
+        except Exception:
+            self._drop(pooled)
+            return False
+        pooled.last_checked = self._clock()
+        return True
+
+    def _drop(self, pooled):
+        with self._lock:
+            for handle, other in list(self._sessions.items()):
+                if other is pooled:
+                    del self._sessions[handle]
+        if pooled.owned:
+            _close(pooled.session)
+
+    def _keep_alive_loop(self):
+        while True:
+            time.sleep(min(self.keep_alive, self.check_interval))
+            self.maintain()
+
+    def maintain(self):
+        """Close idle sessions and ping the others that are due."""
+        now = self._clock()
+        with self._lock:
+            sessions = list(self._sessions.values())
+        for pooled in sessions:
+            if now - pooled.last_used >= self.max_idle:
+                self._drop(pooled)
+            elif now - pooled.last_checked >= self.keep_alive:
+                self._ping(pooled)
+
+
+def _close(session):
+    try:
+        session.close()
+    except Exception:
+        log.warning("Closing a Snowflake session failed", exc_info=True)
+
+
+SESSION_POOL = SessionPool()
@@ -0,0 +1,218 @@
+"""What-if simulation of warehouse billing under other AUTO_SUSPEND and size settings.
+
+Each warehouse's query timeline is replayed per cluster: a cluster resumes
+when a query starts, stays up while queries run and for ``AUTO_SUSPEND``
+seconds after the last one finishes, and every resume is billed for at least
+60 seconds.  Resizing assumes queries scale linearly with warehouse size, so
+on a warehouse twice as large every query takes half as long.  That makes a
+smaller size look at least as cheap, so resized results are only an estimate
+and ``best_settings`` keeps them apart from the AUTO_SUSPEND it picks.
+
+Warehouses are simulated in parallel on one process pool shared by every
+session, started with ``forkserver`` (or ``spawn``) because forking the
+multi-threaded Streamlit server is unsafe.  Within a warehouse all
+AUTO_SUSPEND values are evaluated at once with NumPy.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pandas as pd
+
+from busy_time import epoch_ms
+from intervals import merge_intervals
+from utilization import CREDITS_PER_HOUR
+
+AUTO_SUSPEND_GRID = [30, 60, 120, 180, 300, 600, 900, 1800, 3600]
+# Snowflake's default, assumed for warehouses whose setting is unknown.
+DEFAULT_AUTO_SUSPEND = 600
+# Sizes to try relative to the current one: one smaller, current, one larger.
+SIZE_STEPS = (-1, 0, 1)
+MIN_BILLED_MS = 60 * 1000
+SIZES = list(CREDITS_PER_HOUR)
+WAREHOUSE_KEY = ['WAREHOUSE_NAME', 'WAREHOUSE_SIZE']
+MAX_PROCESSES = min(4, os.cpu_count() or 1)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _billed_runs(run_starts, run_ends, suspends_ms):
+    """Billed ms of one cluster's merged busy runs for each suspend value."""
+    span = run_ends[-1] - run_starts[0]
+    gaps = (run_starts[1:] - run_ends[:-1]).astype(float)
+    # breaks[i, j] is True if the cluster suspends in gap j under suspends_ms[i].
+    breaks = gaps[None, :] > suspends_ms[:, None]
+    sessions = 1 + breaks.sum(axis=1)
+    billed = span - (breaks * gaps).sum(axis=1) + sessions * suspends_ms
+
+    # With AUTO_SUSPEND >= 60s every session already lasts at least 60s.
+    for i in np.flatnonzero(suspends_ms < MIN_BILLED_MS):
+        last = np.append(np.flatnonzero(breaks[i]), len(run_starts) - 1)
+        first = np.append(0, last[:-1] + 1)
+        length = run_ends[last] - run_starts[first] + suspends_ms[i]
+        # A session can only be extended up to the start of the next one.
+        room = np.append(gaps[breaks[i]] - suspends_ms[i], np.inf)
+        billed[i] += np.minimum(np.maximum(MIN_BILLED_MS - length, 0), room).sum()
+    return billed
+
+
+def billed_ms(starts, ends, clusters, suspends_ms):
+    """Billed ms summed over clusters for each value in ``suspends_ms``."""
+    suspends_ms = np.asarray(suspends_ms, dtype=float)
+    total = np.zeros(len(suspends_ms))
+    if len(starts) == 0:
+        return total
+    order = np.lexsort((starts, clusters))
+    run_starts, run_ends, run_clusters = merge_intervals(starts[order], ends[order], clusters[order])
+    bounds = np.flatnonzero(np.diff(run_clusters)) + 1
+    for rs, re in zip(np.split(run_starts, bounds), np.split(run_ends, bounds)):
+        total += _billed_runs(rs, re, suspends_ms)
+    return total
+
+
+def simulate_warehouse(name, size, starts, ends, clusters, auto_suspends=AUTO_SUSPEND_GRID,
+                       size_steps=SIZE_STEPS):
+    """Billed hours and credits for one warehouse over the settings grid."""
+    suspends_ms = np.asarray(auto_suspends, dtype=float) * 1000
+    elapsed = ends - starts
+    rows = []
+    current = SIZES.index(size) if size in SIZES else None
+    for step in size_steps:
+        if current is None or not 0 <= current + step < len(SIZES):
+            continue
+        sim_size = SIZES[current + step]
+        scale = CREDITS_PER_HOUR[size] / CREDITS_PER_HOUR[sim_size]
+        sim_ends = starts + np.ceil(elapsed * scale).astype(np.int64)
+        billed_hrs = billed_ms(starts, sim_ends, clusters, suspends_ms) / 1000 / 60 / 60
+        for auto_suspend, hrs in zip(auto_suspends, billed_hrs):
+            rows.append((name, size, sim_size, auto_suspend, hrs, hrs * CREDITS_PER_HOUR[sim_size]))
+    return rows
+
+
+def _warehouse_tasks(chunks, auto_suspends, size_steps):
+    # Chunks are sorted by warehouse, so each warehouse is handed off as soon
+    # as the next one starts.
+    pending = []
+    for chunk in chunks:
+        if len(chunk) == 0:
+            continue
+        chunk = chunk.assign(START_MS=epoch_ms(pd.to_datetime(chunk['START_TIME'])),
+                             END_MS=epoch_ms(pd.to_datetime(chunk['END_TIME'])))
+        for key, rows in chunk.groupby(WAREHOUSE_KEY, sort=False):
+            if pending and pending[0][0] != key:
+                yield _task(pending, auto_suspends, size_steps)
+                pending = []
+            pending.append((key, rows))
+    if pending:
+        yield _task(pending, auto_suspends, size_steps)
+
+
+def _task(parts, auto_suspends, size_steps):
+    (name, size), _ = parts[0]
+    rows = pd.concat([rows for _, rows in parts])
+    return (name, size, rows['START_MS'].values, rows['END_MS'].values,
+            rows['CLUSTER_NUMBER'].values.astype(np.int64), list(auto_suspends), tuple(size_steps))
+
+
+def _process_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            _pool = ProcessPoolExecutor(MAX_PROCESSES, mp_context=multiprocessing.get_context(method))
+        return _pool
+
+
+def _reset_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+
+
+def simulate(chunks, auto_suspends=AUTO_SUSPEND_GRID, size_steps=SIZE_STEPS, processes=True):
+    """Simulate every warehouse in ``busy_time.busy_intervals_sql`` chunks.
+
+    Returns one row per (warehouse, size, simulated size, auto suspend).
+    ``processes=False`` runs everything in the calling process.
+    """
+    tasks = _warehouse_tasks(chunks, auto_suspends, size_steps)
+    rows = []
+    if not processes or MAX_PROCESSES == 1:
+        for task in tasks:
+            rows.extend(simulate_warehouse(*task))
+    else:
+        pool = _process_pool()
+        # Only keep a few warehouses queued so memory stays bounded.
+        in_flight = set()
+        try:
+            for task in tasks:
+                if len(in_flight) >= 2 * MAX_PROCESSES:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    rows.extend(row for future in done for row in future.result())
+                in_flight.add(pool.submit(simulate_warehouse, *task))
+            rows.extend(row for future in in_flight for row in future.result())
+        except BrokenProcessPool:
+            # A worker died, the next simulation starts a new pool.
+            _reset_pool(pool)
+            raise
+        except BaseException:
+            for future in in_flight:
+                future.cancel()
+            raise
+    simulation = pd.DataFrame(rows, columns=WAREHOUSE_KEY + ['SIMULATED_SIZE', 'AUTO_SUSPEND',
+                                                            'BILLED_HRS', 'SIMULATED_CREDITS'])
+    return simulation.sort_values(WAREHOUSE_KEY + ['SIMULATED_SIZE', 'AUTO_SUSPEND'], ignore_index=True)
+
+
+def current_auto_suspend(name, current):
+    """``name``'s AUTO_SUSPEND in ``current``; None if it never suspends."""
+    return current.get(name, DEFAULT_AUTO_SUSPEND) or None
+
+
+def with_current_settings(auto_suspends, current):
+    """``auto_suspends`` plus every current setting, so savings have a baseline."""
+    values = {current_auto_suspend(name, current) for name in current} | {DEFAULT_AUTO_SUSPEND}
+    return tuple(sorted(set(auto_suspends) | (values - {None})))
+
+
+def best_settings(simulation, actual, current=None):
+    """The cheapest simulated AUTO_SUSPEND per warehouse at its size and what it saves.
+
+    ``actual`` needs ``WAREHOUSE_NAME``, ``WAREHOUSE_SIZE`` and ``ACTUAL_CREDITS``
+    and ``current`` maps warehouse names to their AUTO_SUSPEND.  Savings are
+    measured against the simulation of the current size and AUTO_SUSPEND, as
+    ACTUAL_CREDITS also bills cloud services and uptime that no query explains.
+    They are missing for warehouses that never suspend.
+
+    Other sizes are not candidates: with query times scaling linearly, the
+    busy time costs the same at every size and only the idle time before a
+    suspend gets cheaper, so one size smaller would always win.  Their
+    credits with the chosen AUTO_SUSPEND are in ``SMALLER_SIZE_CREDITS`` and
+    ``LARGER_SIZE_CREDITS`` instead, missing where no such size was simulated.
+    """
+    current = current or {}
+    at_size = simulation[simulation['SIMULATED_SIZE'] == simulation['WAREHOUSE_SIZE']]
+    best = at_size.loc[at_size.groupby(WAREHOUSE_KEY)['SIMULATED_CREDITS'].idxmin()]
+    best = best.drop(columns=['SIMULATED_SIZE']).merge(actual[WAREHOUSE_KEY + ['ACTUAL_CREDITS']], on=WAREHOUSE_KEY)
+    baseline = at_size[at_size['AUTO_SUSPEND'] == at_size['WAREHOUSE_NAME'].map(
+        lambda name: current_auto_suspend(name, current))]
+    best = best.merge(baseline[WAREHOUSE_KEY + ['AUTO_SUSPEND', 'SIMULATED_CREDITS']].rename(columns={
+        'AUTO_SUSPEND': 'CURRENT_AUTO_SUSPEND', 'SIMULATED_CREDITS': 'CURRENT_CREDITS'}),
+        on=WAREHOUSE_KEY, how='left')
+    best['SAVINGS'] = best['CURRENT_CREDITS'] - best['SIMULATED_CREDITS']
+    for step, column in ((-1, 'SMALLER_SIZE_CREDITS'), (1, 'LARGER_SIZE_CREDITS')):
+        resized = simulation[simulation['SIMULATED_SIZE'] == simulation['WAREHOUSE_SIZE'].map(
+            lambda size: _resized(size, step))]
+        best = best.merge(resized[WAREHOUSE_KEY + ['AUTO_SUSPEND', 'SIMULATED_CREDITS']].rename(
+            columns={'SIMULATED_CREDITS': column}), on=WAREHOUSE_KEY + ['AUTO_SUSPEND'], how='left')
+    return best.sort_values('SAVINGS', ascending=False, ignore_index=True)
+
+
+def _resized(size, step):
+    index = SIZES.index(size) + step if size in SIZES else -1
+    return SIZES[index] if 0 <= index < len(SIZES) else None
@@ -0,0 +1,105 @@
+"""Chunked, bounded-memory fetching of long date ranges.
+
+Instead of materializing a whole result at once, the range is split into day
+windows which are fetched in parallel as streams of batches.  Each batch is
+folded into a running aggregate straight away, so peak memory depends on the
+batch size and the size of the aggregated result, not on the range length.
+"""
+import datetime
+import math
+import threading
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+import pandas as pd
+
+from utilization import as_datetime
+
+# Longer ranges use multi-day windows so the number of queries stays bounded.
+MAX_WINDOWS = 32
+MAX_PARALLEL_WINDOWS = 4
+# Compact the running aggregate once this many raw rows have been buffered.
+COMPACT_ROWS = 500000
+
+
+def day_windows(start, end, max_windows=MAX_WINDOWS):
+    """Split ``[start, end)`` into consecutive windows of whole days."""
+    start, end = as_datetime(start), as_datetime(end)
+    days = max(1, math.ceil((end - start).total_seconds() / 86400))
+    step = datetime.timedelta(days=math.ceil(days / max_windows))
+    windows = []
+    while start < end:
+        windows.append((start, min(start + step, end)))
+        start += step
+    return windows
+
+
+class StreamingAggregate:
+    """Group-by aggregate that is updated one batch at a time.
+
+    ``aggregations`` maps each value column to a pandas reduction that can be
+    re-applied to partial results, such as ``'sum'``, ``'max'`` or ``'min'``.
+    """
+
+    def __init__(self, keys, aggregations):
+        self.keys = keys
+        self.aggregations = aggregations
+        self._lock = threading.Lock()
+        self._parts = []
+        self._buffered = 0
+
+    def add(self, batch):
+        if len(batch) == 0:
+            return
+        partial = self._reduce(batch)
+        with self._lock:
+            self._parts.append(partial)
+            self._buffered += len(partial)
+            if self._buffered >= COMPACT_ROWS:
+                self._parts = [self._reduce(pd.concat(self._parts, ignore_index=True))]
+                self._buffered = len(self._parts[0])
+
+    def result(self):
+        with self._lock:
+            if not self._parts:
+                return pd.DataFrame(columns=self.keys + list(self.aggregations))
+            return self._reduce(pd.concat(self._parts, ignore_index=True))
+
+    def _reduce(self, frame):
+        return frame.groupby(self.keys, as_index=False, sort=False, dropna=False).agg(self.aggregations)
+
+
+def fetch_windows(load, source, build_query, start, end, aggregate, stage,
+                  max_workers=MAX_PARALLEL_WINDOWS):
+    """Stream ``build_query(window_start, window_end)`` for every day window into ``aggregate``.
+
+    Queries are tagged as ``stage`` and progress is reported on ``load``;
+    cancelling ``load`` stops the remaining windows.
+    """
+    windows = day_windows(start, end)
+    name = '{} {} - {}'.format(stage, start, end)
+    done = []
+    load.set_progress(name, 0, len(windows))
+
+    def fetch(window):
+        if load.cancelled:
+            raise CancelledError()
+        for batch in load.iter_batches(source, build_query(*window), stage,
+                                       window='{} - {}'.format(*window)):
+            aggregate.add(batch)
+        done.append(window)
+        load.set_progress(name, len(done), len(windows))
+
+    with load.metrics.stage('fetch', query=stage, windows=len(windows)) as record:
+        with ThreadPoolExecutor(min(max_workers, len(windows) or 1)) as pool:
+            futures = [pool.submit(fetch, window) for window in windows]
+            try:
+                for future in futures:
+                    future.result()
+            except BaseException:
+                # Windows that have not started are not queried at all.
+                for future in futures:
+                    future.cancel()
+                raise
+        result = aggregate.result()
+        record['rows'] = len(result)
+    return result
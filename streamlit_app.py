@@ -1,9 +1,21 @@
 import streamlit as st
 import st_connection
 import st_connection.snowflake
-from snowflake.snowpark.functions import avg, sum, col, lit, datediff, dateadd
 import pandas as pd
 import datetime
+import logging
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+from charts import metering_chart_spec, utilization_chart_spec
+from data_source import LocalDataSource, SnowflakeDataSource
+from instrumentation import (PROCESS_METRICS, configure_json_logging, frame_bytes, query_tag,
+                             session_query_timings_sql)
+from page_load import SessionLoader
+from pipeline import load_metering, load_simulation, load_summary_table, load_utilization_series
+from session_pool import MAX_IDLE, SESSION_POOL
+from simulator import AUTO_SUSPEND_GRID, best_settings
+from table_view import PAGE_SIZE, PAGE_SIZES, style_page
 
 try:
     st.set_page_config(
@@ -28,23 +40,201 @@ try:
 except:
     pass
 
+# Point at a directory of Parquet files (see synthetic.py) to run without Snowflake.
+LOCAL_DATA = os.environ.get('WAREHOUSE_UTILIZATION_LOCAL_DATA')
+# Set to log every stage as a JSON line on stderr.
+if os.environ.get('WAREHOUSE_UTILIZATION_METRICS_LOG'):
+    configure_json_logging()
+# Set to a path to keep Prometheus metrics there, e.g. for node_exporter's textfile collector.
+PROMETHEUS_FILE = os.environ.get('WAREHOUSE_UTILIZATION_PROMETHEUS_FILE')
+log = logging.getLogger('warehouse_utilization')
+
 disclaimer = """Disclaimer: Use at your own discretion. This site does not store your Snowflake credentials and your credentials are only used as a passthrough to connect to your Snowflake account."""
 
+@st.experimental_singleton
+def local_source(path):
+    return LocalDataSource(path)
+
+
+def snowflake_source(session):
+    pooled = SESSION_POOL.adopt(session)
+    if not SESSION_POOL.check(pooled):
+        # The session expired or broke, ask for the login again.
+        del st.session_state['ST_SNOW_SESS']
+        st.experimental_rerun()
+    cached = st.session_state.get('WH_UTIL_SOURCE')
+    if cached is None or cached.session is not session:
+        cached = SnowflakeDataSource(session, pooled.query_ids)
+        st.session_state['WH_UTIL_SOURCE'] = cached
+    return cached
+
+
+def session_loader():
+    if 'WH_UTIL_LOADER' not in st.session_state:
+        st.session_state['WH_UTIL_LOADER'] = SessionLoader()
+    return st.session_state['WH_UTIL_LOADER']
+
+
+def render_simulation(simulation, current, df):
+    st.dataframe(best_settings(simulation, df, current)[[
+                'WAREHOUSE_NAME',
+                'WAREHOUSE_SIZE',
+                'CURRENT_AUTO_SUSPEND',
+                'AUTO_SUSPEND',
+                'ACTUAL_CREDITS',
+                'CURRENT_CREDITS',
+                'SIMULATED_CREDITS',
+                'SAVINGS',
+                'SMALLER_SIZE_CREDITS',
+                'LARGER_SIZE_CREDITS',
+            ]].style.format({
+                'CURRENT_AUTO_SUSPEND': '{:,.0f}',
+                'ACTUAL_CREDITS': '{:,.2f}',
+                'CURRENT_CREDITS': '{:,.2f}',
+                'SIMULATED_CREDITS': '{:,.2f}',
+                'SAVINGS': '{:,.2f}',
+                'SMALLER_SIZE_CREDITS': '{:,.2f}',
+                'LARGER_SIZE_CREDITS': '{:,.2f}',
+            }, na_rep=''), use_container_width=True)
+    st.caption("SMALLER_SIZE_CREDITS and LARGER_SIZE_CREDITS replay the chosen AUTO_SUSPEND one size smaller or larger, assuming query times scale linearly with warehouse size. Real queries rarely do, and under that assumption a smaller size always looks cheaper, so they are not a sizing recommendation.")
+    with st.expander("All Simulated Settings", False):
+        st.dataframe(simulation.style.format({
+                'BILLED_HRS': '{:,.2f}',
+                'SIMULATED_CREDITS': '{:,.2f}',
+            }), use_container_width=True)
+
+
+def render_warehouse_table(view, metrics):
+    # Only the visible page is sorted out of the cached orders, styled and sent.
+    col1, col2, col3, col4, col5 = st.columns([3, 2, 1, 1, 1])
+    search = col1.text_input('Filter :', key='WH_TABLE_FILTER', help="Warehouse name or size")
+    columns = list(view.table.columns)
+    sort_by = col2.selectbox('Sort by :', columns, index=columns.index('UTILIZATION'),
+                             key='WH_TABLE_SORT')
+    descending = col3.selectbox('Order :', ['Descending', 'Ascending'], key='WH_TABLE_ORDER') == 'Descending'
+    page_size = col4.selectbox('Rows :', PAGE_SIZES, index=PAGE_SIZES.index(PAGE_SIZE), key='WH_TABLE_PAGE_SIZE')
+    mask = view.matches(search)
+    pages = view.pages(mask, page_size)
+    if st.session_state.get('WH_TABLE_PAGE', 1) > pages:
+        # A narrower filter or bigger pages left the current page out of range.
+        st.session_state['WH_TABLE_PAGE'] = pages
+    page = col5.number_input('Page :', min_value=1, max_value=pages, step=1, key='WH_TABLE_PAGE')
+    with metrics.stage('styler') as record:
+        rows, shades = view.page(mask, sort_by, descending, page, page_size)
+        record['rows'] = len(rows)
+        st.dataframe(style_page(rows, shades), use_container_width=True)
+    st.write('{:,.0f} of {:,.0f} records, page {:,} of {:,}'.format(
+                mask.sum(), len(view), page, pages))
+
+
+def render_summary(df, view, metrics):
+    col1, col2, col3, col4, col5, col6 = st.columns(6)
+    col1.metric(label="Number of Queries",
+                value='{:,.0f}'.format(df["NUM_QUERIES"].sum()))
+    col2.metric(label="Total Query Hrs",
+                value='{:,.0f}'.format(df["TOTAL_ELAPSED_TIME_MS"].sum()/1000/60/60))
+    col3.metric(label="Avg Query Time (s)",
+                value='{:,.2f}'.format(df["TOTAL_ELAPSED_TIME_MS"].mean()/1000))
+    col4.metric(label="Credits Estimate",
+                value='{:,.0f}'.format(df["EXPECTED_CREDITS"].sum()))
+    col5.metric(label="Actual Credits Used", value='{:,.0f}'.format(df["ACTUAL_CREDITS"].sum(
+    )))
+    col6.metric(label="Utilization %", value='{:,.0%}'.format(
+        df["EXPECTED_CREDITS"].sum()/df["ACTUAL_CREDITS"].sum()), help="Utilization of Warehouses")
+
+    render_warehouse_table(view, metrics)
+    with st.expander("Column Definitions", False):
+        st.markdown(
+        """
+***WAREHOUSE_NAME***: The name of the warehouse used to execute queries.
+
+***WAREHOUSE_SIZE***: The size of the warehouse used to execute queries. See [Warehouse Size](https://docs.snowflake.com/en/user-guide/warehouses-overview.html#warehouse-size)
+                
+***NUM_QUERIES***: Number of queries executed using a warehouse.
+* ***Note***: Queries which did not need a warehouse such as those using the [results cache](https://docs.snowflake.com/en/user-guide/querying-persisted-results.html) are not included in this number.
+
+***TOTAL_QUERY_HRS***: From the `query_history` view, the of the `TOTAL_ELAPSED_TIME` column
+
+***TOTAL_WH_HRS***: Derived from the `CREDITS_USED` column in the `warehouse_metering_history` view, taking the `CREDITS_USED` divided by the [Credits Per Hour](https://docs.snowflake.com/en/user-guide/warehouses-overview.html#warehouse-size) to get the uptime of the warehouse.
+
+***AVG_CREDITS_PER_QUERY***: Calculation of `ACTUAL_CREDITS` / `NUM_QUERIES`.
+
+***AVG_QUERY_TIME_S***: Calculation of (`TOTAL_QUERY_HRS` * 60 * 60) / `NUM_QUERIES`.
+
+***EXPECTED_CREDITS***: Calculation of `TOTAL_QUERY_HRS` * (Credits Per Warehouse)
+
+***ACTUAL_CREDITS***: Sum of the `CREDITS_USED` column in the `warehouse_metering_history` view.
+
+***UTILIZATION***: Calculation of `EXPECTED_CREDITS` / `ACTUAL_CREDITS`.
+
+***TRUE_UTILIZATION***: Like `UTILIZATION`, but using the time each warehouse cluster had at least one query running instead of the sum of all query times, so concurrent queries are not counted twice. Only shown when ***Compute true utilization*** is checked.
+    """)
+
+
+def render_metering(chart, metering, metrics):
+    wh_metering, wh_detail, overview_bucket, detail_bucket = metering
+    with metrics.stage('vega_lite', chart='metering') as record:
+        spec = metering_chart_spec(wh_metering, wh_detail, overview_bucket, detail_bucket)
+        record['bytes'] = sum(frame_bytes(dataset) for dataset in spec['datasets'].values())
+        chart.vega_lite_chart(spec=spec, use_container_width=True)
+
+
+def render_utilization(chart, utilization, metrics):
+    series, bucket = utilization
+    with metrics.stage('vega_lite', chart='utilization') as record:
+        record['rows'], record['bytes'] = len(series), frame_bytes(series)
+        chart.vega_lite_chart(spec=utilization_chart_spec(series, bucket), use_container_width=True)
+
+
+def render_debug(load, source):
+    with st.expander("Timings", True):
+        st.caption('Queries of this page load have "load":"{}" in their QUERY_TAG.'.format(load.id))
+        st.dataframe(pd.DataFrame(load.metrics.records()), use_container_width=True)
+        if isinstance(source, SnowflakeDataSource) and st.button("Look up Snowflake compilation and execution times"):
+            st.dataframe(source.sql(session_query_timings_sql(load.id), query_tag('debug')),
+                         use_container_width=True)
+
+
+def render_as_completed(load, renderers):
+    # Render each section as soon as its data arrives. Updating the status
+    # line while waiting lets Streamlit interrupt this run when the user
+    # changes an input, instead of blocking until every query has finished.
+    status = st.empty()
+    pending = set(renderers)
+    started = time.monotonic()
+    while pending:
+        done, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+        for future in done:
+            renderers[future](future.result())
+        if pending:
+            fetched, total = load.progress()
+            if total:
+                status.progress(fetched / total)
+            else:
+                status.caption('Loading... {:,.0f}s'.format(time.monotonic() - started))
+    status.empty()
+
+
 def main():
     pass
 
 
 if __name__ == "__main__":
+    debug = st.experimental_get_query_params().get('debug') == ['1']
+    source = load = login_seconds = None
     try:
 
         main()
 
         st.title("Snowflake Warehouse Utilization")
         # Things above here will be run before (and after) you log in.
-        if 'ST_SNOW_SESS' not in st.session_state:
-            with st.expander("Login Help", False):
-                st.markdown(
-                """
+        if LOCAL_DATA:
+            source = local_source(LOCAL_DATA)
+        else:
+            if 'ST_SNOW_SESS' not in st.session_state:
+                with st.expander("Login Help", False):
+                    st.markdown(
+                    """
 ***account***: this should be the portion in between "https://" and ".snowflakecomputing.com" - for example https://<account>.snowflakecomputing.com
                     
 ***database***: This should remain ***SNOWFLAKE*** unless you have copied your `query_history` and `warehouse_metering_history` to another location
@@ -52,20 +242,25 @@ if __name__ == "__main__":
 ***schema***: This should remain ***ACCOUNT_USAGE*** unless you have copied your `query_history` and `warehouse_metering_history` to another location
 
 ***role***: This should remain ***ACCOUNTADMIN*** unless you have delegated access to `query_history` and `warehouse_metering_history`
-        """)
-            st.caption(disclaimer)
-
-        session = st.connection.snowflake.login({
-            'account': 'XXX',
-            'user': '',
-            'password': None,
-            'warehouse': 'ADHOC_WH',
-            'database': 'SNOWFLAKE',
-            'schema': 'ACCOUNT_USAGE',
-            'role': 'ACCOUNTADMIN',
-        }, {
-            'ttl': 120
-        }, 'Snowflake Login')
+            """)
+                st.caption(disclaimer)
+
+            login_started = time.perf_counter()
+            session = st.connection.snowflake.login({
+                'account': 'XXX',
+                'user': '',
+                'password': None,
+                'warehouse': 'ADHOC_WH',
+                'database': 'SNOWFLAKE',
+                'schema': 'ACCOUNT_USAGE',
+                'role': 'ACCOUNTADMIN',
+            }, {
+                'ttl': MAX_IDLE
+            }, 'Snowflake Login')
+            source = snowflake_source(session)
+            # Fetched here so its round trip counts towards the login time.
+            source.identity
+            login_seconds = time.perf_counter() - login_started
 
 
         # Nothing below here will be run until you log in.
@@ -104,147 +299,21 @@ For more information and suggestions on how to optimize your Snowflake environme
                     pass
                 else:
                     st.error('Error: End date must fall after start date.')
+            with col1:
+                true_utilization = st.checkbox(
+                    'Compute true utilization',
+                    help="Fetches the start and end time of every query to measure busy time without double counting concurrent queries")
                 
         except:
             st.error("Please select an end date")
             st.stop()
            
-        df = session.sql(f"""SELECT 
-            WAREHOUSE_NAME,
-            WAREHOUSE_SIZE,
-            SUM(NO_OF_QUERIES) AS NUM_QUERIES,
-            SUM(TOTAL_ELAPSED_TIME) AS TOTAL_ELAPSED_TIME_MS,
-            SUM(EXPECTED_CREDITS) AS EXPECTED_CREDITS,
-            SUM(CREDITS_USED) AS ACTUAL_CREDITS
-        FROM  (
-            SELECT
-                TO_VARCHAR(Q.START_TIME, 'YYYY-MM-DD HH:00:00') AS DATETIME,
-                Q.WAREHOUSE_NAME,
-                Q.WAREHOUSE_SIZE,
-                AVG(Q.CLUSTER_NUMBER) AS CLUSTER_NUMBER,
-                COUNT(*) AS NO_OF_QUERIES,
-                SUM(TOTAL_ELAPSED_TIME) AS TOTAL_ELAPSED_TIME,
-                SUM(
-                    TOTAL_ELAPSED_TIME / 1000 / 60 / 60 *
-                    CASE WAREHOUSE_SIZE
-                        WHEN 'X-Small' THEN 1
-                        WHEN 'Small'  THEN 2
-                        WHEN 'Medium' THEN 4
-                        WHEN 'Large'  THEN 8
-                        WHEN 'X-Large' THEN 16
-                        WHEN '2X-Large' THEN 32
-                        WHEN '3X-Large' THEN 64
-                        WHEN '4X-Large' THEN 128
-                        WHEN '5X-Large' THEN 256
-                        WHEN '6X-Large' THEN 512
-                        ELSE 0
-                    END
-                ) AS EXPECTED_CREDITS,
-                MAX(CREDITS_USED) AS CREDITS_USED
-            FROM QUERY_HISTORY Q
-            LEFT JOIN WAREHOUSE_METERING_HISTORY M ON M.WAREHOUSE_ID = Q.WAREHOUSE_ID AND TO_VARCHAR(Q.START_TIME, 'YYYY-MM-DD HH:00:00')::TIMESTAMP=M.START_TIME
-            WHERE 1=1
-                AND WAREHOUSE_SIZE IS NOT NULL
-                AND Q.START_TIME BETWEEN '{start_date}' AND '{end_date}'
-            GROUP BY 1,2,3
-        ) A 
-        GROUP BY 1,2
-        ORDER BY 1 ASC
-        """).to_pandas()
-        # df = df.collect()
-        df = df.fillna(0)
-        df = df[df['ACTUAL_CREDITS'] != 0]
-        df["UTILIZATION"] = (df["EXPECTED_CREDITS"] /
-                            df['ACTUAL_CREDITS']).astype(float)
-        df["TOTAL_QUERY_S"] = (df["TOTAL_ELAPSED_TIME_MS"]/1000).astype(float)
-        df["TOTAL_QUERY_MIN"] = (df["TOTAL_ELAPSED_TIME_MS"]/1000/60).astype(float)
-        df["TOTAL_QUERY_HRS"] = (df["TOTAL_ELAPSED_TIME_MS"]/1000/60/60).astype(float)
-        df["AVG_QUERY_TIME_MS"] = (df['TOTAL_ELAPSED_TIME_MS'] / df["NUM_QUERIES"]).astype(float)
-        df["AVG_QUERY_TIME_S"] = (df["AVG_QUERY_TIME_MS"] / 1000).astype(float)
-        df["AVG_CREDITS_PER_QUERY"] = (df['ACTUAL_CREDITS'] / df["NUM_QUERIES"]).astype(float)
-
-        df['WAREHOUSE_CPH'] = 0
-        df.loc[df['WAREHOUSE_SIZE'] == 'X-Small', 'WAREHOUSE_CPH'] = 1
-        df.loc[df['WAREHOUSE_SIZE'] == 'Small', 'WAREHOUSE_CPH'] = 2
-        df.loc[df['WAREHOUSE_SIZE'] == 'Medium', 'WAREHOUSE_CPH'] = 4
-        df.loc[df['WAREHOUSE_SIZE'] == 'Large', 'WAREHOUSE_CPH'] = 8
-        df.loc[df['WAREHOUSE_SIZE'] == 'X-Large', 'WAREHOUSE_CPH'] = 16
-        df.loc[df['WAREHOUSE_SIZE'] == '2X-Large', 'WAREHOUSE_CPH'] = 32
-        df.loc[df['WAREHOUSE_SIZE'] == '3X-Large', 'WAREHOUSE_CPH'] = 64
-        df.loc[df['WAREHOUSE_SIZE'] == '4X-Large', 'WAREHOUSE_CPH'] = 128
-        df.loc[df['WAREHOUSE_SIZE'] == '5X-Large', 'WAREHOUSE_CPH'] = 256
-        df.loc[df['WAREHOUSE_SIZE'] == '6X-Large', 'WAREHOUSE_CPH'] = 512
-        df['WAREHOUSE_CPH']=df['WAREHOUSE_CPH'].astype(int)
-        df["TOTAL_WH_HRS"] = (df['ACTUAL_CREDITS'] / df["WAREHOUSE_CPH"]).astype(float)
-        df["TOTAL_WH_MIN"] = (df["TOTAL_WH_HRS"] * 60).astype(float)
-        df["TOTAL_WH_S"] = (df["TOTAL_WH_MIN"] * 60).astype(float)
-
-        df['NUM_QUERIES']=df['NUM_QUERIES'].astype(int)
-        df['EXPECTED_CREDITS']=df['EXPECTED_CREDITS'].astype(float)
-        df['ACTUAL_CREDITS']=df['ACTUAL_CREDITS'].astype(float)
-        
-
-        col1, col2, col3, col4, col5, col6 = st.columns(6)
-        col1.metric(label="Number of Queries",
-                    value='{:,.0f}'.format(df["NUM_QUERIES"].sum()))
-        col2.metric(label="Total Query Hrs",
-                    value='{:,.0f}'.format(df["TOTAL_QUERY_HRS"].sum()))
-        col3.metric(label="Avg Query Time (s)",
-                    value='{:,.2f}'.format(df["TOTAL_ELAPSED_TIME_MS"].mean()/1000))
-        col4.metric(label="Credits Estimate",
-                    value='{:,.0f}'.format(df["EXPECTED_CREDITS"].sum()))
-        col5.metric(label="Actual Credits Used", value='{:,.0f}'.format(df["ACTUAL_CREDITS"].sum(
-        )))
-        col6.metric(label="Utilization %", value='{:,.0%}'.format(
-            df["EXPECTED_CREDITS"].sum()/df["ACTUAL_CREDITS"].sum()), help="Utilization of Warehouses")
-
-        st.dataframe(df[[
-                    'WAREHOUSE_NAME',
-                    'WAREHOUSE_SIZE',
-                    'NUM_QUERIES',
-                    'TOTAL_QUERY_HRS',
-                    'TOTAL_WH_HRS',
-                    'AVG_CREDITS_PER_QUERY',
-                    'AVG_QUERY_TIME_S',
-                    'EXPECTED_CREDITS',
-                    'ACTUAL_CREDITS',
-                    'UTILIZATION',
-                ]].sort_values(by=['UTILIZATION'], ascending=False).style.background_gradient(axis=0).format({
-                    'NUM_QUERIES': '{:,.0f}',
-                    'EXPECTED_CREDITS': '{:,.2f}',
-                    'UTILIZATION': '{:,.0%}',
-                    'TOTAL_QUERY_HRS': '{:,.2f}',
-                    'TOTAL_WH_HRS': '{:,.2f}',
-                    'ACTUAL_CREDITS': '{:,.2f}',
-                    'AVG_QUERY_TIME_S': '{:,.3f}',
-                    'AVG_CREDITS_PER_QUERY': '{:,.2f}',
-                }), use_container_width=True)
-        st.write('{:,.0f} records'.format(
-                    len(df)))
-        with st.expander("Column Definitions", False):
-                st.markdown(
-                """
-***WAREHOUSE_NAME***: The name of the warehouse used to execute queries.
-
-***WAREHOUSE_SIZE***: The size of the warehouse used to execute queries. See [Warehouse Size](https://docs.snowflake.com/en/user-guide/warehouses-overview.html#warehouse-size)
-                    
-***NUM_QUERIES***: Number of queries executed using a warehouse.
-* ***Note***: Queries which did not need a warehouse such as those using the [results cache](https://docs.snowflake.com/en/user-guide/querying-persisted-results.html) are not included in this number.
-
-***TOTAL_QUERY_HRS***: From the `query_history` view, the of the `TOTAL_ELAPSED_TIME` column
-
-***TOTAL_WH_HRS***: Derived from the `CREDITS_USED` column in the `warehouse_metering_history` view, taking the `CREDITS_USED` divided by the [Credits Per Hour](https://docs.snowflake.com/en/user-guide/warehouses-overview.html#warehouse-size) to get the uptime of the warehouse.
-
-***AVG_CREDITS_PER_QUERY***: Calculation of `ACTUAL_CREDITS` / `NUM_QUERIES`.
-
-***AVG_QUERY_TIME_S***: Calculation of (`TOTAL_QUERY_HRS` * 60 * 60) / `NUM_QUERIES`.
-
-***EXPECTED_CREDITS***: Calculation of `TOTAL_QUERY_HRS` * (Credits Per Warehouse)
-
-***ACTUAL_CREDITS***: Sum of the `CREDITS_USED` column in the `warehouse_metering_history` view.
-
-***UTILIZATION***: Calculation of `EXPECTED_CREDITS` / `ACTUAL_CREDITS`.
-        """)
+        load = session_loader().start((source.identity, start_date, end_date))
+        if login_seconds is not None:
+            load.metrics.add({'stage': 'login', 'seconds': round(login_seconds, 6)})
+        summary_section = st.container()
+        summary_placeholder = summary_section.empty()
+        summary_placeholder.info("Loading warehouse utilization...")
 
         st.empty()
         st.empty()
@@ -252,155 +321,58 @@ For more information and suggestions on how to optimize your Snowflake environme
         
         st.header("Warehouse Metering")
         st.caption("The following visualization pulls data from the WAREHOUSE_METERING_HISTORY view")
-        wh_metering = session.table("WAREHOUSE_METERING_HISTORY")
-        wh_metering = wh_metering.filter((col("START_TIME")>=start_date) & (col("START_TIME")<=end_date) )
-        wh_metering = wh_metering.toPandas()
-        wh_metering["START_TIME"] = pd.to_datetime(wh_metering["START_TIME"])
-        
-        st.vega_lite_chart(wh_metering,
-                           {
-                               "$schema": "https://vega.github.io/schema/vega-lite/v5.json",
-                               "vconcat": [
-                                   {
-                                       "mark": {
-                                           "type": "bar", "tooltip": {"content": "data"}
-                                           },
-                                       "height": 60,
-                                       "width": "container",
-                                       "autosize": {
-                                           "type": "fit",
-                                           "contains": "padding"
-                                       },
-                                       "params": [
-                                            {
-                                                "name": "brush",
-                                                "select": {
-                                                    "type": "interval",
-                                                    "encodings": ["x"]
-                                                }
-                                            }
-                                        ],
-                                       "encoding": {
-                                           "x": {
-                                               "field": "START_TIME",
-                                               "axis": None,
-                                               "timeUnit": "utcyearmonthdatehours",
-                                               "scale": {"type": "utc"},
-                                               "title": "Time"
-                                           },
-                                           "y": {
-                                               "aggregate": "sum",
-                                               "title": "",
-                                               "field": "CREDITS_USED",
-                                           },
-                                           "tooltip": [
-                                               {
-                                                   "field": "START_TIME",
-                                                   "title": "Day",
-                                                   "scale": {"type": "utc"},
-                                                   "formatType": "time",
-                                                   "format": "%m %d, %Y" 
-                                               },
-                                               {
-                                                   "aggregate": "sum",
-                                                   "field":  "CREDITS_USED",
-                                                   "title": "Credits",
-                                                   "format": ",.0f"
-                                               }
-                                           ]
-                                       }
-                                   },
-                                   {
-
-                                       "hconcat": [
-                                           {
-                                               "mark": {"type": "rect", "tooltip": {"content": "data"}},
-                                               "width": "container",
-                                               "autosize": {
-                                                   "type": "fit",
-                                                   "contains": "padding"
-                                               },
-                                               "height":len(wh_metering["WAREHOUSE_NAME"].unique().tolist())*25,
-                                               "encoding": {
-                                                   "x": {
-                                                       "field": "START_TIME",
-                                                       "timeUnit": "utcyearmonthdatehours",
-                                                        "scale": {
-                                                            "type": "utc",
-                                                            "domain": {"param": "brush"},
-                                                        },  
-                                                       "title": "Time"
-                                                   },
-                                                   "y":  {
-                                                        "field": "WAREHOUSE_NAME",
-                                                        "title": "Wahouse Name"
-                                                    },
-                                                   "color": {
-                                                       "field": 'CREDITS_USED',
-                                                       "aggregate": "sum"
-                                                   },
-                                                   "tooltip": [
-                                                        {
-            "field": "WAREHOUSE_NAME",
-            "title": "Wahouse Name"
-        },
-                                                       {
-                                                           "field": "START_TIME",
-                                                           "title": "Time",
-                                                           "formatType": "time",
-                                                           "format": "%m %d, %Y"
-                                                       },
-                                                       {
-                                                           "aggregate": "sum",
-                                                           "field":  "CREDITS_USED",
-                                                           "title": "Credits",
-                                                           "format": ",.0f"
-                                                       }
-                                                   ]
-                                               }
-                                           },
-                                           {
-                                               "mark": {"type": "bar", "tooltip": {"content": "data"}},
-                                               "width": 60,
-                                                "height":len(wh_metering["WAREHOUSE_NAME"].unique().tolist())*25,
-                                                "encoding": {
-                                                   "y": {
-                                                        "field": "WAREHOUSE_NAME",
-                                                        "title": "Wahouse Name",
-                                                        "axis": None
-                                                    },
-                                                   "x": {
-                                                       "aggregate": "sum",
-                                                       "field": "CREDITS_USED",
-                                                   },
-                                                   "tooltip": [
-                                                       {
-                                                            "field": "WAREHOUSE_NAME",
-                                                            "title": "Wahouse Name"
-                                                        },
-                                                       {
-                                                           "aggregate": "sum",
-                                                           "field":  "CREDITS_USED",
-                                                           "title": "Credits",
-                                                           "format": ",.0f"
-                                                       }
-                                                   ]
-                                               }
-                                           }
-                                       ]
-                                   },
-                               ],
-                               "config": {
-                                   "view": {
-                                       "stroke": "transparent"
-                                   }
-                               }
-                           },
-                           use_container_width=True
-                           )
+        range_start = datetime.datetime.combine(start_date, datetime.time())
+        range_end = datetime.datetime.combine(end_date, datetime.time())
+        zoom_start, zoom_end = st.slider(
+            'Zoom :',
+            min_value=range_start,
+            max_value=range_end,
+            value=(range_start, range_end),
+            step=datetime.timedelta(hours=1),
+            format="MM/DD/YY HH:mm",
+            help="The heatmap and the utilization over time are redrawn at a finer granularity for the selected window")
+        metering_chart = st.empty()
+        metering_chart.info("Loading warehouse metering...")
+
+        st.header("Utilization Over Time")
+        st.caption("Hourly EXPECTED_CREDITS / CREDITS_USED for the warehouses with the most credits in the zoomed window. Long windows are shown per day or week, keeping the lowest and highest value of each point")
+        utilization_chart = st.empty()
+        utilization_chart.info("Loading utilization over time...")
+
+        summary_future = load.submit(load_summary_table, source, load, start_date, end_date, true_utilization)
+        metering_future = load.submit(load_metering, source, load, range_start, range_end, zoom_start, zoom_end)
+        utilization_future = load.submit(load_utilization_series, source, load, start_date, end_date,
+                                         zoom_start, zoom_end)
+
+        def show_summary(summary):
+            summary_placeholder.empty()
+            with summary_section:
+                render_summary(*summary, load.metrics)
+
+        render_as_completed(load, {
+            summary_future: show_summary,
+            metering_future: lambda metering: render_metering(metering_chart, metering, load.metrics),
+            utilization_future: lambda utilization: render_utilization(utilization_chart, utilization, load.metrics),
+        })
+
+        st.header("Auto Suspend What-If")
+        st.caption("Replays each warehouse's queries from QUERY_HISTORY to find the AUTO_SUSPEND setting that would have used the fewest credits at its current size. Savings are against the replay of the current AUTO_SUSPEND (600 seconds if unknown), since ACTUAL_CREDITS also includes cloud services and uptime no query explains.")
+        auto_suspends = st.multiselect('AUTO_SUSPEND (seconds) :', AUTO_SUSPEND_GRID, default=AUTO_SUSPEND_GRID)
+        if auto_suspends and st.checkbox('Run simulation', help="Fetches the start and end time of every query"):
+            with st.spinner("Simulating..."):
+                simulation, current = load_simulation(source, load, start_date, end_date,
+                                                      tuple(sorted(auto_suspends)))
+            render_simulation(simulation, current, summary_future.result()[0])
         
     except Exception as e:
-        pass
-        # st.write(e)
+        log.exception("Dashboard run failed")
+        st.error("Something went wrong while loading the dashboard: {}".format(e))
+        if debug:
+            st.exception(e)
+
+    if debug and load is not None:
+        render_debug(load, source)
+    if PROMETHEUS_FILE:
+        PROCESS_METRICS.write_prometheus(PROMETHEUS_FILE)
 
     st.caption(disclaimer + " The metrics shown on this page should be used as information only. Please work with your Snowflake Account team if you have any questions.")
\ No newline at end of file
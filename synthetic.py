@@ -0,0 +1,170 @@
+"""Generate synthetic ``QUERY_HISTORY`` and ``WAREHOUSE_METERING_HISTORY`` data.
+
+The output can be read with ``data_source.LocalDataSource``.  Warehouses get a
+size (every size is used once there are enough warehouses), a cluster count,
+an auto suspend setting and active/idle days.  Queries arrive in bursts during
+working hours, and metering is derived from the resulting cluster uptime the
+same way Snowflake bills it: a cluster stays up ``AUTO_SUSPEND`` seconds after
+its last query and is billed for at least 60 seconds each time it resumes.
+
+    python synthetic.py ./data --queries 1000000 --warehouses 25 --days 30 --seed 0
+
+Generation is chunked by days, so 100M queries only needs memory for about
+``--chunk-size`` queries at a time.  A block is never shorter than one day,
+so a warehouse with more than ``--chunk-size`` queries a day is generated a
+day at a time and needs memory for one day of its queries.
+"""
+import argparse
+import datetime
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from intervals import HOUR_MS, merge_intervals, split_by_hour
+from utilization import CREDITS_PER_HOUR
+
+DAY_MS = 24 * HOUR_MS
+SIZES = list(CREDITS_PER_HOUR)
+AUTO_SUSPEND_CHOICES = [60, 120, 300, 600, 1800]
+# Relative likelihood of a burst starting in each hour of the day.
+HOUR_WEIGHTS = np.array([1, 1, 1, 1, 1, 2, 4, 8, 12, 14, 14, 12, 10, 12, 14, 14, 12, 8, 5, 3, 2, 2, 1, 1], dtype=float)
+HOUR_WEIGHTS /= HOUR_WEIGHTS.sum()
+
+
+def make_warehouses(rng, num_warehouses, max_clusters):
+    sizes = [SIZES[i % len(SIZES)] for i in range(num_warehouses)]
+    rng.shuffle(sizes)
+    return pd.DataFrame({
+        'WAREHOUSE_ID': np.arange(1, num_warehouses + 1),
+        'WAREHOUSE_NAME': [f'WH_{i:04d}' for i in range(1, num_warehouses + 1)],
+        'WAREHOUSE_SIZE': sizes,
+        'MAX_CLUSTERS': rng.integers(1, max_clusters + 1, num_warehouses),
+        'AUTO_SUSPEND': rng.choice(AUTO_SUSPEND_CHOICES, num_warehouses),
+        'ACTIVE_DAY_RATIO': rng.uniform(0.3, 1.0, num_warehouses),
+        'BURST_SIZE': rng.integers(5, 200, num_warehouses),
+        'QUERY_SHARE': rng.dirichlet(np.full(num_warehouses, 0.8)),
+    })
+
+
+def generate_queries(rng, warehouse, num_queries, first_day_ms, num_days):
+    """Queries for one warehouse over ``num_days`` days starting at ``first_day_ms``."""
+    active_days = np.flatnonzero(rng.random(num_days) < warehouse.ACTIVE_DAY_RATIO)
+    if len(active_days) == 0:
+        active_days = np.array([rng.integers(num_days)])
+    num_bursts = max(1, num_queries // int(warehouse.BURST_SIZE))
+    burst_start = (first_day_ms
+                   + rng.choice(active_days, num_bursts) * DAY_MS
+                   + rng.choice(24, num_bursts, p=HOUR_WEIGHTS) * HOUR_MS
+                   + rng.integers(0, HOUR_MS, num_bursts))
+    burst_length = rng.integers(60 * 1000, HOUR_MS, num_bursts)
+
+    burst = rng.integers(0, num_bursts, num_queries)
+    start = burst_start[burst] + (rng.random(num_queries) * burst_length[burst]).astype(np.int64)
+    elapsed = np.clip(rng.lognormal(np.log(1500), 1.6, num_queries), 10, 4 * HOUR_MS).astype(np.int64)
+    # Extra clusters only pick up work under concurrency, so they see fewer queries.
+    cluster = np.minimum(rng.geometric(0.7, num_queries), warehouse.MAX_CLUSTERS)
+    order = np.argsort(start, kind='stable')
+    return start[order], elapsed[order], cluster[order]
+
+
+def cluster_uptime_by_hour(start, end, cluster, auto_suspend_s):
+    """Seconds of uptime per hour across all clusters of one warehouse."""
+    order = np.lexsort((start, cluster))
+    run_start, run_end, _ = merge_intervals(
+        start[order], end[order] + auto_suspend_s * 1000, cluster[order])
+    run_end = np.maximum(run_end, run_start + 60 * 1000)
+    _, hour, duration = split_by_hour(run_start, run_end)
+    return pd.Series(duration / 1000.0).groupby(hour).sum()
+
+
+def query_frame(rng, warehouse, start, elapsed, cluster, first_query_id):
+    n = len(start)
+    # A few queries are served without a warehouse, e.g. from the result cache.
+    no_warehouse = rng.random(n) < 0.02
+    size = np.where(no_warehouse, None, warehouse.WAREHOUSE_SIZE)
+    return pd.DataFrame({
+        'QUERY_ID': np.arange(first_query_id, first_query_id + n),
+        'WAREHOUSE_ID': warehouse.WAREHOUSE_ID,
+        'WAREHOUSE_NAME': warehouse.WAREHOUSE_NAME,
+        'WAREHOUSE_SIZE': size,
+        'CLUSTER_NUMBER': np.where(no_warehouse, np.nan, cluster),
+        'START_TIME': pd.to_datetime(start, unit='ms'),
+        'END_TIME': pd.to_datetime(start + elapsed, unit='ms'),
+        'TOTAL_ELAPSED_TIME': np.where(no_warehouse, np.minimum(elapsed, 50), elapsed),
+    })
+
+
+def metering_frame(warehouse, uptime_s):
+    credits_per_hour = CREDITS_PER_HOUR[warehouse.WAREHOUSE_SIZE]
+    hours = pd.to_datetime(uptime_s.index.values, unit='ms')
+    compute = np.minimum(uptime_s.values, 3600 * warehouse.MAX_CLUSTERS) / 3600 * credits_per_hour
+    cloud_services = compute * 0.04
+    return pd.DataFrame({
+        'START_TIME': hours,
+        'END_TIME': hours + pd.Timedelta(hours=1),
+        'WAREHOUSE_ID': warehouse.WAREHOUSE_ID,
+        'WAREHOUSE_NAME': warehouse.WAREHOUSE_NAME,
+        'CREDITS_USED': compute + cloud_services,
+        'CREDITS_USED_COMPUTE': compute,
+        'CREDITS_USED_CLOUD_SERVICES': cloud_services,
+    })
+
+
+def generate(path, num_queries=100000, num_warehouses=10, days=30, seed=0,
+             end_date=None, max_clusters=3, chunk_size=1000000):
+    """Write synthetic history to ``path`` and return the warehouse settings used."""
+    rng = np.random.default_rng(seed)
+    end_date = end_date or datetime.date.today()
+    first_day_ms = int(pd.Timestamp(end_date - datetime.timedelta(days=days)).value // 10**6)
+    warehouses = make_warehouses(rng, num_warehouses, max_clusters)
+    counts = rng.multinomial(num_queries, warehouses['QUERY_SHARE'])
+
+    os.makedirs(path, exist_ok=True)
+    query_writer = None
+    metering = []
+    next_query_id = 1
+    for warehouse, count in zip(warehouses.itertuples(index=False), counts):
+        # Split large warehouses into blocks of days of at most chunk_size
+        # queries, or single days if a day has more than that.
+        num_blocks = min(days, max(1, -(-count // chunk_size)))
+        block_days = np.array_split(np.arange(days), num_blocks)
+        block_counts = rng.multinomial(count, [len(b) / days for b in block_days])
+        uptime = []
+        for block, block_count in zip(block_days, block_counts):
+            if block_count == 0:
+                continue
+            start, elapsed, cluster = generate_queries(
+                rng, warehouse, block_count, first_day_ms + int(block[0]) * DAY_MS, len(block))
+            uptime.append(cluster_uptime_by_hour(start, start + elapsed, cluster, warehouse.AUTO_SUSPEND))
+            table = pa.Table.from_pandas(
+                query_frame(rng, warehouse, start, elapsed, cluster, next_query_id), preserve_index=False)
+            if query_writer is None:
+                query_writer = pq.ParquetWriter(os.path.join(path, 'query_history.parquet'), table.schema)
+            query_writer.write_table(table.cast(query_writer.schema))
+            next_query_id += block_count
+        if uptime:
+            metering.append(metering_frame(warehouse, pd.concat(uptime).groupby(level=0).sum()))
+    if query_writer is not None:
+        query_writer.close()
+    pd.concat(metering, ignore_index=True).to_parquet(
+        os.path.join(path, 'warehouse_metering_history.parquet'), index=False)
+    return warehouses.drop(columns=['QUERY_SHARE'])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('path', help="Directory to write the Parquet files to")
+    parser.add_argument('--queries', type=int, default=100000)
+    parser.add_argument('--warehouses', type=int, default=10)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--max-clusters', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--end-date', type=datetime.date.fromisoformat, default=None,
+                        help="Last day of generated history (default: today)")
+    parser.add_argument('--chunk-size', type=int, default=1000000)
+    args = parser.parse_args()
+    print(generate(args.path, args.queries, args.warehouses, args.days, args.seed,
+                   end_date=args.end_date, max_clusters=args.max_clusters, chunk_size=args.chunk_size).to_string(index=False))
@@ -0,0 +1,72 @@
+"""Server-side filtering, sorting and paging of the warehouse table.
+
+``Styler.background_gradient`` over the whole frame builds HTML and CSS for
+every cell on each rerun.  Instead, the gradient position of every cell is
+computed once per frame, relative to its whole column like
+``background_gradient(axis=0)``, and only the visible page is styled using
+those precomputed values.  Sort orders are computed once per column and
+direction, so a rerun only filters, slices and styles one page.
+"""
+import math
+
+import numpy as np
+
+from utilization import TABLE_FORMAT, warehouse_table
+
+PAGE_SIZES = [25, 50, 100, 250]
+PAGE_SIZE = 50
+
+
+class TableView:
+    """The warehouse table of a summary frame, served one page at a time.
+
+    Instances are cached and shared between sessions, treat them as read-only.
+    """
+
+    def __init__(self, df):
+        self.table = warehouse_table(df).reset_index(drop=True)
+        numeric = self.table.select_dtypes('number')
+        low, high = numeric.min(), numeric.max()
+        # A column with a single value gets the low end of the colormap.
+        self.shades = ((numeric - low) / (high - low).where(high > low)).fillna(0).astype(np.float32)
+        self.shades[numeric.isna()] = np.nan
+        self._search_text = (self.table['WAREHOUSE_NAME'].astype(str) + '\n' +
+                             self.table['WAREHOUSE_SIZE'].astype(str)).str.lower()
+        self._orders = {}
+
+    def __len__(self):
+        return len(self.table)
+
+    def matches(self, search=''):
+        """Boolean mask of rows whose warehouse name or size contains ``search``."""
+        if not search:
+            return np.ones(len(self.table), dtype=bool)
+        return self._search_text.str.contains(search.lower(), regex=False).to_numpy()
+
+    def page(self, mask, sort_by='UTILIZATION', descending=True, page=1, page_size=PAGE_SIZE):
+        """Rows ``page`` (from 1) of the ``mask``-ed rows sorted by ``sort_by``.
+
+        Returns the page of the table and the matching gradient shades.
+        """
+        order = self._order(sort_by, descending)
+        rows = order[mask[order]]
+        rows = rows[(page - 1) * page_size:page * page_size]
+        return self.table.iloc[rows], self.shades.iloc[rows]
+
+    def pages(self, mask, page_size=PAGE_SIZE):
+        return max(1, math.ceil(int(mask.sum()) / page_size))
+
+    def _order(self, column, descending):
+        key = (column, descending)
+        order = self._orders.get(key)
+        if order is None:
+            # Missing values go last in both directions.
+            order = self._orders[key] = self.table[column].sort_values(
+                ascending=not descending, kind='stable', na_position='last').index.to_numpy()
+        return order
+
+
+def style_page(rows, shades):
+    """Style one page like the full table, using the precomputed gradient."""
+    return rows.style.background_gradient(
+        gmap=shades, subset=list(shades.columns), axis=None, vmin=0, vmax=1).format(TABLE_FORMAT)
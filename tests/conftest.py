@@ -0,0 +1,25 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+# The modules live at the top of the repository, next to streamlit_app.py.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def local_source(tmp_path):
+    pytest.importorskip('duckdb')
+    from data_source import LocalDataSource
+
+    def write(queries, metering):
+        queries = pd.DataFrame(queries)
+        queries = queries.assign(WAREHOUSE_ID=1, WAREHOUSE_NAME='WH', WAREHOUSE_SIZE='Small', CLUSTER_NUMBER=1,
+                                 TOTAL_ELAPSED_TIME=(queries['END_TIME'] - queries['START_TIME']) // pd.Timedelta('1ms'))
+        queries.to_parquet(tmp_path / 'query_history.parquet')
+        metering = pd.DataFrame(metering)
+        metering.assign(END_TIME=metering['START_TIME'] + pd.Timedelta(hours=1), WAREHOUSE_ID=1,
+                        WAREHOUSE_NAME='WH').to_parquet(tmp_path / 'warehouse_metering_history.parquet')
+        return LocalDataSource(str(tmp_path))
+    return write
@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from busy_time import BUSY_GROUP, BusyTimeAccumulator, busy_time
+
+DAY = pd.Timestamp('2024-01-01')
+
+
+def random_queries(seed, n=300):
+    rng = np.random.default_rng(seed)
+    start = DAY + pd.to_timedelta(rng.integers(0, 6 * 3600 * 1000, n), unit='ms')
+    queries = pd.DataFrame({
+        'WAREHOUSE_NAME': rng.choice(['A', 'B'], n),
+        'WAREHOUSE_SIZE': rng.choice(['Small', 'Large'], n),
+        'CLUSTER_NUMBER': rng.integers(0, 2, n),
+        'START_TIME': start,
+        'END_TIME': start + pd.to_timedelta(rng.integers(0, 40 * 60 * 1000, n), unit='ms'),
+    })
+    return queries.sort_values(BUSY_GROUP + ['START_TIME'], ignore_index=True)
+
+
+def brute_busy_time(queries):
+    # Mark every busy millisecond, then count them per hour.
+    busy = {}
+    for key, rows in queries.groupby(BUSY_GROUP):
+        origin = DAY.value // 10**6
+        mask = np.zeros(8 * 3600 * 1000, dtype=bool)
+        for start, end in zip(rows['START_TIME'], rows['END_TIME']):
+            mask[start.value // 10**6 - origin:end.value // 10**6 - origin] = True
+        per_hour = mask.reshape(-1, 3600 * 1000).sum(axis=1)
+        for hour in np.flatnonzero(per_hour):
+            busy[key + (DAY + pd.Timedelta(hours=int(hour)),)] = int(per_hour[hour])
+    return busy
+
+
+def as_dict(result):
+    return {tuple(row[:-1]): row[-1] for row in result[BUSY_GROUP + ['HOUR', 'BUSY_MS']].itertuples(index=False)}
+
+
+@pytest.mark.parametrize('seed', range(3))
+@pytest.mark.parametrize('chunk_size', [1, 7, 50, 1000])
+def test_busy_time_matches_brute_force_for_any_chunk_size(seed, chunk_size):
+    queries = random_queries(seed)
+    chunks = [queries.iloc[i:i + chunk_size] for i in range(0, len(queries), chunk_size)]
+    assert as_dict(busy_time(chunks)) == brute_busy_time(queries)
+
+
+def test_overlapping_queries_are_counted_once():
+    queries = pd.DataFrame({
+        'WAREHOUSE_NAME': ['A', 'A'],
+        'WAREHOUSE_SIZE': ['Small', 'Small'],
+        'CLUSTER_NUMBER': [0, 0],
+        'START_TIME': [DAY, DAY + pd.Timedelta(minutes=10)],
+        'END_TIME': [DAY + pd.Timedelta(minutes=30), DAY + pd.Timedelta(minutes=20)],
+    })
+    result = busy_time([queries.iloc[:1], queries.iloc[1:]])
+    assert result['BUSY_MS'].tolist() == [30 * 60 * 1000]
+
+
+def test_tz_aware_times_keep_their_wall_clock_hour():
+    queries = pd.DataFrame({
+        'WAREHOUSE_NAME': ['A'],
+        'WAREHOUSE_SIZE': ['Small'],
+        'CLUSTER_NUMBER': [0],
+        'START_TIME': [pd.Timestamp('2024-01-01 10:30', tz='America/Los_Angeles')],
+        'END_TIME': [pd.Timestamp('2024-01-01 10:45', tz='America/Los_Angeles')],
+    })
+    result = busy_time([queries])
+    assert result['HOUR'].tolist() == [pd.Timestamp('2024-01-01 10:00')]
+
+
+def test_empty():
+    accumulator = BusyTimeAccumulator()
+    accumulator.add(random_queries(0).iloc[:0])
+    assert accumulator.result().empty
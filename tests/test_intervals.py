@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from intervals import HOUR_MS, merge_intervals, split_by_hour
+
+
+def brute_merge(starts, ends, groups):
+    runs = []
+    for start, end, group in zip(starts, ends, groups):
+        end = max(end, start)
+        if runs and runs[-1][2] == group and start <= runs[-1][1]:
+            runs[-1][1] = max(runs[-1][1], end)
+        else:
+            runs.append([start, end, group])
+    return runs
+
+
+def random_intervals(rng, n, groups=3):
+    group = np.sort(rng.integers(0, groups, n))
+    starts = rng.integers(0, 10000, n)
+    order = np.lexsort((starts, group))
+    # Some zero length and some inverted intervals, like bad QUERY_HISTORY rows.
+    ends = starts + rng.integers(-5, 500, n)
+    return starts[order], ends[order], group[order]
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_merge_intervals_matches_brute_force(seed):
+    rng = np.random.default_rng(seed)
+    starts, ends, groups = random_intervals(rng, int(rng.integers(1, 200)))
+    run_starts, run_ends, run_groups = merge_intervals(starts, ends, groups)
+    expected = brute_merge(starts, ends, groups)
+    assert [list(run) for run in zip(run_starts, run_ends, run_groups)] == expected
+
+
+def test_merge_intervals_without_groups_merges_touching_runs():
+    run_starts, run_ends, run_groups = merge_intervals([0, 10, 30], [10, 20, 40])
+    assert list(run_starts) == [0, 30]
+    assert list(run_ends) == [20, 40]
+    assert run_groups is None
+
+
+def test_merge_intervals_keeps_groups_apart():
+    run_starts, run_ends, run_groups = merge_intervals([0, 5], [10, 20], [1, 2])
+    assert list(zip(run_starts, run_ends, run_groups)) == [(0, 10, 1), (5, 20, 2)]
+
+
+def test_merge_intervals_empty():
+    run_starts, run_ends, run_groups = merge_intervals([], [], [])
+    assert len(run_starts) == len(run_ends) == len(run_groups) == 0
+
+
+def test_split_by_hour():
+    index, hours, durations = split_by_hour([HOUR_MS - 10, 5, 7], [2 * HOUR_MS + 10, 5, 8])
+    assert list(index) == [0, 0, 0, 2]
+    assert list(hours) == [0, HOUR_MS, 2 * HOUR_MS, 0]
+    assert list(durations) == [10, HOUR_MS, 10, 1]
@@ -0,0 +1,26 @@
+import json
+
+import pytest
+
+from report import read_accounts
+
+
+def write_accounts(tmp_path, names):
+    path = tmp_path / 'accounts.json'
+    path.write_text(json.dumps([{'name': name, 'local': str(tmp_path)} for name in names]))
+    return str(path)
+
+
+def test_accounts_need_unique_names(tmp_path):
+    assert len(read_accounts(write_accounts(tmp_path, ['prod', 'dev']))) == 2
+    with pytest.raises(ValueError, match='unique'):
+        read_accounts(write_accounts(tmp_path, ['prod', 'prod']))
+    # Both would be written to prod_1.<format>.
+    with pytest.raises(ValueError, match='unique'):
+        read_accounts(write_accounts(tmp_path, ['prod 1', 'prod/1']))
+
+
+@pytest.mark.parametrize('name', ['combined', 'Combined'])
+def test_an_account_cannot_overwrite_the_combined_file(tmp_path, name):
+    with pytest.raises(ValueError, match='combined'):
+        read_accounts(write_accounts(tmp_path, ['prod', name]))
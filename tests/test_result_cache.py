@@ -0,0 +1,87 @@
+import threading
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+import pytest
+
+from result_cache import ResultCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_entries_expire_and_least_recently_used_is_evicted():
+    clock = Clock()
+    cache = ResultCache(max_entries=2, ttl=10, clock=clock)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    clock.now = 10
+    assert cache.get('a') is None
+    assert cache.get('c') is None
+
+
+def test_concurrent_misses_compute_once():
+    cache = ResultCache()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return 'value'
+
+    with ThreadPoolExecutor(4) as pool:
+        leader = pool.submit(cache.get_or_compute, 'key', compute)
+        started.wait(5)
+        followers = [pool.submit(cache.get_or_compute, 'key', compute) for _ in range(3)]
+        release.set()
+        assert [f.result() for f in [leader] + followers] == ['value'] * 4
+    assert len(calls) == 1
+
+
+def test_errors_are_shared_and_not_cached():
+    cache = ResultCache()
+    started, release = threading.Event(), threading.Event()
+
+    def fail():
+        started.set()
+        release.wait(5)
+        raise ValueError('boom')
+
+    with ThreadPoolExecutor(2) as pool:
+        leader = pool.submit(cache.get_or_compute, 'key', fail)
+        started.wait(5)
+        follower = pool.submit(cache.get_or_compute, 'key', lambda: 'unused')
+        release.set()
+        for future in (leader, follower):
+            with pytest.raises(ValueError):
+                future.result()
+    assert cache.get_or_compute('key', lambda: 'value') == 'value'
+
+
+def test_waiters_retry_when_the_leader_is_cancelled():
+    cache = ResultCache()
+    started, release = threading.Event(), threading.Event()
+
+    def cancelled():
+        started.set()
+        release.wait(5)
+        raise CancelledError()
+
+    with ThreadPoolExecutor(2) as pool:
+        leader = pool.submit(cache.get_or_compute, 'key', cancelled)
+        started.wait(5)
+        follower = pool.submit(cache.get_or_compute, 'key', lambda: 'value')
+        release.set()
+        with pytest.raises(CancelledError):
+            leader.result()
+        assert follower.result() == 'value'
+    assert cache.get('key') == 'value'
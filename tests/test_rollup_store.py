@@ -0,0 +1,107 @@
+import datetime
+
+import pandas as pd
+import pytest
+
+from rollup_store import HourlyRollupStore
+
+TZ = 'America/Los_Angeles'
+UTC = datetime.timezone.utc
+
+
+class Source:
+    """Hourly rollup with one row per hour, recording every fetched range."""
+
+    def __init__(self, tz=None):
+        self.tz = tz
+        self.calls = []
+
+    def __call__(self, start, end):
+        self.calls.append((start, end))
+        hours = pd.date_range(start, end, freq='h', inclusive='left')
+        # Snowflake returns hours in the session time zone, DuckDB as naive UTC.
+        hours = hours.tz_convert(self.tz) if self.tz else hours.tz_localize(None)
+        return pd.DataFrame({'HOUR': hours, 'WAREHOUSE_NAME': 'A', 'WAREHOUSE_SIZE': 'Small',
+                             'CREDITS_USED': 1.0})
+
+
+def hour(day, h=0, month=1):
+    return datetime.datetime(2024, month, day, h)
+
+
+def utc(day, h=0, month=1):
+    return hour(day, h, month).replace(tzinfo=UTC)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return HourlyRollupStore(str(tmp_path))
+
+
+def test_only_missing_hours_are_fetched(store):
+    fetch = Source()
+    now = hour(20)
+    assert len(store.get_range(fetch, hour(3), hour(5), now=now)) == 48
+    assert len(store.get_range(fetch, hour(9), hour(11), now=now)) == 48
+    assert store.covered == [(hour(3), hour(5)), (hour(9), hour(11))]
+
+    # Only the gaps are fetched, not the hours between the covered ranges.
+    assert len(store.get_range(fetch, hour(1), hour(13), now=now)) == 288
+    assert fetch.calls[2:] == [(utc(1), utc(3)), (utc(5), utc(9)), (utc(11), utc(13))]
+    assert store.covered == [(hour(1), hour(13))]
+
+    fetch.calls.clear()
+    assert len(store.get_range(fetch, hour(2), hour(6), now=now)) == 96
+    assert fetch.calls == []
+
+
+def test_open_hours_are_fetched_live_and_never_stored(store, tmp_path):
+    fetch = Source()
+    now = hour(4, 10) + datetime.timedelta(minutes=30)
+    result = store.get_range(fetch, hour(2), hour(3), now=now)
+    assert len(result) == 24
+    # Metering lags by three hours and queries running now may have started
+    # up to two days ago, so the last 51 hours are not final yet.
+    assert store.covered == [(hour(2), hour(2, 7))]
+
+    fetch.calls.clear()
+    HourlyRollupStore(str(tmp_path)).get_range(fetch, hour(2), hour(3), now=now)
+    assert fetch.calls == [(utc(2, 7), utc(3))]
+
+
+def test_hours_are_returned_in_the_session_time_zone(store, tmp_path):
+    fetch = Source(tz=TZ)
+    now = hour(10)
+    result = store.get_range(fetch, datetime.date(2024, 1, 1), datetime.date(2024, 1, 3), now=now, tz=TZ)
+    assert len(result) == 48
+    assert result['HOUR'].dt.tz is None
+    assert result['HOUR'].iloc[0] == pd.Timestamp('2024-01-01 00:00')
+    assert fetch.calls == [(utc(1, 8), utc(3, 8))]
+    assert store.covered == [(hour(1, 8), hour(3, 8))]
+
+    reloaded = HourlyRollupStore(str(tmp_path))
+    again = reloaded.get_range(fetch, datetime.date(2024, 1, 1), datetime.date(2024, 1, 3), now=now, tz=TZ)
+    assert again['HOUR'].tolist() == result['HOUR'].tolist()
+    assert len(fetch.calls) == 1
+
+
+def test_repeated_hour_at_end_of_daylight_saving_time_is_kept(store, tmp_path):
+    fetch = Source(tz=TZ)
+    now = hour(10, month=11)
+    day = datetime.date(2024, 11, 3)
+    result = store.get_range(fetch, day, day + datetime.timedelta(days=1), now=now, tz=TZ)
+    assert len(result) == 25
+    assert (result['HOUR'] == pd.Timestamp('2024-11-03 01:00')).sum() == 2
+
+    reloaded = HourlyRollupStore(str(tmp_path)).get_range(
+        fetch, day, day + datetime.timedelta(days=1), now=now, tz=TZ)
+    assert len(reloaded) == 25
+    assert len(fetch.calls) == 1
+
+
+def test_stores_of_another_version_are_rebuilt(store, tmp_path):
+    fetch = Source()
+    store.get_range(fetch, hour(1), hour(2), now=hour(10))
+    meta = tmp_path / 'meta.json'
+    meta.write_text('{"low": "2024-01-01T00:00:00", "high": "2024-01-02T00:00:00"}')
+    assert HourlyRollupStore(str(tmp_path)).covered == []
@@ -0,0 +1,155 @@
+import pandas as pd
+import pytest
+
+from data_source import SnowflakeDataSource
+from result_cache import ResultCache
+from session_pool import SessionPool
+from utilization import Query
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeJob:
+    def __init__(self, query_id, error=None):
+        self.query_id = query_id
+        self.error = error
+
+    def result(self, kind):
+        if self.error is not None:
+            raise self.error
+        df = pd.DataFrame({'QUERY_ID': [self.query_id]})
+        return iter([df]) if kind == 'pandas_batches' else df
+
+    def cancel(self):
+        pass
+
+
+class FakeSession:
+    """Answers the pool's and the data source's queries; query IDs count up."""
+
+    def __init__(self):
+        self.queries = []
+        self.expired = set()
+        self.broken = False
+        self.closed = False
+
+    def sql(self, text, params=None):
+        self.queries.append(text)
+        return FakeDataFrame(self, text)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeDataFrame:
+    def __init__(self, session, text):
+        self.session = session
+        self.text = text
+
+    def collect(self, statement_params=None):
+        if self.session.broken:
+            raise RuntimeError('session expired')
+        if 'CURRENT_USER' in self.text:
+            return [('ACCOUNT', 'USER', 'ROLE')]
+        return [('ACCOUNT', 'ROLE', 'SNOWFLAKE', 'ACCOUNT_USAGE')]
+
+    def collect_nowait(self, statement_params=None):
+        query_id = f'01-{len(self.session.queries):04}'
+        if any(f"RESULT_SCAN('{expired}')" in self.text for expired in self.session.expired):
+            return FakeJob(query_id, RuntimeError('result expired'))
+        return FakeJob(query_id)
+
+
+@pytest.fixture
+def pool():
+    clock = Clock()
+    created = []
+
+    def create(params):
+        created.append(FakeSession())
+        return created[-1]
+
+    pool = SessionPool(create, keep_alive=600, check_interval=60, max_idle=3600, clock=clock)
+    pool.clock, pool.created = clock, created
+    yield pool
+    pool.close()
+
+
+def test_sessions_are_shared_by_the_same_login(pool):
+    prod = pool.get({'account': 'a', 'user': 'u', 'warehouse': 'W1'})
+    assert pool.get({'account': 'a', 'user': 'u', 'warehouse': 'W1'}) is prod
+    other = pool.get({'account': 'a', 'user': 'u', 'warehouse': 'W2'})
+    assert other is not prod
+    assert len(pool.created) == 2
+    # Another warehouse of the same user and role reads the same results.
+    assert other.query_ids is prod.query_ids
+    assert pool.get({'account': 'a', 'user': 'v'}).query_ids is not prod.query_ids
+
+
+def test_broken_sessions_are_replaced_once_due_for_a_check(pool):
+    params = {'account': 'a', 'user': 'u'}
+    pooled = pool.get(params)
+    pooled.session.broken = True
+    pool.clock.now = 59
+    assert pool.get(params) is pooled
+    pool.clock.now = 60
+    replaced = pool.get(params)
+    assert replaced is not pooled
+    assert pooled.session.closed
+    assert pool.created == [pooled.session, replaced.session]
+
+
+def test_idle_sessions_are_closed_and_the_others_kept_alive(pool):
+    idle = pool.get({'account': 'a', 'user': 'u'})
+    adopted = pool.adopt(FakeSession())
+    assert pool.adopt(adopted.session) is adopted
+    pool.clock.now = 3000
+    busy = pool.get({'account': 'a', 'user': 'v'})
+    pool.clock.now = 3600
+    pool.maintain()
+    assert idle.session.closed
+    # The pool never closes sessions it did not log in.
+    assert not adopted.session.closed
+    assert not busy.session.closed
+    assert busy.session.queries[-1] == "SELECT 1"
+    pool.close()
+    assert busy.session.closed
+    assert not adopted.session.closed
+
+
+def test_result_scan_keeps_the_expiry_of_the_remembered_result():
+    clock = Clock()
+    session = FakeSession()
+    source = SnowflakeDataSource(session, ResultCache(ttl=100, clock=clock))
+    query = Query("SELECT * FROM QUERY_HISTORY WHERE START_TIME >= ?", ('2024-01-01',))
+    first = source.sql(query)['QUERY_ID'][0]
+
+    clock.now = 60
+    assert source.sql(query)['QUERY_ID'][0] != first
+    assert session.queries[-1] == f"SELECT * FROM TABLE(RESULT_SCAN('{first}'))"
+    assert list(source.iter_batches(query))[0]['QUERY_ID'][0] != first
+    assert session.queries[-1] == f"SELECT * FROM TABLE(RESULT_SCAN('{first}'))"
+
+    # The result scans did not extend or replace what is remembered.
+    clock.now = 100
+    source.sql(query)
+    assert session.queries[-1] == query.text
+
+
+def test_an_expired_result_is_run_again_and_remembered():
+    session = FakeSession()
+    source = SnowflakeDataSource(session, ResultCache())
+    query = Query("SELECT * FROM QUERY_HISTORY WHERE START_TIME >= ?", ('2024-01-01',))
+    first = source.sql(query)['QUERY_ID'][0]
+    session.expired.add(first)
+
+    rerun = source.sql(query)['QUERY_ID'][0]
+    assert session.queries[-2:] == [f"SELECT * FROM TABLE(RESULT_SCAN('{first}'))", query.text]
+    source.sql(query)
+    assert session.queries[-1] == f"SELECT * FROM TABLE(RESULT_SCAN('{rerun}'))"
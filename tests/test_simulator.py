@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from simulator import MIN_BILLED_MS, best_settings, billed_ms, simulate, simulate_warehouse
+
+
+def brute_billed_ms(starts, ends, suspend_ms):
+    # Replay one cluster query by query: it resumes at a query start and
+    # suspends suspend_ms after the last running query, billing at least 60s
+    # per resume but never past the next resume.
+    sessions = []
+    for start, end in sorted(zip(starts, ends)):
+        end = max(end, start)
+        if sessions and start <= sessions[-1][1] + suspend_ms:
+            sessions[-1][1] = max(sessions[-1][1], end)
+        else:
+            sessions.append([start, end])
+    billed = 0
+    for i, (start, last_end) in enumerate(sessions):
+        length = last_end + suspend_ms - start
+        next_start = sessions[i + 1][0] if i + 1 < len(sessions) else np.inf
+        billed += max(length, min(MIN_BILLED_MS, next_start - start))
+    return billed
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_billed_ms_matches_brute_force(seed):
+    rng = np.random.default_rng(seed)
+    n = int(rng.integers(1, 150))
+    starts = rng.integers(0, 3600 * 1000, n)
+    ends = starts + rng.integers(0, 120 * 1000, n)
+    clusters = rng.integers(0, 3, n)
+    suspends_ms = np.array([0, 10, 30, 60, 120, 600]) * 1000
+    expected = [sum(brute_billed_ms(starts[clusters == c], ends[clusters == c], suspend)
+                    for c in np.unique(clusters))
+                for suspend in suspends_ms]
+    assert billed_ms(starts, ends, clusters, suspends_ms) == pytest.approx(expected)
+
+
+def test_a_short_query_is_billed_the_minimum():
+    assert billed_ms(np.array([0]), np.array([10 * 1000]), np.array([0]), [30 * 1000]).tolist() == [MIN_BILLED_MS]
+
+
+def test_a_larger_warehouse_runs_queries_faster():
+    rows = simulate_warehouse('A', 'Small', np.array([0]), np.array([3600 * 1000]), np.array([0]), [60], (0, 1))
+    (_, _, small, _, small_hours, small_credits), (_, _, medium, _, medium_hours, medium_credits) = rows
+    assert (small, medium) == ('Small', 'Medium')
+    assert small_hours == pytest.approx(1 + 1 / 60)
+    assert medium_hours == pytest.approx(0.5 + 1 / 60)
+    assert small_credits == pytest.approx(2 * small_hours)
+    assert medium_credits == pytest.approx(4 * medium_hours)
+
+
+def test_simulate_in_process_and_savings_against_the_current_setting():
+    start = pd.Timestamp('2024-01-01')
+    chunk = pd.DataFrame({
+        'WAREHOUSE_NAME': ['A', 'A'],
+        'WAREHOUSE_SIZE': ['Small', 'Small'],
+        'CLUSTER_NUMBER': [0, 0],
+        'START_TIME': [start, start + pd.Timedelta(minutes=30)],
+        'END_TIME': [start + pd.Timedelta(minutes=1), start + pd.Timedelta(minutes=31)],
+    })
+    simulation = simulate([chunk], [60, 600], size_steps=(0,), processes=False)
+    assert simulation['AUTO_SUSPEND'].tolist() == [60, 600]
+
+    actual = pd.DataFrame({'WAREHOUSE_NAME': ['A'], 'WAREHOUSE_SIZE': ['Small'], 'ACTUAL_CREDITS': [100.0]})
+    best = best_settings(simulation, actual, {'A': 600}).iloc[0]
+    current = simulation.set_index('AUTO_SUSPEND')['SIMULATED_CREDITS']
+    assert best['AUTO_SUSPEND'] == 60
+    assert best['CURRENT_CREDITS'] == pytest.approx(current[600])
+    assert best['SAVINGS'] == pytest.approx(current[600] - current[60])
+
+    never = best_settings(simulation, actual, {'A': None}).iloc[0]
+    assert np.isnan(never['SAVINGS'])
+
+
+def test_other_sizes_are_shown_but_not_chosen():
+    start = pd.Timestamp('2024-01-01')
+    chunk = pd.DataFrame({
+        'WAREHOUSE_NAME': ['A', 'A'],
+        'WAREHOUSE_SIZE': ['X-Small', 'X-Small'],
+        'CLUSTER_NUMBER': [0, 0],
+        'START_TIME': [start, start + pd.Timedelta(minutes=30)],
+        'END_TIME': [start + pd.Timedelta(minutes=1), start + pd.Timedelta(minutes=31)],
+    })
+    simulation = simulate([chunk], [60, 600], processes=False)
+    credits = simulation.set_index(['SIMULATED_SIZE', 'AUTO_SUSPEND'])['SIMULATED_CREDITS']
+    actual = pd.DataFrame({'WAREHOUSE_NAME': ['A'], 'WAREHOUSE_SIZE': ['X-Small'], 'ACTUAL_CREDITS': [100.0]})
+    best = best_settings(simulation, actual, {'A': 600})
+    assert len(best) == 1
+    best = best.iloc[0]
+    assert 'SIMULATED_SIZE' not in best.index
+    assert best['SIMULATED_CREDITS'] == pytest.approx(credits['X-Small', 60])
+    assert best['LARGER_SIZE_CREDITS'] == pytest.approx(credits['Small', 60])
+    # There is no size below X-Small.
+    assert np.isnan(best['SMALLER_SIZE_CREDITS'])
+
+    actual = actual.assign(WAREHOUSE_SIZE='Small')
+    simulation = simulate([chunk.assign(WAREHOUSE_SIZE='Small')], [60, 600], processes=False)
+    credits = simulation.set_index(['SIMULATED_SIZE', 'AUTO_SUSPEND'])['SIMULATED_CREDITS']
+    best = best_settings(simulation, actual, {'A': 600}).iloc[0]
+    # Scaled linearly, X-Small is cheaper, but the savings stay at the current size.
+    assert credits['X-Small', 60] < credits['Small', 60]
+    assert best['WAREHOUSE_SIZE'] == 'Small'
+    assert best['SAVINGS'] == pytest.approx(credits['Small', 600] - credits['Small', 60])
+    assert best['SMALLER_SIZE_CREDITS'] == pytest.approx(credits['X-Small', 60])
+    assert best['LARGER_SIZE_CREDITS'] == pytest.approx(credits['Medium', 60])
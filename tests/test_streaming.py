@@ -0,0 +1,87 @@
+import datetime
+import threading
+from concurrent.futures import CancelledError
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_source import DataSource, QueryJob
+from page_load import SessionLoader
+from streaming import StreamingAggregate, day_windows, fetch_windows
+from utilization import metering_sql
+
+
+class BlockingJob(QueryJob):
+    """Returns one batch per window, but only once released or cancelled."""
+
+    def __init__(self, release):
+        self.release = release
+        self.cancelled = threading.Event()
+
+    def batches(self):
+        while not self.release.wait(0.01):
+            if self.cancelled.is_set():
+                raise CancelledError()
+        yield pd.DataFrame({'START_TIME': [0], 'WAREHOUSE_NAME': ['A'], 'CREDITS_USED': [1.0]})
+
+    def cancel(self):
+        self.cancelled.set()
+
+
+class BlockingSource(DataSource):
+    identity = ('test',)
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.jobs = []
+
+    def submit(self, query, tag=None):
+        job = BlockingJob(self.release)
+        self.jobs.append(job)
+        return job
+
+
+def fetch(load, source, start, end):
+    return fetch_windows(load, source, metering_sql, start, end,
+                         StreamingAggregate(['START_TIME', 'WAREHOUSE_NAME'], {'CREDITS_USED': 'sum'}),
+                         'metering', max_workers=4)
+
+
+def test_day_windows_cover_the_range():
+    windows = day_windows(datetime.date(2024, 1, 1), datetime.date(2024, 3, 1), max_windows=8)
+    assert windows[0][0] == datetime.datetime(2024, 1, 1)
+    assert windows[-1][1] == datetime.datetime(2024, 3, 1)
+    assert all(a[1] == b[0] for a, b in zip(windows, windows[1:]))
+    assert len(windows) <= 8
+
+
+def test_streaming_aggregate_matches_a_single_group_by():
+    rng = np.random.default_rng(0)
+    frame = pd.DataFrame({'K': rng.integers(0, 50, 10000), 'S': rng.random(10000), 'M': rng.random(10000)})
+    aggregate = StreamingAggregate(['K'], {'S': 'sum', 'M': 'max'})
+    for i in range(0, len(frame), 333):
+        aggregate.add(frame.iloc[i:i + 333])
+    expected = frame.groupby('K', as_index=False).agg({'S': 'sum', 'M': 'max'})
+    pd.testing.assert_frame_equal(aggregate.result().sort_values('K', ignore_index=True), expected)
+
+
+def test_all_windows_are_fetched():
+    source = BlockingSource()
+    source.release.set()
+    load = SessionLoader().start('key')
+    result = fetch(load, source, datetime.date(2024, 1, 1), datetime.date(2024, 1, 20))
+    assert len(source.jobs) == 19
+    assert result['CREDITS_USED'].tolist() == [19.0]
+    assert load.progress() == (19, 19)
+
+
+def test_cancelling_the_load_stops_running_windows_and_issues_no_more():
+    source = BlockingSource()
+    load = SessionLoader().start('key')
+    threading.Timer(0.05, load.cancel).start()
+    with pytest.raises(CancelledError):
+        fetch(load, source, datetime.date(2024, 1, 1), datetime.date(2024, 1, 20))
+    # Only the windows already running on the four workers were issued.
+    assert len(source.jobs) == 4
+    assert all(job.cancelled.is_set() for job in source.jobs)
@@ -0,0 +1,81 @@
+import re
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from table_view import TableView, style_page
+from utilization import add_derived_columns
+
+
+@pytest.fixture
+def view():
+    return TableView(add_derived_columns(pd.DataFrame({
+        'WAREHOUSE_NAME': ['LOAD_WH', 'BI_WH', 'ADHOC_WH', 'DEV_WH', 'ETL_WH', 'SPARE_WH', 'TEST_WH'],
+        'WAREHOUSE_SIZE': ['Large', 'Small', 'X-Small', 'Small', 'Medium', 'Small', 'X-Small'],
+        'NUM_QUERIES': [100, 40, 10, 4, 60, 0, 2],
+        'TOTAL_ELAPSED_TIME_MS': [3.6e7, 3.6e6, 3.6e5, 1.8e5, 7.2e6, 0.0, 1.0e4],
+        'EXPECTED_CREDITS': [80.0, 2.0, 0.3, 0.02, 6.0, 0.0, 0.01],
+        'ACTUAL_CREDITS': [100.0, 10.0, 1.0, 0.5, 10.0, 2.0, 0.1],
+    })))
+
+
+def names(rows):
+    return rows['WAREHOUSE_NAME'].tolist()
+
+
+def test_pages_of_the_sorted_table(view):
+    everything = view.matches()
+    assert view.pages(everything, page_size=3) == 3
+    pages = [view.page(everything, page=page, page_size=3)[0] for page in (1, 2, 3)]
+    assert [len(rows) for rows in pages] == [3, 3, 1]
+    assert sum((names(rows) for rows in pages), []) == names(view.table)
+    assert names(pages[0]) == ['LOAD_WH', 'ETL_WH', 'ADHOC_WH']
+    assert view.page(everything, page=4, page_size=3)[0].empty
+
+
+def test_sorting_puts_missing_values_last(view):
+    everything = view.matches()
+    descending = names(view.page(everything, 'AVG_CREDITS_PER_QUERY')[0])
+    ascending = names(view.page(everything, 'AVG_CREDITS_PER_QUERY', descending=False)[0])
+    # SPARE_WH ran no queries.
+    assert descending[-1] == ascending[-1] == 'SPARE_WH'
+    assert descending[:-1] == ascending[:-1][::-1]
+
+
+def test_search_by_name_or_size(view):
+    assert names(view.table[view.matches('small')]) == ['ADHOC_WH', 'BI_WH', 'TEST_WH', 'DEV_WH', 'SPARE_WH']
+    mask = view.matches('DeV')
+    assert view.pages(mask) == 1
+    assert names(view.page(mask)[0]) == ['DEV_WH']
+    nothing = view.matches('nothing')
+    assert view.pages(nothing) == 1
+    assert view.page(nothing)[0].empty
+
+
+def test_shades_are_relative_to_the_whole_column(view):
+    shades = view.shades
+    assert shades.dtypes.eq(np.float32).all()
+    assert shades['ACTUAL_CREDITS'].min() == 0
+    assert shades['ACTUAL_CREDITS'].max() == 1
+    assert shades.loc[view.table['WAREHOUSE_NAME'] == 'SPARE_WH', 'AVG_CREDITS_PER_QUERY'].isna().all()
+    rows, page_shades = view.page(view.matches('small'), page_size=2)
+    assert page_shades.index.tolist() == rows.index.tolist()
+
+
+def background_colors(styler):
+    # Cells of the same color share one CSS rule.
+    return {(int(row), int(col)): color
+            for cells, color in re.findall(r'([^{}]+)\{\s*background-color: (#\w+)', styler.to_html())
+            for row, col in re.findall(r'_row(\d+)_col(\d+)', cells)}
+
+
+def test_a_styled_page_matches_the_styled_table(view):
+    pytest.importorskip('matplotlib')
+    numeric = list(view.shades.columns)
+    full = background_colors(view.table.style.background_gradient(subset=numeric, axis=0))
+    rows, shades = view.page(view.matches(), sort_by='WAREHOUSE_NAME', descending=False, page=2, page_size=3)
+    page = background_colors(style_page(rows, shades))
+    assert page
+    for (row, col), color in page.items():
+        assert full[view.table.index.get_loc(rows.index[row]), col] == color
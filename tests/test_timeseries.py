@@ -0,0 +1,65 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from timeseries import OTHER_WAREHOUSES, minmax_downsample, pre_aggregate, utilization_series
+from utilization import hourly_utilization_sql
+
+DAY = datetime.datetime(2024, 1, 1)
+
+
+def test_a_query_running_for_hours_uses_each_hour_fully(local_source):
+    # One Small query from 10:00 to 13:00, billed 2 credits an hour.
+    hours = pd.to_datetime(['2024-01-01 10:00', '2024-01-01 11:00', '2024-01-01 12:00'])
+    source = local_source({'START_TIME': hours[:1], 'END_TIME': pd.to_datetime(['2024-01-01 13:00'])},
+                          {'START_TIME': hours, 'CREDITS_USED': [2.0] * 3})
+    levels = pre_aggregate(source.sql(hourly_utilization_sql(DAY, DAY + datetime.timedelta(days=1))))
+    series, bucket = utilization_series(levels, DAY, DAY + datetime.timedelta(days=1))
+    assert bucket == 'HOUR'
+    assert series['START_TIME'].tolist() == list(hours)
+    assert series['UTILIZATION'].tolist() == pytest.approx([1.0] * 3)
+
+    # Years of hours are too many points even for one warehouse.
+    series, bucket = utilization_series(levels, DAY, DAY + datetime.timedelta(days=3 * 365))
+    assert bucket == 'DAY'
+    assert series['UTILIZATION'].tolist() == pytest.approx([1.0])
+
+
+def test_credits_of_a_warehouse_hour_are_counted_once():
+    hourly = pd.DataFrame({
+        'HOUR': pd.to_datetime(['2024-01-01 10:00', '2024-01-01 10:00', '2024-01-01 11:00']),
+        'WAREHOUSE_NAME': ['WH', 'WH', 'WH'],
+        'WAREHOUSE_SIZE': ['Small', 'Medium', 'Small'],
+        'EXPECTED_CREDITS': [1.0, 2.0, 0.5],
+        'CREDITS_USED': [4.0, 4.0, 1.0],
+    })
+    levels = pre_aggregate(hourly)
+    assert levels['HOUR'][['EXPECTED_CREDITS', 'CREDITS_USED']].values.tolist() == [[3.0, 4.0], [0.5, 1.0]]
+    assert levels['DAY'][['EXPECTED_CREDITS', 'CREDITS_USED']].values.tolist() == [[3.5, 5.0]]
+
+
+def test_small_warehouses_are_folded_into_one_line():
+    hourly = pd.DataFrame({
+        'HOUR': pd.Timestamp('2024-01-01 10:00'),
+        'WAREHOUSE_NAME': ['A', 'B', 'C', 'D'],
+        'EXPECTED_CREDITS': [4.0, 1.0, 1.0, 0.0],
+        'CREDITS_USED': [8.0, 1.0, 2.0, 1.0],
+    })
+    series, _ = utilization_series(pre_aggregate(hourly), DAY, DAY + datetime.timedelta(days=1), max_series=2)
+    assert series[['WAREHOUSE_NAME', 'UTILIZATION']].values.tolist() == [['A', 0.5], [OTHER_WAREHOUSES, 0.5]]
+
+
+def test_downsampling_keeps_the_extremes_of_every_pixel():
+    start = DAY
+    times = pd.date_range(start, periods=100, freq='h')
+    utilization = np.full(100, 0.5)
+    utilization[37], utilization[38] = 3.0, 0.0
+    frame = pd.DataFrame({'START_TIME': times, 'WAREHOUSE_NAME': 'WH', 'UTILIZATION': utilization})
+    assert minmax_downsample(frame, 100, start, times[-1]) is frame
+
+    sampled = minmax_downsample(frame, 10, start, start + datetime.timedelta(hours=100))
+    assert len(sampled) <= 10
+    assert sampled['START_TIME'].is_monotonic_increasing
+    assert {37, 38} <= set(sampled.index)
@@ -0,0 +1,203 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from busy_time import busy_intervals_sql, busy_time
+from utilization import (MAX_METERING_POINTS, METERING_BUCKETS, add_derived_columns, add_true_utilization,
+                         coarsen_metering, hourly_utilization_sql, metering_bucket, summarize_hourly,
+                         with_time_units)
+
+DAY = datetime.date(2024, 1, 1)
+
+
+def hours(*values):
+    return pd.to_datetime([f'2024-01-01 {value}' for value in values])
+
+
+def rollup(source, start, end):
+    return source.sql(hourly_utilization_sql(start, end)).sort_values('HOUR', ignore_index=True)
+
+
+def test_queries_are_split_over_the_hours_they_ran_in(local_source):
+    # One Small query from 10:00 to 13:00, billed 2 credits an hour.
+    source = local_source({'START_TIME': hours('10:00'), 'END_TIME': hours('13:00')},
+                          {'START_TIME': hours('10:00', '11:00', '12:00'), 'CREDITS_USED': [2.0] * 3})
+    hourly = rollup(source, DAY, DAY + datetime.timedelta(days=1))
+    assert hourly['HOUR'].tolist() == list(hours('10:00', '11:00', '12:00'))
+    assert hourly['NO_OF_QUERIES'].tolist() == [1, 0, 0]
+    assert hourly['TOTAL_ELAPSED_TIME'].tolist() == [3600000] * 3
+    assert hourly['EXPECTED_CREDITS'].tolist() == pytest.approx([2.0] * 3)
+    assert hourly['CREDITS_USED'].tolist() == [2.0] * 3
+
+    summary = summarize_hourly(hourly)
+    assert summary['EXPECTED_CREDITS'].tolist() == pytest.approx([6.0])
+    assert summary['ACTUAL_CREDITS'].tolist() == [6.0]
+
+
+def test_partial_hours_and_queries_started_before_the_range(local_source):
+    source = local_source({'START_TIME': hours('10:30'), 'END_TIME': hours('12:30')},
+                          {'START_TIME': hours('10:00', '11:00', '12:00'), 'CREDITS_USED': [1.0] * 3})
+    hourly = rollup(source, datetime.datetime(2024, 1, 1, 11), datetime.datetime(2024, 1, 1, 13))
+    assert hourly['HOUR'].tolist() == list(hours('11:00', '12:00'))
+    # The query started before the range, so it is not counted again.
+    assert hourly['NO_OF_QUERIES'].tolist() == [0, 0]
+    assert hourly['TOTAL_ELAPSED_TIME'].tolist() == [3600000, 1800000]
+
+
+def test_billed_hours_without_queries_keep_their_credits(local_source):
+    source = local_source({'START_TIME': hours('10:00'), 'END_TIME': hours('10:20')},
+                          {'START_TIME': hours('10:00', '11:00'), 'CREDITS_USED': [1.0, 0.5]})
+    hourly = rollup(source, DAY, DAY + datetime.timedelta(days=1))
+    assert hourly['CREDITS_USED'].tolist() == [1.0, 0.5]
+    assert hourly['WAREHOUSE_NAME'].tolist() == ['WH', 'WH']
+    assert hourly['WAREHOUSE_SIZE'].isna().tolist() == [False, True]
+
+    summary = summarize_hourly(hourly)
+    assert summary[['WAREHOUSE_SIZE', 'ACTUAL_CREDITS']].values.tolist() == [['Small', 1.5]]
+
+
+def test_idle_hours_get_the_size_the_warehouse_ran_at():
+    hourly = pd.DataFrame({
+        'HOUR': hours('09:00', '10:00', '11:00', '12:00', '10:00'),
+        'WAREHOUSE_NAME': ['A', 'A', 'A', 'A', 'B'],
+        'WAREHOUSE_SIZE': [None, 'Small', None, 'Large', None],
+        'NO_OF_QUERIES': [0, 1, 0, 1, 0],
+        'TOTAL_ELAPSED_TIME': [0, 100, 0, 100, 0],
+        'EXPECTED_CREDITS': [0.0, 1.0, 0.0, 1.0, 0.0],
+        'CREDITS_USED': [1.0, 2.0, 1.0, 8.0, 3.0],
+    })
+    summary = summarize_hourly(hourly)
+    assert summary[['WAREHOUSE_NAME', 'ACTUAL_CREDITS']].values.tolist() == [['A', 8.0], ['A', 4.0], ['B', 3.0]]
+    assert summary['WAREHOUSE_SIZE'].tolist()[:2] == ['Large', 'Small']
+    # A warehouse that ran no queries has no size to give its hours.
+    assert summary['WAREHOUSE_SIZE'].isna().tolist() == [False, False, True]
+
+
+def test_metering_points_are_shared_by_the_warehouses():
+    start, end = DAY, DAY + datetime.timedelta(days=30)
+    assert metering_bucket(start, end) == 'HOUR'
+    # 720 hours for each of 10 warehouses is over the budget, 30 days is not.
+    assert metering_bucket(start, end, warehouses=10) == 'DAY'
+    assert metering_bucket(start, end, warehouses=100) == 'WEEK'
+    # Nothing coarser than a week, whatever the budget.
+    assert metering_bucket(start, end, warehouses=10000) == 'WEEK'
+    for warehouses in (1, 3, 10, 50):
+        bucket = metering_bucket(start, end, warehouses)
+        bucket_hours = dict(METERING_BUCKETS)[bucket]
+        assert 30 * 24 / bucket_hours * warehouses <= MAX_METERING_POINTS
+
+
+def test_coarsened_metering_matches_the_sql_buckets():
+    hourly = pd.DataFrame({
+        'START_TIME': pd.to_datetime(['2024-01-06 23:00', '2024-01-07 01:00', '2024-01-08 00:00', '2024-01-08 05:00']),
+        'WAREHOUSE_NAME': ['A', 'A', 'A', 'B'],
+        'CREDITS_USED': [1.0, 2.0, 4.0, 8.0],
+    })
+    daily = coarsen_metering(hourly, 'DAY')
+    assert daily.values.tolist() == [
+        [pd.Timestamp('2024-01-06'), 'A', 1.0],
+        [pd.Timestamp('2024-01-07'), 'A', 2.0],
+        [pd.Timestamp('2024-01-08'), 'A', 4.0],
+        [pd.Timestamp('2024-01-08'), 'B', 8.0],
+    ]
+    # Weeks start on Monday, 2024-01-01 and 2024-01-08.
+    weekly = coarsen_metering(hourly, 'WEEK')
+    assert weekly.values.tolist() == [
+        [pd.Timestamp('2024-01-01'), 'A', 3.0],
+        [pd.Timestamp('2024-01-08'), 'A', 4.0],
+        [pd.Timestamp('2024-01-08'), 'B', 8.0],
+    ]
+
+
+def busy_frame(rows):
+    return pd.DataFrame(rows, columns=['WAREHOUSE_NAME', 'WAREHOUSE_SIZE', 'CLUSTER_NUMBER', 'HOUR', 'BUSY_MS'])
+
+
+def test_true_utilization_counts_busy_time_in_the_billed_hours():
+    # One Small query from 10:00 to 13:00, billed 2 credits an hour.
+    hourly = pd.DataFrame({
+        'HOUR': hours('10:00', '11:00', '12:00'),
+        'WAREHOUSE_NAME': 'WH',
+        'WAREHOUSE_SIZE': 'Small',
+        'NO_OF_QUERIES': [1, 0, 0],
+        'TOTAL_ELAPSED_TIME': [3600000] * 3,
+        'EXPECTED_CREDITS': [2.0] * 3,
+        'CREDITS_USED': [2.0] * 3,
+    })
+    busy = busy_frame([('WH', 'Small', 0, hour, 3600000) for hour in hours('10:00', '11:00', '12:00')])
+    df = add_true_utilization(add_derived_columns(summarize_hourly(hourly)), busy, hourly)
+    assert df['TRUE_UTILIZATION'].tolist() == [1.0]
+
+
+def test_true_utilization_of_a_query_running_into_the_range(local_source):
+    source = local_source({'START_TIME': hours('10:30'), 'END_TIME': hours('12:30')},
+                          {'START_TIME': hours('10:00', '11:00', '12:00'), 'CREDITS_USED': [2.0] * 3})
+    start, end = datetime.datetime(2024, 1, 1, 11), datetime.datetime(2024, 1, 1, 13)
+    hourly = rollup(source, start, end)
+    busy = busy_time(source.iter_batches(busy_intervals_sql(start, end)))
+    df = add_true_utilization(add_derived_columns(summarize_hourly(hourly)), busy, hourly)
+    assert df['UTILIZATION'].tolist() == [0.75]
+    assert df['TRUE_UTILIZATION'].tolist() == [0.75]
+
+
+def test_busy_time_outside_the_rollup_hours_is_ignored():
+    hourly = pd.DataFrame({
+        'HOUR': hours('10:00'),
+        'WAREHOUSE_NAME': 'WH',
+        'WAREHOUSE_SIZE': 'Small',
+        'NO_OF_QUERIES': [1],
+        'TOTAL_ELAPSED_TIME': [1800000],
+        'EXPECTED_CREDITS': [1.0],
+        'CREDITS_USED': [2.0],
+    })
+    busy = busy_frame([('WH', 'Small', 0, hours('10:00')[0], 900000),
+                       ('WH', 'Small', 1, hours('10:00')[0], 900000),
+                       ('WH', 'Small', 0, hours('11:00')[0], 3600000)])
+    df = add_true_utilization(add_derived_columns(summarize_hourly(hourly)), busy, hourly)
+    assert df['TRUE_UTILIZATION'].tolist() == [0.5]
+
+
+def summary_frame(rows):
+    return pd.DataFrame(rows, columns=['WAREHOUSE_NAME', 'WAREHOUSE_SIZE', 'NUM_QUERIES', 'TOTAL_ELAPSED_TIME_MS',
+                                       'EXPECTED_CREDITS', 'ACTUAL_CREDITS'])
+
+
+def test_derived_columns():
+    df = add_derived_columns(summary_frame([
+        ('A', 'Small', 4, 3600000.0, 1.0, 4.0),
+        ('B', 'Large', 0, 0.0, 0.0, 8.0),
+        ('C', None, 2, 1000.0, 0.5, 1.0),
+        ('D', 'Small', 0, 0.0, 0.0, 0.0),
+    ]))
+    # Warehouses that used no credits are dropped.
+    assert df['WAREHOUSE_NAME'].tolist() == ['A', 'B', 'C']
+    assert df['WAREHOUSE_SIZE'].tolist()[:2] == ['Small', 'Large']
+    assert pd.isna(df['WAREHOUSE_SIZE'].iloc[2])
+    assert df['UTILIZATION'].tolist() == pytest.approx([0.25, 0.0, 0.5])
+    assert df['AVG_QUERY_TIME_MS'].iloc[0] == pytest.approx(900000)
+    assert df['AVG_CREDITS_PER_QUERY'].tolist()[::2] == pytest.approx([1.0, 0.5])
+    # No queries and no known size leave the ratios missing, not infinite.
+    assert np.isnan(df['AVG_CREDITS_PER_QUERY'].iloc[1])
+    assert df['WAREHOUSE_CPH'].tolist() == [2, 8, 0]
+    assert df['TOTAL_WH_HRS'].tolist()[:2] == pytest.approx([2.0, 1.0])
+    assert np.isnan(df['TOTAL_WH_HRS'].iloc[2])
+
+
+def test_derived_columns_are_compact():
+    df = add_derived_columns(summary_frame([('A', 'Small', 4, 3600000.0, 1.0, 4.0)]))
+    assert isinstance(df['WAREHOUSE_NAME'].dtype, pd.CategoricalDtype)
+    assert isinstance(df['WAREHOUSE_SIZE'].dtype, pd.CategoricalDtype)
+    for column in ('UTILIZATION', 'AVG_QUERY_TIME_MS', 'AVG_CREDITS_PER_QUERY', 'TOTAL_WH_HRS'):
+        assert df[column].dtype == np.float32
+    assert df['NUM_QUERIES'].dtype == np.uint8
+    assert df['WAREHOUSE_CPH'].dtype == np.uint16
+
+
+def test_time_units_are_added_on_request():
+    df = add_derived_columns(summary_frame([('A', 'Small', 4, 3600000.0, 1.0, 4.0)]))
+    df = with_time_units(df, ['TOTAL_QUERY_HRS', 'AVG_QUERY_TIME_S', 'WAREHOUSE_NAME'])
+    assert df['TOTAL_QUERY_HRS'].tolist() == pytest.approx([1.0])
+    assert df['AVG_QUERY_TIME_S'].tolist() == pytest.approx([900.0])
+    assert 'TOTAL_WH_MIN' not in df
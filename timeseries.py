@@ -0,0 +1,81 @@
+"""Utilization over time per warehouse, kept under a fixed point budget.
+
+The hourly rollup is pre-aggregated once per date range at every level of
+``utilization.METERING_BUCKETS`` (hour, day, week), so zooming only slices
+an existing frame.  The slice keeps the warehouses with the most credits and
+folds the rest into one line, and each line is reduced to the minimum and
+maximum of every pixel bucket so that spikes survive the downsampling.
+"""
+import numpy as np
+import pandas as pd
+
+from utilization import METERING_BUCKETS, as_datetime, metering_bucket, truncate
+
+# Points sent to the browser for the whole chart, whatever the date range.
+MAX_SERIES_POINTS = 2000
+MAX_SERIES = 10
+# A level is used until it has this many times more points than fit the
+# budget, beyond that the next coarser level is downsampled instead.
+MAX_DOWNSAMPLING = 8
+OTHER_WAREHOUSES = 'Other warehouses'
+SERIES_KEY = ['START_TIME', 'WAREHOUSE_NAME']
+
+
+def pre_aggregate(hourly):
+    """Expected and used credits per (bucket, warehouse) for every bucket level."""
+    # CREDITS_USED repeats on every size row of a warehouse-hour.
+    per_hour = hourly.groupby(['HOUR', 'WAREHOUSE_NAME'], as_index=False, sort=False).agg(
+        EXPECTED_CREDITS=('EXPECTED_CREDITS', 'sum'),
+        CREDITS_USED=('CREDITS_USED', 'max'),
+    )
+    times = pd.to_datetime(per_hour['HOUR'])
+    return {
+        bucket: (per_hour.assign(START_TIME=truncate(times, bucket))
+                 .groupby(SERIES_KEY, as_index=False, sort=True)[['EXPECTED_CREDITS', 'CREDITS_USED']].sum())
+        for bucket, _ in METERING_BUCKETS
+    }
+
+
+def utilization_series(levels, start, end, max_points=MAX_SERIES_POINTS, max_series=MAX_SERIES):
+    """``UTILIZATION`` per (bucket, warehouse) over ``[start, end)`` and the bucket used.
+
+    At most ``max_series`` lines and ``max_points`` rows are returned.
+    """
+    start, end = as_datetime(start), as_datetime(end)
+    coarsest = levels[METERING_BUCKETS[-1][0]]
+    names = coarsest['WAREHOUSE_NAME'].nunique()
+    points_per_series = max(2, max_points // max(1, min(names, max_series)))
+    bucket = metering_bucket(start, end, max_points=points_per_series * MAX_DOWNSAMPLING)
+
+    frame = levels[bucket]
+    times = frame['START_TIME']
+    if getattr(times.dt, 'tz', None) is not None:
+        times = times.dt.tz_localize(None)
+    frame = frame[(times >= truncate(pd.Series([start]), bucket)[0]) & (times < end)]
+
+    credits = frame.groupby('WAREHOUSE_NAME')['CREDITS_USED'].sum().sort_values(ascending=False)
+    if len(credits) > max_series:
+        other = ~frame['WAREHOUSE_NAME'].isin(credits.index[:max_series - 1])
+        frame = (frame.assign(WAREHOUSE_NAME=frame['WAREHOUSE_NAME'].where(~other, OTHER_WAREHOUSES))
+                 .groupby(SERIES_KEY, as_index=False, sort=True)[['EXPECTED_CREDITS', 'CREDITS_USED']].sum())
+
+    frame = frame[frame['CREDITS_USED'] > 0]
+    frame = frame.assign(UTILIZATION=frame['EXPECTED_CREDITS'] / frame['CREDITS_USED'])
+    return minmax_downsample(frame, points_per_series, start, end).reset_index(drop=True), bucket
+
+
+def minmax_downsample(frame, max_points, start, end):
+    """Keep the lowest and highest ``UTILIZATION`` of each pixel bucket per warehouse."""
+    if len(frame) == 0 or frame['WAREHOUSE_NAME'].value_counts().max() <= max_points:
+        return frame
+    times = frame['START_TIME']
+    if getattr(times.dt, 'tz', None) is not None:
+        times = times.dt.tz_localize(None)
+    # Two points per pixel bucket.
+    buckets = max_points // 2
+    span = (as_datetime(end) - as_datetime(start)).total_seconds()
+    offset = (times - as_datetime(start)).dt.total_seconds().to_numpy()
+    pixel = np.clip((offset / span * buckets).astype(np.int64), 0, buckets - 1)
+    grouped = frame['UTILIZATION'].groupby([frame['WAREHOUSE_NAME'].to_numpy(), pixel])
+    keep = np.union1d(grouped.idxmin().to_numpy(), grouped.idxmax().to_numpy())
+    return frame.loc[keep]
@@ -0,0 +1,392 @@
+"""Queries and transforms behind the Warehouse Utilization dashboard.
+
+Nothing in here imports Streamlit so it can be reused outside of the app.
+"""
+import datetime
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+# Credits billed per hour for each warehouse size.
+# https://docs.snowflake.com/en/user-guide/warehouses-overview.html#warehouse-size
+CREDITS_PER_HOUR = {
+    'X-Small': 1,
+    'Small': 2,
+    'Medium': 4,
+    'Large': 8,
+    'X-Large': 16,
+    '2X-Large': 32,
+    '3X-Large': 64,
+    '4X-Large': 128,
+    '5X-Large': 256,
+    '6X-Large': 512,
+}
+
+_SIZE_CASE = "CASE WAREHOUSE_SIZE\n" + "\n".join(
+    f"                        WHEN '{size}' THEN {credits}"
+    for size, credits in CREDITS_PER_HOUR.items()
+) + "\n                        ELSE 0\n                    END"
+
+# SQL text with ``?`` placeholders and the values bound to them.  Binding the
+# dates keeps the text identical between date ranges, so Snowflake can reuse
+# query results and compiled plans.
+Query = namedtuple('Query', ['text', 'params'])
+
+HOURLY_KEY = ['HOUR', 'WAREHOUSE_NAME', 'WAREHOUSE_SIZE']
+# How partial hourly rollups for the same key combine.
+HOURLY_AGGREGATIONS = {
+    'NO_OF_QUERIES': 'sum',
+    'TOTAL_ELAPSED_TIME': 'sum',
+    'EXPECTED_CREDITS': 'sum',
+    'CREDITS_USED': 'max',
+}
+
+
+# Snowflake's default STATEMENT_TIMEOUT_IN_SECONDS.  Queries are looked up this
+# far before the range they ran in, and an hour is only final once every
+# query that may have run in it has finished.  Accounts that allow longer
+# queries should raise this.
+MAX_QUERY_DURATION = datetime.timedelta(hours=48)
+MAX_QUERY_HOURS = int(MAX_QUERY_DURATION / datetime.timedelta(hours=1))
+
+
+def as_datetime(value):
+    if isinstance(value, datetime.datetime):
+        return value
+    return datetime.datetime(value.year, value.month, value.day)
+
+
+def floor_hour(value):
+    return as_datetime(value).replace(minute=0, second=0, microsecond=0)
+
+
+def hourly_utilization_sql(start, end):
+    """Per (hour, warehouse, size) rollup of the hours in ``[start, end)``.
+
+    A query's elapsed time is split over the hours it ran in, in proportion
+    to how much of its run fell into each, so a query running from 10:30 to
+    12:30 adds a quarter to 10:00, half to 11:00 and a quarter to 12:00.  It
+    is counted in ``NO_OF_QUERIES`` of the hour it started in.  Most queries
+    start and end in the same hour, only the others are joined to an hour
+    spine.  Queries are found by a range predicate on ``START_TIME`` reaching
+    back ``MAX_QUERY_DURATION`` before ``start``, so they can still be pruned.
+
+    Both views are aggregated per (warehouse, hour) before they are joined,
+    and the join is a full outer join so that billed hours in which no query
+    ran keep their credits, with a NULL ``WAREHOUSE_SIZE``.  ``CREDITS_USED``
+    is the warehouse-hour's credits on each of its size rows.
+    """
+    start, end = as_datetime(start), as_datetime(end)
+    return Query(f"""WITH RECURSIVE N (HOURS_AFTER) AS (
+                SELECT 0
+                UNION ALL
+                SELECT HOURS_AFTER + 1 FROM N WHERE HOURS_AFTER < {MAX_QUERY_HOURS}
+            ), Q AS (
+                SELECT
+                    DATE_TRUNC('HOUR', START_TIME) AS FIRST_HOUR,
+                    WAREHOUSE_ID,
+                    WAREHOUSE_NAME,
+                    WAREHOUSE_SIZE,
+                    START_TIME,
+                    END_TIME,
+                    TOTAL_ELAPSED_TIME
+                FROM QUERY_HISTORY
+                WHERE WAREHOUSE_SIZE IS NOT NULL
+                    AND START_TIME >= ?
+                    AND START_TIME < ?
+                    AND END_TIME > ?
+            ), S AS (
+                SELECT
+                    FIRST_HOUR AS HOUR,
+                    WAREHOUSE_ID,
+                    WAREHOUSE_NAME,
+                    WAREHOUSE_SIZE,
+                    1 AS STARTED,
+                    TOTAL_ELAPSED_TIME AS ELAPSED
+                FROM Q
+                WHERE END_TIME <= DATEADD('HOUR', 1, FIRST_HOUR)
+                UNION ALL
+                SELECT
+                    HOUR,
+                    WAREHOUSE_ID,
+                    WAREHOUSE_NAME,
+                    WAREHOUSE_SIZE,
+                    CASE WHEN HOUR = FIRST_HOUR THEN 1 ELSE 0 END AS STARTED,
+                    TOTAL_ELAPSED_TIME
+                        * DATEDIFF('MILLISECOND', GREATEST(START_TIME, HOUR), LEAST(END_TIME, DATEADD('HOUR', 1, HOUR)))
+                        / DATEDIFF('MILLISECOND', START_TIME, END_TIME) AS ELAPSED
+                FROM (
+                    SELECT Q.*, DATEADD('HOUR', N.HOURS_AFTER, Q.FIRST_HOUR) AS HOUR
+                    FROM Q
+                    JOIN N ON N.HOURS_AFTER <= DATEDIFF('HOUR', Q.FIRST_HOUR, Q.END_TIME)
+                    WHERE Q.END_TIME > DATEADD('HOUR', 1, Q.FIRST_HOUR)
+                )
+                WHERE HOUR < END_TIME
+            ), U AS (
+                SELECT
+                    HOUR,
+                    WAREHOUSE_ID,
+                    WAREHOUSE_NAME,
+                    WAREHOUSE_SIZE,
+                    SUM(STARTED) AS NO_OF_QUERIES,
+                    SUM(ELAPSED) AS TOTAL_ELAPSED_TIME,
+                    SUM(
+                        ELAPSED / 1000 / 60 / 60 *
+                        {_SIZE_CASE}
+                    ) AS EXPECTED_CREDITS
+                FROM S
+                WHERE HOUR >= ?
+                    AND HOUR < ?
+                GROUP BY 1,2,3,4
+            ), M AS (
+                SELECT
+                    WAREHOUSE_ID,
+                    MAX(WAREHOUSE_NAME) AS WAREHOUSE_NAME,
+                    START_TIME AS HOUR,
+                    MAX(CREDITS_USED) AS CREDITS_USED
+                FROM WAREHOUSE_METERING_HISTORY
+                WHERE START_TIME >= ?
+                    AND START_TIME < ?
+                GROUP BY 1,3
+            )
+            SELECT
+                COALESCE(U.HOUR, M.HOUR) AS HOUR,
+                COALESCE(U.WAREHOUSE_NAME, M.WAREHOUSE_NAME) AS WAREHOUSE_NAME,
+                U.WAREHOUSE_SIZE,
+                SUM(COALESCE(U.NO_OF_QUERIES, 0)) AS NO_OF_QUERIES,
+                SUM(COALESCE(U.TOTAL_ELAPSED_TIME, 0)) AS TOTAL_ELAPSED_TIME,
+                SUM(COALESCE(U.EXPECTED_CREDITS, 0)) AS EXPECTED_CREDITS,
+                MAX(M.CREDITS_USED) AS CREDITS_USED
+            FROM U
+            FULL OUTER JOIN M ON M.WAREHOUSE_ID = U.WAREHOUSE_ID AND M.HOUR = U.HOUR
+            GROUP BY 1,2,3
+        """, (str(start - MAX_QUERY_DURATION), str(end), str(start), str(start), str(end), str(start), str(end)))
+
+
+def legacy_hourly_utilization_sql(start, end):
+    """The original per-row join, kept to time ``hourly_utilization_sql`` against.
+
+    It attributes each query to the hour it started in and drops billed hours
+    in which no query started, so its results differ.
+    """
+    return Query(f"""SELECT
+                TO_VARCHAR(Q.START_TIME, 'YYYY-MM-DD HH:00:00')::TIMESTAMP AS HOUR,
+                Q.WAREHOUSE_NAME,
+                Q.WAREHOUSE_SIZE,
+                COUNT(*) AS NO_OF_QUERIES,
+                SUM(TOTAL_ELAPSED_TIME) AS TOTAL_ELAPSED_TIME,
+                SUM(
+                    TOTAL_ELAPSED_TIME / 1000 / 60 / 60 *
+                    {_SIZE_CASE}
+                ) AS EXPECTED_CREDITS,
+                MAX(CREDITS_USED) AS CREDITS_USED
+            FROM QUERY_HISTORY Q
+            LEFT JOIN WAREHOUSE_METERING_HISTORY M ON M.WAREHOUSE_ID = Q.WAREHOUSE_ID AND TO_VARCHAR(Q.START_TIME, 'YYYY-MM-DD HH:00:00')::TIMESTAMP=M.START_TIME
+            WHERE 1=1
+                AND WAREHOUSE_SIZE IS NOT NULL
+                AND Q.START_TIME >= ?
+                AND Q.START_TIME < ?
+            GROUP BY 1,2,3
+        """, (str(as_datetime(start)), str(as_datetime(end))))
+
+
+def with_idle_hour_sizes(hourly):
+    """Give billed hours without queries the size the warehouse last ran queries at.
+
+    Hours before the warehouse's first query get the size of that query;
+    warehouses without any query in the rollup keep a missing size.
+    """
+    idle = hourly['WAREHOUSE_SIZE'].isna()
+    if not idle.any():
+        return hourly
+    ordered = hourly.sort_values(['WAREHOUSE_NAME', 'HOUR'], kind='stable')
+    sizes = ordered.groupby('WAREHOUSE_NAME', sort=False)['WAREHOUSE_SIZE'].ffill()
+    sizes = sizes.groupby(ordered['WAREHOUSE_NAME'], sort=False).bfill()
+    return hourly.assign(WAREHOUSE_SIZE=sizes.reindex(hourly.index))
+
+
+def summarize_hourly(hourly):
+    """Collapse the hourly rollup to one row per (warehouse, size)."""
+    return with_idle_hour_sizes(hourly).groupby(
+        ['WAREHOUSE_NAME', 'WAREHOUSE_SIZE'], as_index=False, sort=True, dropna=False).agg(
+        NUM_QUERIES=('NO_OF_QUERIES', 'sum'),
+        TOTAL_ELAPSED_TIME_MS=('TOTAL_ELAPSED_TIME', 'sum'),
+        EXPECTED_CREDITS=('EXPECTED_CREDITS', 'sum'),
+        ACTUAL_CREDITS=('CREDITS_USED', 'sum'),
+    )
+
+
+# Time buckets for the metering chart, finest first, with their length in hours.
+METERING_BUCKETS = [('HOUR', 1), ('DAY', 24), ('WEEK', 24 * 7)]
+# Most (bucket, warehouse) points shown by the metering chart, shared by
+# all warehouses like ``timeseries.MAX_SERIES_POINTS``.
+MAX_METERING_POINTS = 2000
+METERING_KEY = ['START_TIME', 'WAREHOUSE_NAME']
+METERING_AGGREGATIONS = {'CREDITS_USED': 'sum'}
+
+
+def metering_bucket(start, end, warehouses=1, max_points=MAX_METERING_POINTS):
+    """The finest bucket that keeps ``[start, end]`` within ``max_points`` points.
+
+    The points are shared by ``warehouses`` warehouses.
+    """
+    hours = (as_datetime(end) - as_datetime(start)).total_seconds() / 3600
+    points_per_warehouse = max(1, max_points // max(1, warehouses))
+    for bucket, bucket_hours in METERING_BUCKETS:
+        if hours / bucket_hours <= points_per_warehouse:
+            return bucket
+    return METERING_BUCKETS[-1][0]
+
+
+def truncate(times, bucket):
+    """``times`` truncated to ``bucket`` like DATE_TRUNC in Snowflake, where weeks start on Monday."""
+    if bucket == 'HOUR':
+        return times.dt.floor('h')
+    days = times.dt.floor('D')
+    if bucket == 'DAY':
+        return days
+    return days - pd.to_timedelta(days.dt.dayofweek, unit='D')
+
+
+def coarsen_metering(wh_metering, bucket):
+    """Re-aggregate a ``metering_sql`` result to a coarser ``bucket``."""
+    return (wh_metering.assign(START_TIME=truncate(wh_metering['START_TIME'], bucket))
+            .groupby(METERING_KEY, as_index=False, sort=True).agg(METERING_AGGREGATIONS))
+
+
+def metering_sql(start, end, bucket='HOUR'):
+    """Credits per (bucket, warehouse) for metering hours starting in ``[start, end)``."""
+    return Query(f"""SELECT
+            DATE_TRUNC('{bucket}', START_TIME) AS START_TIME,
+            WAREHOUSE_NAME,
+            SUM(CREDITS_USED) AS CREDITS_USED
+        FROM WAREHOUSE_METERING_HISTORY
+        WHERE START_TIME >= ? AND START_TIME < ?
+        GROUP BY 1,2
+        ORDER BY 1,2
+        """, (str(as_datetime(start)), str(as_datetime(end))))
+
+
+# Time columns that are only a unit conversion of a stored column, as
+# (source column, factor).  They are added on demand by ``with_time_units``.
+TIME_UNIT_COLUMNS = {
+    'TOTAL_QUERY_S': ('TOTAL_ELAPSED_TIME_MS', 1 / 1000),
+    'TOTAL_QUERY_MIN': ('TOTAL_ELAPSED_TIME_MS', 1 / 1000 / 60),
+    'TOTAL_QUERY_HRS': ('TOTAL_ELAPSED_TIME_MS', 1 / 1000 / 60 / 60),
+    'AVG_QUERY_TIME_S': ('AVG_QUERY_TIME_MS', 1 / 1000),
+    'TOTAL_WH_MIN': ('TOTAL_WH_HRS', 60),
+    'TOTAL_WH_S': ('TOTAL_WH_HRS', 60 * 60),
+}
+
+
+def _categorical(values):
+    # Categories in order of appearance, which skips the sort pd.Categorical
+    # does; the rows from summarize_hourly are already sorted.
+    codes, categories = pd.factorize(values)
+    return pd.Categorical.from_codes(codes, categories)
+
+
+def add_derived_columns(df):
+    """Per warehouse metrics from ``summarize_hourly``, built in one pass.
+
+    Names and sizes are categorical and derived ratios are float32, which
+    map straight onto compact Arrow dictionary and float columns when the
+    frame is sent to the browser.  Unit conversions of the time columns are
+    left to ``with_time_units``.
+    """
+    actual = df['ACTUAL_CREDITS'].fillna(0).to_numpy(dtype=np.float64)
+    keep = actual != 0
+    actual = actual[keep]
+    expected = df['EXPECTED_CREDITS'].fillna(0).to_numpy(dtype=np.float64)[keep]
+    num_queries = df['NUM_QUERIES'].fillna(0).to_numpy(dtype=np.int64)[keep]
+    elapsed_ms = df['TOTAL_ELAPSED_TIME_MS'].fillna(0).to_numpy(dtype=np.float64)[keep]
+    sizes = _categorical(df['WAREHOUSE_SIZE'][keep])
+    # Only the few distinct sizes are looked up; unknown and missing sizes
+    # (code -1, the appended last entry) get 0 and no warehouse hours.
+    cph = np.array([CREDITS_PER_HOUR.get(size, 0) for size in sizes.categories] + [0],
+                   dtype=np.uint16)[sizes.codes]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return pd.DataFrame({
+            'WAREHOUSE_NAME': _categorical(df['WAREHOUSE_NAME'][keep]),
+            'WAREHOUSE_SIZE': sizes,
+            'NUM_QUERIES': pd.to_numeric(num_queries, downcast='unsigned'),
+            'TOTAL_ELAPSED_TIME_MS': elapsed_ms,
+            'EXPECTED_CREDITS': expected,
+            'ACTUAL_CREDITS': actual,
+            'UTILIZATION': (expected / actual).astype(np.float32),
+            'AVG_QUERY_TIME_MS': (elapsed_ms / num_queries).astype(np.float32),
+            'AVG_CREDITS_PER_QUERY': (actual / np.where(num_queries > 0, num_queries, np.nan)).astype(np.float32),
+            'WAREHOUSE_CPH': cph,
+            'TOTAL_WH_HRS': (actual / np.where(cph > 0, cph, np.nan)).astype(np.float32),
+        })
+
+
+def with_time_units(df, columns):
+    """Add whichever of ``TIME_UNIT_COLUMNS`` are in ``columns`` and missing from ``df``."""
+    return df.assign(**{
+        column: (df[source] * factor).astype(np.float32)
+        for column, (source, factor) in TIME_UNIT_COLUMNS.items()
+        if column in columns and column not in df
+    })
+
+
+TABLE_COLUMNS = [
+    'WAREHOUSE_NAME',
+    'WAREHOUSE_SIZE',
+    'NUM_QUERIES',
+    'TOTAL_QUERY_HRS',
+    'TOTAL_WH_HRS',
+    'AVG_CREDITS_PER_QUERY',
+    'AVG_QUERY_TIME_S',
+    'EXPECTED_CREDITS',
+    'ACTUAL_CREDITS',
+    'UTILIZATION',
+    'TRUE_UTILIZATION',
+]
+
+TABLE_FORMAT = {
+    'NUM_QUERIES': '{:,.0f}',
+    'EXPECTED_CREDITS': '{:,.2f}',
+    'UTILIZATION': '{:,.0%}',
+    'TRUE_UTILIZATION': '{:,.0%}',
+    'TOTAL_QUERY_HRS': '{:,.2f}',
+    'TOTAL_WH_HRS': '{:,.2f}',
+    'ACTUAL_CREDITS': '{:,.2f}',
+    'AVG_QUERY_TIME_S': '{:,.3f}',
+    'AVG_CREDITS_PER_QUERY': '{:,.2f}',
+}
+
+
+def add_true_utilization(df, busy=None, hourly=None):
+    """Add utilization based on the union of busy time from ``busy_time.busy_time``.
+
+    Busy time is only counted in the (hour, warehouse, size) rows of the
+    ``hourly`` rollup that ``df`` was summarized from, so it is measured
+    against the credits of the same hours.  Without ``busy`` the columns are
+    not added.
+    """
+    if busy is None:
+        return df
+    # The repeated wall clock hour at the end of daylight saving time is
+    # one busy time hour but two rollup rows.
+    hours = hourly[HOURLY_KEY].drop_duplicates()
+    busy = busy.assign(HOUR=pd.to_datetime(busy['HOUR'])).groupby(HOURLY_KEY, as_index=False)['BUSY_MS'].sum()
+    busy = busy.merge(hours.assign(HOUR=pd.to_datetime(hours['HOUR'])), on=HOURLY_KEY)
+    busy_ms = busy.groupby(['WAREHOUSE_NAME', 'WAREHOUSE_SIZE'])['BUSY_MS'].sum().rename('BUSY_MS')
+    df = df.join(busy_ms, on=['WAREHOUSE_NAME', 'WAREHOUSE_SIZE'])
+    df["TRUE_EXPECTED_CREDITS"] = (df["BUSY_MS"].fillna(0)/1000/60/60 * df["WAREHOUSE_CPH"]).astype(np.float32)
+    df["TRUE_UTILIZATION"] = (df["TRUE_EXPECTED_CREDITS"] / df['ACTUAL_CREDITS']).astype(np.float32)
+    return df.drop(columns=['BUSY_MS'])
+
+
+def table_columns(df):
+    """``TABLE_COLUMNS`` that ``df`` has or can derive; TRUE_UTILIZATION is optional."""
+    return [column for column in TABLE_COLUMNS if column in df or column in TIME_UNIT_COLUMNS]
+
+
+def warehouse_table(df):
+    """The columns of the warehouse table, most utilized warehouse first."""
+    columns = table_columns(df)
+    return with_time_units(df, columns)[columns].sort_values(by=['UTILIZATION'], ascending=False)